@@ -1,32 +1,19 @@
-def main():
+from semmatch.timing import timed
+
+
+def _roiArg(text):
     import argparse
-    import sys
 
-    import imageio
+    from semmatch.roi import parseRoi
 
-    from semmatch.core import (
-        Pt,
-        NavOptions,
-        templateMatch,
-        imresize,
-        houghCircles,
-        laceySearch,
-    )
-    from semmatch.autodoc import ptsToNavPts, createAutodoc, openNavfile
-    from semmatch.groups import getRandPts
+    try:
+        return parseRoi(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-    parser = argparse.ArgumentParser(description="template matching tool for SerialEM")
-    # required
-    parser.add_argument("--navfile", help="SerialEM nav file", required=True)
-    parser.add_argument("--image", help="jpg", required=True)
-    parser.add_argument("--mapLabel", help="label id", required=True)
-    parser.add_argument(
-        "--newLabel", help="starting label of added points", type=int, required=True
-    )
-    parser.add_argument("-o", "--output", help="output nav file", required=True)
 
-    # optional
-    parser.add_argument("--gui", help="interactive gui mode", action="store_true")
+def addSearchArgs(parser):
+    """Options choosing and tuning the detection method."""
     parser.add_argument(
         "--template", help="template image to use; required in non-gui mode"
     )
@@ -36,7 +23,6 @@ def main():
     parser.add_argument(
         "--param2", help="threshold for houghCircles", type=int, default=60
     )
-    parser.add_argument("--pixelSize", help="pixelSize in nm", type=float, required=True)
     parser.add_argument(
         "--laceySearch", help="automatic detection for lacey grid", action="store_true"
     )
@@ -57,6 +43,31 @@ def main():
         help="limit number of pts found via houghCircles or laceySearch",
         type=int,
     )
+    parser.add_argument(
+        "--threshold", help="threshold value for zncc", type=float, default=0.8
+    )
+    parser.add_argument(
+        "--reduction", help="external reduction factor", type=float, default=1.0
+    )
+    parser.add_argument("--noBlurImage", help="", action="store_true")
+    parser.add_argument("--noBlurTemplate", help="", action="store_true")
+    parser.add_argument(
+        "--roi",
+        help="only search this region of the map: X0,Y0,X1,Y1 for a rectangle or"
+        " X,Y of each vertex for a polygon, in map pixels with (0,0) at the"
+        " bottom-left corner like CoordsInMap; repeat for more regions",
+        type=_roiArg,
+        action="append",
+    )
+
+
+def addNavArgs(parser):
+    """Options for turning points into navigator items and writing them."""
+    parser.add_argument("-o", "--output", help="output nav file")
+    parser.add_argument(
+        "--appendTo",
+        help="append new points directly to the end of this nav file",
+    )
     parser.add_argument(
         "--groupOption",
         help="grouping option for points;"
@@ -68,12 +79,6 @@ def main():
         type=int,
         default=0,
     )
-    parser.add_argument(
-        "--threshold", help="threshold value for zncc", type=float, default=0.8
-    )
-    parser.add_argument(
-        "--reduction", help="external reduction factor", type=float, default=1.0
-    )
     parser.add_argument(
         "--acquire", help="mark points with acquire flag", type=int, default=1
     )
@@ -89,10 +94,252 @@ def main():
     parser.add_argument(
         "--ptsPerGroup", help="specify number of points per group", type=int, default=8
     )
-    parser.add_argument("--noBlurImage", help="", action="store_true")
-    parser.add_argument("--noBlurTemplate", help="", action="store_true")
+    parser.add_argument(
+        "--skipExisting",
+        help="drop new points within this radius in µm of items already in the navigator",
+        type=float,
+        metavar="RADIUS",
+    )
+    parser.add_argument(
+        "--skipExistingScope",
+        help="compare against items drawn on the same map (default) or all items",
+        choices=["map", "all"],
+        default="map",
+    )
+    parser.add_argument(
+        "--stageCoords",
+        help="write points as stage coordinate items instead of map coordinates",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--sidecar",
+        help="also write map and stage coordinates of the points to a .csv or .npy file",
+    )
+
+
+def addProfileArgs(parser):
+    """Options recording where the time of a run goes."""
+    parser.add_argument(
+        "--profile",
+        help="write the seconds spent in each stage of the run to this JSON file",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--traceMemory",
+        help="with --profile, also trace the memory each stage allocates;"
+        " slows pure Python stages such as reading the navigator",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cprofile",
+        help="write cProfile statistics of the run to this file, for pstats",
+        metavar="FILE",
+    )
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    from semmatch.autodoc import createAutodoc
+
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["batch"]:
+        import semmatch.batch
+
+        return semmatch.batch.main(argv[1:])
+    if argv[:1] == ["review"]:
+        import semmatch.review
+
+        return semmatch.review.main(argv[1:])
+    if argv[:1] == ["watch"]:
+        import semmatch.watch
 
-    args = parser.parse_args()
+        return semmatch.watch.main(argv[1:])
+    if argv[:1] == ["serve"]:
+        import semmatch.server
+
+        return semmatch.server.main(argv[1:])
+    if "--client" in argv:
+        import semmatch.server
+
+        argv = [arg for arg in argv if arg != "--client"]
+        sys.exit(semmatch.server.client(argv))
+
+    parser = argparse.ArgumentParser(description="template matching tool for SerialEM")
+    # required
+    parser.add_argument("--navfile", help="SerialEM nav file", required=True)
+    parser.add_argument("--mapLabel", help="label id", required=True)
+    parser.add_argument(
+        "--newLabel", help="starting label of added points", type=int, required=True
+    )
+    parser.add_argument("--pixelSize", help="pixelSize in nm", type=float, required=True)
+
+    # optional
+    parser.add_argument(
+        "--image",
+        help="jpg, or MRC file (.mrc, .st) holding the map; default the map's MapFile",
+    )
+    parser.add_argument("--gui", help="interactive gui mode", action="store_true")
+    parser.add_argument(
+        "--pieces",
+        help="search a montage MRC map piece by piece in parallel",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pieceBand",
+        help="pixels of neighbouring pieces searched around each piece;"
+        " default from the template or hole size",
+        type=int,
+    )
+    parser.add_argument(
+        "--workers", help="number of worker processes for --pieces", type=int
+    )
+    parser.add_argument(
+        "--maxMemory",
+        help="GB a search of the whole map may need, estimated before reading it;"
+        " larger montage MRC maps are searched piece by piece and others refused;"
+        " default the memory available, 0 for no limit",
+        type=float,
+    )
+    addSearchArgs(parser)
+    addNavArgs(parser)
+    addProfileArgs(parser)
+
+    args = parser.parse_args(argv)
+    if args.output is None and args.appendTo is None:
+        parser.error("one of --output or --appendTo is required")
+
+    from semmatch.timing import profiledRun
+
+    # clear output file to prevent merging previous points, however the run
+    # ends
+    if args.output is not None:
+        createAutodoc(args.output, [])
+    with profiledRun(
+        args.profile, args.cprofile, args.traceMemory, mapLabel=args.mapLabel
+    ):
+        run(args)
+
+
+@timed
+def readTemplate(template, reduction):
+    """Read and downsize the template image; None if it can't be read."""
+    import imageio
+
+    from semmatch.core import imresize
+
+    try:
+        return imresize(imageio.imread(template), 1 / reduction)
+    except Exception as e:
+        print(e)
+        print("error reading in template %s; continuing without template" % template)
+        return None
+
+
+def memoryShortfall(imagefile, mapItem, template, args):
+    """Why searching the whole of imagefile won't fit in --maxMemory or, by
+    default, the memory available, by estimate; None if it will."""
+    from semmatch.memory import availableMemory, estimateMemory, formatBytes
+
+    if args.maxMemory == 0:
+        return None
+    try:
+        needed = estimateMemory(imagefile, mapItem, template, args.pixelSize, args)
+    except (OSError, ValueError):
+        # left for reading the image to report
+        return None
+    if args.maxMemory is None:
+        limit = availableMemory()
+    else:
+        limit = args.maxMemory * 2**30
+    if limit is None or needed <= limit:
+        return None
+    return "searching %s needs about %s of memory but %s is available" % (
+        imagefile,
+        formatBytes(needed),
+        formatBytes(limit),
+    )
+
+
+@timed
+def findPts(image, template, pixelSize, args):
+    """Run the non-gui detection method selected in args on image.
+
+    image can also be an ImagePyramid of it. Each method searches the pyramid
+    level that suits it, and the points are returned in image pixels. Only
+    the region given by args.roi, if any, is searched.
+    """
+    from semmatch.core import templateMatch, houghCircles, laceySearch
+    from semmatch.groups import getRandPts
+    from semmatch.roi import Roi
+    from semmatch.pyramid import (
+        ImagePyramid,
+        templateLevel,
+        houghLevel,
+        laceyLevel,
+        toBase,
+    )
+
+    pyramid = image if isinstance(image, ImagePyramid) else ImagePyramid(image)
+    roi = getattr(args, "roi", None)
+    roi = Roi(roi) if roi else None
+
+    def levelRoi(k):
+        return roi.binned(2**k) if roi is not None else None
+
+    if args.houghCircles:
+        k = houghLevel(pixelSize)
+        pts = houghCircles(
+            pyramid.level(k), pixelSize * 2**k, param2=args.param2, roi=levelRoi(k)
+        )
+        if args.maxPts is not None:
+            pts = getRandPts(pts, args.maxPts)
+    elif args.laceySearch:
+        k = laceyLevel(pyramid.mapWidth)
+        maxPts = 999 if args.maxPts is None else args.maxPts
+        pts = laceySearch(
+            pyramid.level(k),
+            maxPts,
+            args.laceyThreshLow,
+            args.laceyThreshHigh,
+            roi=levelRoi(k),
+        )
+    else:
+        k = templateLevel(template)
+        pts = templateMatch(
+            pyramid.level(k),
+            ImagePyramid(template).level(k),
+            args.threshold,
+            blurImage=not args.noBlurImage,
+            blurTemplate=not args.noBlurTemplate,
+            sigma=10 / 2**k,
+            roi=levelRoi(k),
+        )
+    return toBase(pts, 2**k)
+
+
+def run(args):
+    from semmatch.core import NavOptions
+    from semmatch.autodoc import (
+        ptsToNavPts,
+        createAutodoc,
+        openNavfile,
+        appendToNavfile,
+    )
+    from semmatch.coords import (
+        NavPtsIndex,
+        loadedMapScale,
+        skipExistingPts,
+        navPtsToStage,
+        setStageCoords,
+        writeSidecar,
+    )
+    from semmatch.mrc import findMapFile, isMrcFile, readImage
+    from semmatch.montage import findPtsInPieces
+    from semmatch.pyramid import toBase
+    from semmatch.roi import Roi
 
     navfile = args.navfile
     image = args.image
@@ -113,13 +360,6 @@ def main():
     options = NavOptions(
         groupOption, groupRadius, pixelSize, numGroups, ptsPerGroup, acquire
     )
-    param2 = args.param2
-    laceyThreshLow = args.laceyThreshLow
-    laceyThreshHigh = args.laceyThreshHigh
-    maxPts = args.maxPts
-
-    # clear output file to prevent merging previous points
-    createAutodoc(output, [])
 
     # unnecessary options messages
     if groupOption != 1:
@@ -151,28 +391,71 @@ def main():
         )
         exit()
 
-    # read and downsize images if necessary
-    image = imageio.imread(image)
+    if image is None:
+        image = findMapFile(nav[mapLabel], navfile)
+        if image is None:
+            print(
+                "could not find the MapFile of %s; aborting (use --image to give"
+                " the map image)" % mapLabel
+            )
+            exit()
+
+    if isMrcFile(image) and reduction != 1:
+        print("MRC files are read unreduced; ignoring --reduction")
+        reduction = 1.0
+    if args.roi and reduction != 1:
+        # the points are scaled back up by toBase below
+        args.roi = Roi(args.roi).binned(reduction).polygons
+
     if template is not None:
-        try:
-            template = imageio.imread(template)
-            template = imresize(template, 1 / (reduction))
-        except Exception as e:
-            print(e)
+        template = readTemplate(template, reduction)
+    if template is None and not (args.gui or args.houghCircles or args.laceySearch):
+        print("non-gui option must specify template")
+        exit()
+
+    montage = isMrcFile(image) and nav[mapLabel].get("MapMontage", "0") != "0"
+    pieces = args.pieces and not args.gui and montage
+    if args.pieces and not pieces:
+        print(
+            "--pieces only works for montage maps read from their MRC file"
+            " without --gui; searching the whole map"
+        )
+    shortfall = None
+    if not pieces:
+        shortfall = memoryShortfall(image, nav[mapLabel], template, args)
+    if shortfall is not None:
+        if not montage or args.gui:
             print(
-                "error reading in template %s; continuing without template" % template
+                "%s; aborting (search part of the map with --roi, or raise"
+                " --maxMemory)" % shortfall
             )
-            template = None
+            exit()
+        print("%s; searching it piece by piece" % shortfall)
+        pieces = True
+
+    if pieces:
+        print("searching %s piece by piece" % image)
+
+        def search():
+            return findPtsInPieces(
+                image, nav[mapLabel], template, pixelSize, args, args.workers
+            )
+
+    else:
+        try:
+            image = readImage(image, nav[mapLabel])
+        except ValueError as e:
+            print("%s; aborting" % e)
+            exit()
+
+        def search():
+            return findPts(image, template, pixelSize, args), image.shape[1]
 
     if args.houghCircles == True:
         print("using hough circles")
-        pts = houghCircles(image, pixelSize, param2=param2)
-        if maxPts is not None:
-            pts = getRandPts(pts, maxPts)
+        pts, width = search()
     elif args.laceySearch == True:
-        if maxPts == None:
-            maxPts = 999
-        pts = laceySearch(image, maxPts, laceyThreshLow, laceyThreshHigh)
+        pts, width = search()
     elif args.gui == True:
         print("using template matching gui")
         import semmatch.gui
@@ -184,6 +467,7 @@ def main():
             options,
             blurImage=blurImage,
             blurTemplate=blurTemplate,
+            roi=args.roi,
         )
         if options.groupRadius is None:
             print("invalid group radius; aborting")
@@ -191,25 +475,62 @@ def main():
         if options.pixelSize is None:
             print("invalid pixel size; aborting")
             exit()
+        width = image.shape[1]
     else:
         print("using template matching non gui")
-        if template is None:
-            print("non-gui option must specify template")
+        pts, width = search()
+
+    # back to the pixels of the map as loaded in SerialEM
+    pts = toBase(pts, reduction)
+
+    if "MapScaleMat" in nav[mapLabel] and "MapWidthHeight" in nav[mapLabel]:
+        scale = loadedMapScale(nav[mapLabel], width * reduction)
+    else:
+        scale = None
+        if args.skipExisting is not None or args.stageCoords or args.sidecar:
+            print(
+                "MapScaleMat and/or MapWidthHeight missing in section labeled %s;"
+                " can't convert to stage coordinates; aborting" % mapLabel
+            )
             exit()
-        pts = templateMatch(
-            image, template, threshold, blurImage=blurImage, blurTemplate=blurTemplate
-        )
 
-    # compensate round off error from reduction
-    pts = [Pt(x + 2, y) for x, y in pts]
-    pts = [Pt(int(reduction * x), int(reduction * y)) for x, y in pts]
+    if args.skipExisting is not None and len(pts) > 0:
+        numPts = len(pts)
+        pts = skipExistingPts(
+            pts,
+            nav[mapLabel],
+            NavPtsIndex(nav),
+            scale,
+            args.skipExisting,
+            sameMapOnly=args.skipExistingScope == "map",
+        )
+        print("skipped %d points already in the navigator" % (numPts - len(pts)))
 
     if len(pts) == 0:
-        print("no matches found; exiting without creating %s" % output)
-        exit()
+        if args.appendTo is not None:
+            print("no matches found; %s left unchanged" % args.appendTo)
+        else:
+            print("no matches found; %s will be empty" % output)
+        return
     navPts = ptsToNavPts(pts, nav, mapLabel, newLabel, options)
-    createAutodoc(output, navPts)
-    print("%s created" % output)
+    if args.stageCoords or args.sidecar:
+        stagePts = navPtsToStage(navPts, nav[mapLabel], scale)
+        if args.sidecar:
+            writeSidecar(args.sidecar, navPts, stagePts)
+            print("%s created" % args.sidecar)
+        if args.stageCoords:
+            setStageCoords(navPts, stagePts)
+    if args.appendTo is not None:
+        try:
+            appendToNavfile(args.appendTo, navPts)
+        except (ValueError, OSError) as e:
+            print(e)
+            print("%s left unchanged; aborting" % args.appendTo)
+            exit()
+        print("%d points appended to %s" % (len(navPts), args.appendTo))
+    if output is not None:
+        createAutodoc(output, navPts)
+        print("%s created" % output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+"""In-process API for SerialEM's embedded Python.
+
+SerialEM can hand its image buffers to Python scripts as NumPy arrays. These
+functions search such an array directly and build navigator items from the
+result, so there is no JPEG export, no semmatch process and no nav file to
+merge. Nothing here imports Qt or touches the filesystem.
+
+    import numpy as np, serialem, semmatch.api
+    image = np.asarray(serialem.bufferImage("A"))
+    pts = semmatch.api.find_points(image, pixelSize, "hough", {"maxPts": 20})
+"""
+
+import numpy as np
+
+from semmatch.core import NavOptions, templateMatch, houghCircles, laceySearch
+from semmatch.autodoc import ptsToNavPts
+from semmatch.mrc import toUint8
+
+METHODS = ("template", "hough", "lacey")
+
+
+def to_uint8(image, minMax=None) -> "ndarray":
+    """Scale an image to 8 bits the way SerialEM does for JPEG export.
+
+    uint8 images are returned as they are. Otherwise minMax (for example a
+    map's MapMinMaxScale) or the image's own range is mapped to 0-255.
+    """
+    return toUint8(image, minMax)
+
+
+def find_points(image, pixel_size, method="template", options=None, template=None):
+    """Find acquisition points in a 2D image array.
+
+    image is used without copying if it is already 8-bit; other types are
+    scaled to 8 bits first. pixel_size is in nm. method is one of METHODS and
+    options holds that method's keyword arguments:
+
+        template  threshold (0.8), blurImage, blurTemplate; requires template
+        hough     param1, param2, minDistNm, minRadiusNm, maxRadiusNm, maxPts
+        lacey     maxPts (999), threshLow (195), threshHigh (245)
+
+    Every method also takes roi, a list of polygons of (x, y) vertices in
+    the same coordinates as the points, and then only searches that region.
+
+    Returns an (N, 2) int array of (x, y) pixel coordinates with (0,0) at the
+    bottom-left corner, as used for CoordsInMap.
+    """
+    options = dict(options or {})
+    image = to_uint8(np.asarray(image))
+    if method == "template":
+        if template is None:
+            raise ValueError("template matching needs a template")
+        threshold = options.pop("threshold", 0.8)
+        pts = templateMatch(image, to_uint8(np.asarray(template)), threshold, **options)
+    elif method == "hough":
+        maxPts = options.pop("maxPts", None)
+        pts = houghCircles(image, pixel_size, **options)
+        if maxPts is not None:
+            from semmatch.groups import getRandPts
+
+            pts = getRandPts(pts, maxPts)
+    elif method == "lacey":
+        pts = laceySearch(
+            image,
+            options.get("maxPts", 999),
+            options.get("threshLow", 195),
+            options.get("threshHigh", 245),
+            roi=options.get("roi"),
+        )
+    else:
+        raise ValueError("method needs to be one of %s" % ", ".join(METHODS))
+    return np.array(pts, dtype=int).reshape(-1, 2)
+
+
+def nav_items(pts, map_item: dict, start_label: int, nav_options=None, scale=1.0):
+    """Turn points found in a map into NavFilePoints drawn on that map.
+
+    map_item is the map's navigator entry as a dict of strings, like one
+    section of openNavfile. scale multiplies the points first, e.g. by the
+    reduction of the searched image relative to the loaded map. str() of each
+    item is its autodoc section; its attributes are the navigator fields.
+    """
+    missing = [key for key in ("Regis", "MapID", "StageXYZ") if key not in map_item]
+    if missing:
+        raise ValueError("map item is missing %s" % ", ".join(missing))
+    if nav_options is None:
+        nav_options = NavOptions(0, 7.0, None, 10, 8, 1)
+    # checked here, since ptsToNavPts exits on them as the command line does
+    if nav_options.groupOption == 1 and not (
+        nav_options.groupRadius and nav_options.pixelSize
+    ):
+        raise ValueError("groupOption 1 needs a group radius and a pixel size")
+    if nav_options.groupOption == 3 and not (nav_options.numGroups or 0) >= 1:
+        raise ValueError("groupOption 3 needs numGroups of at least 1")
+    if nav_options.groupOption == 4 and not (nav_options.ptsPerGroup or 0) >= 1:
+        raise ValueError("groupOption 4 needs ptsPerGroup of at least 1")
+    pts = [tuple(int(scale * v) for v in pt) for pt in np.asarray(pts).tolist()]
+    if not pts:
+        return []
+    return ptsToNavPts(pts, {"map": map_item}, "map", start_label, nav_options)
@@ -1,13 +1,13 @@
+import contextlib
 import random
 import os
-from semmatch.groups import (
-    greedyPathThroughPts,
-    makeGroupsOfPoints,
-    k_means,
-    closestPtToCentroid,
-)
+import time
+import uuid
+from semmatch.groups import groupPts
+from semmatch.timing import timed
 
 
+@timed
 def openNavfile(navfile) -> dict:
     nav = {}
     try:
@@ -103,17 +103,45 @@ class NavFilePoint:
         vars(self).update(kwargs)
 
     def __str__(self):
-        result = [f"[Item = {self._label}]"]
-        for key, val in vars(self).items():
-            if key == "_label":
-                continue
-            if key == "CoordsInMap":
-                val = " ".join(str(x) for x in val)
-            result.append(f"{key} = {val}")
-        result.append("\n")
-        return "\n".join(result)
+        return "".join(formatNavPts([self]))
+
+
+def _itemTemplate(keys):
+    """Format string for one autodoc section with the given field names."""
+    lines = ["[Item = {}]"] + [f"{key} = {{}}" for key in keys if key != "_label"]
+    return "\n".join(lines) + "\n\n"
+
+
+def _itemValues(pt):
+    for key, val in vars(pt).items():
+        if key == "CoordsInMap":
+            val = " ".join(str(x) for x in val)
+        yield val
+
+
+def formatNavPts(navPts):
+    """Yield autodoc text for navPts, one chunk per run of points sharing the
+    same fields.
 
+    The section template is built once per run instead of once per point, so
+    formatting a few thousand points is a single join per run.
+    """
+    keys = None
+    run = []
+    for pt in navPts:
+        ptKeys = tuple(vars(pt))
+        if ptKeys != keys and run:
+            template = _itemTemplate(keys)
+            yield "".join(template.format(*values) for values in run)
+            run = []
+        keys = ptKeys
+        run.append(tuple(_itemValues(pt)))
+    if run:
+        template = _itemTemplate(keys)
+        yield "".join(template.format(*values) for values in run)
 
+
+@timed
 def ptsToNavPts(
     coords, nav: dict, mapLabel: str, startLabel: int, options: "NavOptions"
 ):
@@ -125,46 +153,30 @@ def ptsToNavPts(
         print(e)
         exit()
 
+    if options.groupOption not in (0, 1, 2, 3, 4):
+        raise ValueError("groupOption needs to be 0, 1, 2, 3 or 4")
+    if options.groupOption == 1 and not options.pixelSize:
+        print("pixel size can't be 0; aborting")
+        exit()
+
     navPoints = []
     label = startLabel
+    groups = groupPts(coords, options)
 
     if options.groupOption == 0:  # no groups
-        for pt in greedyPathThroughPts(coords):
+        for pt in groups[0]:
             navPoints.append(
                 NavFilePoint(
                     label, regis, *pt, zHeight, drawnID, acquire=options.acquire
                 )
             )
             label += 1
-    elif options.groupOption == 1:  # groups withing mesh
-        try:
-            groupRadiusPix = options.groupRadius * 1000 / options.pixelSize
-        except ZeroDivisionError:
-            print("pixel size can't be 0; aborting")
-            exit()
-
-        for group in makeGroupsOfPoints(coords, groupRadiusPix):
-            group = greedyPathThroughPts(group)
-            subLabel = 1
-            groupID = random.randint(10 ** 9, 2 * 10 ** 9)
-            for pt in group:
-                navPoints.append(
-                    NavFilePoint(
-                        f"{label}-{subLabel}",
-                        regis,
-                        *pt,
-                        zHeight,
-                        drawnID,
-                        groupID=groupID,
-                        acquire=options.acquire,
-                    )
-                )
-                subLabel += 1
-            label += 1
-    elif options.groupOption == 2:  # entire mesh as group
-        groupID = random.randint(10 ** 9, 2 * 10 ** 9)
+        return navPoints
+
+    for group in groups:
         subLabel = 1
-        for pt in greedyPathThroughPts(coords):
+        groupID = random.randint(10 ** 9, 2 * 10 ** 9)
+        for pt in group:
             navPoints.append(
                 NavFilePoint(
                     f"{label}-{subLabel}",
@@ -178,66 +190,149 @@ def ptsToNavPts(
             )
             subLabel += 1
         label += 1
-    elif options.groupOption == 3:  # numGroups
-        groups = []
-        for group in k_means(coords, options.numGroups):
-            groupLeader = closestPtToCentroid(group)
-            group.remove(groupLeader)
-            group = [groupLeader] + greedyPathThroughPts(group)
-            groups.append(group)
-        groups.sort(key=lambda group: group[0][0])  # sort by group leader's x position
-
-        for group in groups:
-            subLabel = 1
-            groupID = random.randint(10 ** 9, 2 * 10 ** 9)
-            for pt in group:
-                navPoints.append(
-                    NavFilePoint(
-                        f"{label}-{subLabel}",
-                        regis,
-                        *pt,
-                        zHeight,
-                        drawnID,
-                        groupID=groupID,
-                        acquire=options.acquire,
-                    )
-                )
-                subLabel += 1
-            label += 1
-    elif options.groupOption == 4:  # points per group
-        groups = []
-        numGroups = len(coords) // options.ptsPerGroup
-        if numGroups == 0:
-            numGroups = 1
-        for group in k_means(coords, numGroups):
-            groupLeader = closestPtToCentroid(group)
-            group.remove(groupLeader)
-            group = [groupLeader] + greedyPathThroughPts(group)
-            groups.append(group)
-        groups.sort(key=lambda group: group[0][0])  # sort by group leader's x position
-
-        for group in groups:
-            subLabel = 1
-            groupID = random.randint(10 ** 9, 2 * 10 ** 9)
-            for pt in group:
-                navPoints.append(
-                    NavFilePoint(
-                        f"{label}-{subLabel}",
-                        regis,
-                        *pt,
-                        zHeight,
-                        drawnID,
-                        groupID=groupID,
-                        acquire=options.acquire,
-                    )
-                )
-                subLabel += 1
-            label += 1
-    else:
-        raise ValueError("groupOption needs to be 0, 1, 2, 3 or 4")
     return navPoints
 
 
+# large enough that a typical semmatch_nav.nav goes out in a few writes
+WRITE_BUFFER_SIZE = 1 << 20
+# seconds to wait for another program, such as SerialEM saving the navigator,
+# to let go of a navigator being appended to
+LOCK_TIMEOUT = 60
+
+
+@timed
 def createAutodoc(outputfile, navPts):
-    with open(outputfile, "w") as f:
-        f.write("AdocVersion = 2.00\n\n" + "".join(str(pt) for pt in navPts))
+    """Write navPts as a new autodoc.
+
+    The file is written under a temporary name in the same directory and then
+    renamed over outputfile, so SerialEM's MergeNavFile never reads a partially
+    written navigator.
+    """
+    tmpfile = "%s.%s.tmp" % (outputfile, uuid.uuid4().hex[:8])
+    try:
+        with open(tmpfile, "w", buffering=WRITE_BUFFER_SIZE) as f:
+            f.write("AdocVersion = 2.00\n\n")
+            f.writelines(formatNavPts(navPts))
+        os.replace(tmpfile, outputfile)
+    except BaseException:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+
+def navIndex(f):
+    """Return the item labels and MapIDs in an open binary nav file.
+
+    Only the "[Item = ...]" and "MapID = ..." lines are looked at, which is
+    enough to check new items for collisions without a full openNavfile.
+    """
+    labels = set()
+    mapIDs = set()
+    f.seek(0)
+    for line in f:
+        if line.startswith(b"[Item"):
+            labels.add(line.split(b"=", 1)[1].strip()[:-1].strip().decode())
+        elif line.startswith(b"MapID"):
+            mapIDs.add(int(line.split(b"=", 1)[1]))
+    return labels, mapIDs
+
+
+def _retryLock(f, lock):
+    """Call lock until it doesn't raise OSError, for up to LOCK_TIMEOUT
+    seconds; TimeoutError if f stays locked."""
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        try:
+            return lock()
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(
+                    "%s is still locked by another program after %d s"
+                    % (f.name, LOCK_TIMEOUT)
+                )
+            time.sleep(0.1)
+
+
+@contextlib.contextmanager
+def _lockedFile(f):
+    """Hold an exclusive lock on f, waiting up to LOCK_TIMEOUT seconds for
+    it to be available."""
+    f.seek(0)
+    if os.name == "nt":
+        import msvcrt
+
+        _retryLock(f, lambda: msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1))
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        _retryLock(f, lambda: fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB))
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def appendingTo(navfile):
+    """Open navfile for appending new items in place.
+
+    Yields a function that takes a list of NavFilePoints and appends them to
+    the end of navfile. New items are checked against the labels already in
+    the file and given MapIDs that are not in use. The file stays locked until
+    the with block exits; if it exits with an exception, navfile is truncated
+    back to its original size.
+    """
+    with open(navfile, "r+b") as f, _lockedFile(f):
+        firstLine = f.readline()
+        if not firstLine.startswith(b"AdocVersion"):
+            raise Exception("could not find AdocVersion")
+        newline = b"\r\n" if firstLine.endswith(b"\r\n") else b"\n"
+        labels, mapIDs = navIndex(f)
+        start = f.seek(0, os.SEEK_END)
+        f.seek(max(start - 2 * len(newline), 0))
+        separator = newline * (2 - f.read().count(newline))
+
+        def append(navPts):
+            newLabels = [str(pt._label) for pt in navPts]
+            collisions = labels.intersection(newLabels)
+            seen = set()
+            for label in newLabels:
+                if label in seen:
+                    collisions.add(label)
+                seen.add(label)
+            if collisions:
+                raise ValueError(
+                    "labels already in %s: %s" % (navfile, ", ".join(sorted(collisions)))
+                )
+            for pt in navPts:
+                mapID = random.randint(10 ** 9, 2 * 10 ** 9)
+                while mapID in mapIDs:
+                    mapID = random.randint(10 ** 9, 2 * 10 ** 9)
+                pt.MapID = mapID
+                mapIDs.add(mapID)
+            labels.update(newLabels)
+
+            nonlocal separator
+            text = "".join(formatNavPts(navPts)).encode()
+            f.seek(0, os.SEEK_END)
+            f.write(separator + text.replace(b"\n", newline))
+            separator = b""
+
+        try:
+            yield append
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(start)
+            raise
+
+
+@timed
+def appendToNavfile(navfile, navPts):
+    with appendingTo(navfile) as append:
+        append(navPts)
@@ -0,0 +1,337 @@
+"""Search many maps of one navigator in a single process.
+
+    semmatch batch --navfile nav.nav --image "maps/{label}.jpg" --template T.jpg -o out.nav
+
+The navigator is parsed once, the template is read once and shared with a
+pool of worker processes, and all new items go to a single output with
+consecutive labels. With {label} in the output name, each map's items go to
+their own file instead, written in the background as soon as the map is done.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import functools
+import os
+
+import numpy as np
+
+from semmatch.__main__ import (
+    addNavArgs,
+    addProfileArgs,
+    addSearchArgs,
+    findPts,
+    readTemplate,
+)
+from semmatch.core import NavOptions
+from semmatch.autodoc import (
+    ptsToNavPts,
+    createAutodoc,
+    openNavfile,
+    appendToNavfile,
+)
+from semmatch.coords import (
+    NavPtsIndex,
+    loadedMapScale,
+    mapPixelSize,
+    skipExistingPts,
+    navPtsToStage,
+    setStageCoords,
+    writeSidecar,
+)
+from semmatch.mrc import findMapFile, imageShape, isMrcFile, readImage
+from semmatch.pyramid import toBase
+from semmatch.roi import Roi
+from semmatch.pipeline import Pipeline, formatStats
+from semmatch.timing import addSpans, profiledRun, profiling, span
+
+# set in each worker process by _initWorker: the template at each reduction
+# maps are searched at
+_templates = {}
+
+
+def _initWorker(templates):
+    import cv2
+
+    global _templates
+    _templates = templates
+    # the pool already keeps every core busy
+    cv2.setNumThreads(1)
+
+
+def _searchImage(job, shape, args):
+    """Points found in the map of job, its width and pixel size, and with
+    --profile the spans of the search, recorded in the worker process.
+
+    The map is read here rather than passed in, so MRC maps are read from
+    the memory-mapped file and only the maps being searched are in memory.
+    """
+    mapItem = job[2]
+    image = readImage(job[1], mapItem)
+    pixelSize = args.pixelSize
+    if pixelSize is None:
+        pixelSize = mapPixelSize(mapItem, image.shape[1])
+    reduction = mapReduction(job[1], args)
+    if args.roi and reduction != 1:
+        # the points are scaled back up by toBase in mapNavPts
+        args = argparse.Namespace(**vars(args))
+        args.roi = Roi(args.roi).binned(reduction).polygons
+    recording = profiling("detect", args.traceMemory) if args.profile else None
+    with recording or contextlib.nullcontext() as spans:
+        pts = findPts(image, _templates.get(reduction), pixelSize, args)
+    spans = spans.toDict() if spans is not None else None
+    return pts, image.shape[1], pixelSize, spans
+
+
+def mapReduction(imagefile, args):
+    """Reduction of imagefile as searched: --reduction, or 1 for MRC files,
+    which are read unreduced."""
+    return 1.0 if isMrcFile(imagefile) else args.reduction
+
+
+def readTemplates(args, jobs):
+    """The template reduced for each reduction the images of jobs are
+    searched at, by reduction; None if it can't be read."""
+    templates = {}
+    for reduction in sorted({mapReduction(job[1], args) for job in jobs}):
+        templates[reduction] = readTemplate(args.template, reduction)
+        if templates[reduction] is None:
+            return None
+    return templates
+
+
+def isSearchableMap(item):
+    return item.get("Type") == "2" and all(
+        key in item
+        for key in ("Regis", "MapID", "StageXYZ", "MapScaleMat", "MapWidthHeight")
+    )
+
+
+def nextLabel(nav):
+    """First integer label after the items in nav, like SerialEM's navIntLabel + 1."""
+    intLabels = [label.split("-")[0] for label in nav]
+    return max((int(label) for label in intLabels if label.isdigit()), default=0) + 1
+
+
+def addMapArgs(parser):
+    """Options choosing the maps of a navigator and their images."""
+    parser.add_argument("--navfile", help="SerialEM nav file", required=True)
+    parser.add_argument(
+        "--image",
+        help="image file of each map, with {label} in place of the map label;"
+        " default each map's MapFile, or {label}.jpg if that can't be found",
+    )
+    parser.add_argument(
+        "--maps", help="labels of the maps to search; default all maps", nargs="+"
+    )
+    parser.add_argument(
+        "--newLabel",
+        help="starting label of added points; default after the last label in navfile",
+        type=int,
+    )
+    parser.add_argument(
+        "--pixelSize",
+        help="pixelSize in nm; default computed from each map's MapScaleMat",
+        type=float,
+    )
+
+
+def checkArgs(parser, args):
+    if args.output is None and args.appendTo is None:
+        parser.error("one of --output or --appendTo is required")
+    if not (args.houghCircles or args.laceySearch or args.template):
+        parser.error("one of --template, --houghCircles or --laceySearch is required")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="semmatch batch", description="search many maps of a SerialEM navigator"
+    )
+    addMapArgs(parser)
+    parser.add_argument(
+        "--workers", help="number of worker processes", type=int, default=os.cpu_count()
+    )
+    addSearchArgs(parser)
+    addNavArgs(parser)
+    addProfileArgs(parser)
+
+    args = parser.parse_args(argv)
+    checkArgs(parser, args)
+
+    # clear output file to prevent merging previous points, however the run
+    # ends
+    if args.output is not None and "{label}" not in args.output:
+        createAutodoc(args.output, [])
+    with profiledRun(args.profile, args.cprofile, args.traceMemory):
+        run(args)
+
+
+def mapJobs(nav, args):
+    """(label, image file, map item) of each map to search; exits if none."""
+    if args.maps is None:
+        mapLabels = [label for label, item in nav.items() if isSearchableMap(item)]
+    else:
+        mapLabels = []
+        for label in args.maps:
+            if label not in nav:
+                print("could not find map label: %s; skipping" % label)
+            elif not isSearchableMap(nav[label]):
+                print("%s is not a map with a MapScaleMat; skipping" % label)
+            else:
+                mapLabels.append(label)
+
+    jobs = []
+    for label in mapLabels:
+        if args.image is not None:
+            imagefile = args.image.format(label=label)
+        else:
+            imagefile = findMapFile(nav[label], args.navfile) or "%s.jpg" % label
+        if os.path.exists(imagefile):
+            jobs.append((label, imagefile, nav[label]))
+        else:
+            print("could not find %s for map %s; skipping" % (imagefile, label))
+    if not jobs:
+        print("no maps to search; aborting")
+        exit()
+    return jobs
+
+
+def mapNavPts(nav, job, pts, width, options, newLabel, index, args):
+    """Nav items, labeled from newLabel, and stage coordinates of the points
+    found in the image of a map that is width pixels wide.
+
+    Points near items already in index are dropped with --skipExisting, and
+    the new ones are added to it so overlapping maps searched later see them.
+    """
+    label = job[0]
+    mapItem = nav[label]
+    reduction = mapReduction(job[1], args)
+    # back to the pixels of the map as loaded in SerialEM
+    pts = toBase(pts, reduction)
+    scale = loadedMapScale(mapItem, width * reduction)
+
+    if index is not None and pts:
+        numPts = len(pts)
+        pts = skipExistingPts(
+            pts,
+            mapItem,
+            index,
+            scale,
+            args.skipExisting,
+            sameMapOnly=args.skipExistingScope == "map",
+        )
+        print(
+            "%s: skipped %d points already in the navigator"
+            % (label, numPts - len(pts))
+        )
+    print("%s: %d points" % (label, len(pts)))
+    if not pts:
+        return [], np.empty((0, 2))
+
+    navPts = ptsToNavPts(pts, nav, label, newLabel, options)
+    stagePts = navPtsToStage(navPts, mapItem, scale)
+    if index is not None:
+        index.add(stagePts, int(mapItem["MapID"]))
+    return navPts, stagePts
+
+
+def writeResults(args, navPts, stagePts, pixelPts):
+    """Write the items of all maps to the sidecar and nav outputs in args."""
+    if args.sidecar:
+        writeSidecar(args.sidecar, navPts, stagePts, pixelPts)
+        print("%s created" % args.sidecar)
+    if args.appendTo is not None:
+        try:
+            appendToNavfile(args.appendTo, navPts)
+        except (ValueError, OSError) as e:
+            print(e)
+            print("%s left unchanged; aborting" % args.appendTo)
+            exit()
+        print("%d points appended to %s" % (len(navPts), args.appendTo))
+    if args.output is not None and "{label}" not in args.output:
+        createAutodoc(args.output, navPts)
+        print("%s created" % args.output)
+
+
+def run(args):
+    nav = openNavfile(args.navfile)
+    jobs = mapJobs(nav, args)
+
+    templates = {}
+    if args.template is not None and not (args.houghCircles or args.laceySearch):
+        templates = readTemplates(args, jobs)
+        if templates is None:
+            exit()
+
+    newLabel = nextLabel(nav) if args.newLabel is None else args.newLabel
+    index = NavPtsIndex(nav) if args.skipExisting is not None else None
+    perMapOutput = args.output is not None and "{label}" in args.output
+    allNavPts = []
+    allStagePts = []
+    allPixelPts = []
+    failed = []
+
+    def decode(job):
+        # only the header, to catch unreadable maps before they're searched
+        return imageShape(job[1], job[2])
+
+    def group(job, detected):
+        nonlocal newLabel
+        pts, width, pixelSize, spans = detected
+        options = NavOptions(
+            args.groupOption,
+            args.groupRadius,
+            pixelSize,
+            args.numGroups,
+            args.ptsPerGroup,
+            args.acquire,
+        )
+        # each map's search, in a worker alongside other maps, and grouping
+        # under its label
+        if spans is not None:
+            addSpans(
+                {
+                    "name": job[0],
+                    "seconds": spans["seconds"],
+                    "calls": 0,
+                    "children": [spans],
+                }
+            )
+        with span(job[0]):
+            navPts, stagePts = mapNavPts(
+                nav, job, pts, width, options, newLabel, index, args
+            )
+        if navPts:
+            newLabel = int(str(navPts[-1]._label).split("-")[0]) + 1
+        return navPts, stagePts
+
+    def skip(job, stage, e):
+        print("%s: %s failed: %s; skipping" % (job[0], stage, e or repr(e)))
+        failed.append(job[0])
+
+    def write(job, grouped):
+        navPts, stagePts = grouped
+        allPixelPts.extend(pt.CoordsInMap[:2] for pt in navPts)
+        if args.stageCoords:
+            setStageCoords(navPts, stagePts)
+        if perMapOutput:
+            createAutodoc(args.output.format(label=job[0]), navPts)
+        allNavPts.extend(navPts)
+        allStagePts.append(stagePts)
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.workers, initializer=_initWorker, initargs=(templates,)
+    ) as pool:
+        detect = functools.partial(_searchImage, args=args)
+        pipeline = Pipeline(
+            decode, detect, group, write, pool, depth=args.workers + 1, onError=skip
+        )
+        stats = pipeline.run(jobs)
+    print(formatStats(stats))
+
+    if failed:
+        print("skipped %d maps that failed: %s" % (len(failed), ", ".join(failed)))
+    print("%d points from %d maps" % (len(allNavPts), len(jobs) - len(failed)))
+    if not allNavPts:
+        exit()
+    writeResults(args, allNavPts, np.concatenate(allStagePts), allPixelPts)
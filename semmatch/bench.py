@@ -0,0 +1,484 @@
+"""Benchmarks of the detectors, grouping and navigator I/O.
+
+    python -m semmatch.bench [-o report.json] [--sizes 2048 8192 16384] [--only REGEX]
+                             [--data tests]
+    python -m semmatch.bench compare old.json new.json [--tolerance 0.1] [--check]
+
+The cases run on the test map (MMM.jpg, T.jpg and nav.nav in the --data
+directory, tests/ in a source checkout) and on synthetic maps made from a
+fixed seed, so every run times the same work: a lattice of holes, with more
+holes in larger maps, and a lacey texture, the same at every size, at each of
+--sizes pixels across. Each detector is timed on the pyramid level findPts
+would search for the map, as it is in a real run; the report records which
+level that was and how many points were found. Without --data the cases on
+the test map are skipped.
+
+Every case runs --warmup times untimed, then --repeat times, and the report
+keeps all the times with their minimum and median, and the versions and
+machine they were measured on, as JSON. compare lines up two reports case by
+case, so a regression between two releases shows up as a ratio (and, with
+--check, a nonzero exit status).
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from semmatch.core import NavOptions, Pt
+
+SIZES = (2048, 8192, 16384)
+SEED = 0
+
+# pixel size of the test map, as in the tests
+TEST_PIXEL_SIZE = 13
+# holes of the synthetic lattice: 1 µm in radius on a 4 µm pitch, at 25 nm/px
+LATTICE_PIXEL_SIZE = 25
+HOLE_RADIUS = 40
+HOLE_PITCH = 160
+
+
+# synthetic maps
+
+
+def latticeCenters(size):
+    """(x, y) centers of the holes of a synthetic lattice map, with (0,0) at
+    the bottom-left corner."""
+    centers = np.arange(HOLE_PITCH // 2, size - HOLE_PITCH // 2 + 1, HOLE_PITCH)
+    xs, rows = np.meshgrid(centers, centers)
+    return np.stack([xs.ravel(), size - 1 - rows.ravel()], axis=1)
+
+
+def _addNoise(image, rng, sigma=12):
+    # one block of noise, tiled, so even 16k maps are made quickly
+    block = rng.normal(0, sigma, (509, 509)).astype(np.int16)
+    for top in range(0, image.shape[0], block.shape[0]):
+        rows = image[top : top + block.shape[0]]
+        noise = np.tile(block, (1, -(-image.shape[1] // block.shape[1])))
+        rows[...] = np.clip(rows + noise[: len(rows), : rows.shape[1]], 0, 255)
+    return image
+
+
+@functools.lru_cache(maxsize=1)
+def holeLattice(size, seed=SEED):
+    """Synthetic holey carbon map of size x size pixels.
+
+    Returns the image and a template cut out around one hole.
+    """
+    pitch = HOLE_PITCH
+    yy, xx = np.mgrid[:pitch, :pitch] - (pitch // 2)
+    cell = np.where(xx**2 + yy**2 <= HOLE_RADIUS**2, 200, 110).astype(np.uint8)
+    reps = -(-size // pitch)
+    image = np.tile(cell, (reps, reps))[:size, :size]
+    image = _addNoise(image, np.random.default_rng(seed))
+    return image, image[:pitch, :pitch].copy()
+
+
+@functools.lru_cache(maxsize=1)
+def laceyTexture(size, seed=SEED):
+    """Synthetic lacey carbon map of size x size pixels: irregular bright
+    holes in laceySearch's default range on darker carbon."""
+    from scipy.ndimage import gaussian_filter
+
+    rng = np.random.default_rng(seed)
+    # the same holes at every size, as in maps of one area at different
+    # magnifications, since laceySearch bins maps to about the same width
+    coarse = gaussian_filter(rng.random((128, 128)), 2)
+    holes = np.where(coarse > np.median(coarse), 220, 120).astype(np.uint8)
+    factor = -(-size // 128)
+    image = np.repeat(np.repeat(holes, factor, axis=0), factor, axis=1)
+    return _addNoise(image[:size, :size], rng)
+
+
+@functools.lru_cache(maxsize=1)
+def testMap(data):
+    import PIL.Image
+
+    from semmatch.autodoc import openNavfile
+
+    image = np.array(PIL.Image.open(os.path.join(data, "MMM.jpg")))
+    template = np.array(PIL.Image.open(os.path.join(data, "T.jpg")))
+    nav = openNavfile(os.path.join(data, "nav.nav"))
+    return image, template, nav
+
+
+# cases; each setup returns the function to time and what it runs on
+
+
+def _templateCase(image, template):
+    from semmatch.core import templateMatch
+    from semmatch.pyramid import ImagePyramid, templateLevel
+
+    k = templateLevel(template)
+    level = ImagePyramid(image).level(k)
+    template = ImagePyramid(template).level(k)
+
+    def run():
+        return templateMatch(
+            level, template, 0.8, blurImage=True, blurTemplate=True, sigma=10 / 2**k
+        )
+
+    return run, {"shape": list(level.shape), "level": k}
+
+
+def _houghCase(image, pixelSize):
+    from semmatch.core import houghCircles
+    from semmatch.pyramid import ImagePyramid, houghLevel
+
+    k = houghLevel(pixelSize)
+    level = ImagePyramid(image).level(k)
+    return (
+        lambda: houghCircles(level, pixelSize * 2**k),
+        {"shape": list(level.shape), "level": k},
+    )
+
+
+def _laceyLevel(image):
+    from semmatch.pyramid import ImagePyramid, laceyLevel
+
+    pyramid = ImagePyramid(image)
+    k = laceyLevel(pyramid.mapWidth)
+    return pyramid.level(k), k
+
+
+def _laceyCase(image):
+    from semmatch.core import laceySearch
+
+    level, k = _laceyLevel(image)
+    return (
+        lambda: laceySearch(level, 999, 195, 245),
+        {"shape": list(level.shape), "level": k},
+    )
+
+
+def _anisodiffCase(image):
+    from semmatch.core import anisodiff
+
+    # the way laceySearch runs it
+    level, k = _laceyLevel(image)
+    return (
+        lambda: anisodiff(level, niter=30, kappa=20),
+        {"shape": list(level.shape), "level": k},
+    )
+
+
+def _groupCase(groupOption, size):
+    from semmatch.groups import groupPts
+
+    pts = [Pt(*pt) for pt in latticeCenters(size).tolist()]
+    options = NavOptions(groupOption, 7.0, LATTICE_PIXEL_SIZE, 10, 8, 1)
+    return lambda: groupPts(list(pts), options), {"points": len(pts)}
+
+
+def _navPts(data, size):
+    from semmatch.autodoc import ptsToNavPts
+
+    nav = testMap(data)[2]
+    pts = [Pt(*pt) for pt in latticeCenters(size).tolist()]
+    options = NavOptions(0, 7.0, TEST_PIXEL_SIZE, 10, 8, 1)
+    return ptsToNavPts(pts, nav, "30-A", 1, options)
+
+
+def _openNavfileCase(data):
+    from semmatch.autodoc import openNavfile
+
+    navfile = os.path.join(data, "nav.nav")
+    return lambda: openNavfile(navfile), {"bytes": os.path.getsize(navfile)}
+
+
+def _createAutodocCase(data, size, scratch):
+    from semmatch.autodoc import createAutodoc
+
+    navPts = _navPts(data, size)
+    output = os.path.join(scratch, "out.nav")
+    return lambda: createAutodoc(output, navPts), {"items": len(navPts)}
+
+
+def allCases(data, sizes, scratch):
+    """(name, setup) of every case, grouped by the map they need so only one
+    synthetic map of each kind is in memory at a time. Files are written to
+    the directory scratch. The setup of the cases on the test map is None if
+    data is."""
+    cases = _dataCases(
+        data,
+        [
+            ("templateMatch/MMM", lambda: _templateCase(*testMap(data)[:2])),
+            (
+                "houghCircles/MMM",
+                lambda: _houghCase(testMap(data)[0], TEST_PIXEL_SIZE),
+            ),
+            ("laceySearch/MMM", lambda: _laceyCase(testMap(data)[0])),
+            ("anisodiff/MMM", lambda: _anisodiffCase(testMap(data)[0])),
+        ],
+    )
+    for size in sizes:
+        cases += [
+            (
+                "templateMatch/lattice-%d" % size,
+                lambda size=size: _templateCase(*holeLattice(size)[:2]),
+            ),
+            (
+                "houghCircles/lattice-%d" % size,
+                lambda size=size: _houghCase(holeLattice(size)[0], LATTICE_PIXEL_SIZE),
+            ),
+            (
+                "laceySearch/lacey-%d" % size,
+                lambda size=size: _laceyCase(laceyTexture(size)),
+            ),
+            (
+                "anisodiff/lacey-%d" % size,
+                lambda size=size: _anisodiffCase(laceyTexture(size)),
+            ),
+        ]
+    # the 625 holes of a 4k lattice
+    for groupOption in range(5):
+        cases.append(
+            (
+                "groupPts/option%d" % groupOption,
+                functools.partial(_groupCase, groupOption, 4096),
+            )
+        )
+    cases += _dataCases(
+        data,
+        [
+            ("openNavfile/nav.nav", lambda: _openNavfileCase(data)),
+            (
+                "createAutodoc/lattice-4096",
+                lambda: _createAutodocCase(data, 4096, scratch),
+            ),
+        ],
+    )
+    return cases
+
+
+def _dataCases(data, cases):
+    return cases if data is not None else [(name, None) for name, _ in cases]
+
+
+def timeCase(run, repeat, warmup=1):
+    # untimed runs first, so imports and caches aren't counted
+    for _ in range(warmup):
+        run()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        seconds.append(time.perf_counter() - start)
+    timing = {
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+    }
+    if isinstance(result, list):
+        timing["found"] = len(result)
+    return timing
+
+
+def environment():
+    """Versions and machine a report was measured on."""
+    import cv2
+    import scipy
+
+    try:
+        from importlib.metadata import version
+
+        semmatchVersion = version("semmatch")
+    except Exception:
+        semmatchVersion = None
+    return {
+        "semmatch": semmatchVersion,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run(data=None, sizes=SIZES, only=None, repeat=3, warmup=1, log=None):
+    """Run the cases whose names match the regular expression only (default
+    all) and return the report. The cases on the test map, in the directory
+    data, are skipped if data is None."""
+    report = {
+        "environment": environment(),
+        "repeat": repeat,
+        "warmup": warmup,
+        "cases": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="semmatch-bench") as scratch:
+        for name, setup in allCases(data, sizes, scratch):
+            if only is not None and not re.search(only, name):
+                continue
+            if setup is None:
+                report["cases"][name] = {"skipped": "no --data"}
+                if log is not None:
+                    log("%-36s skipped, no --data" % name)
+                continue
+            fn, params = setup()
+            report["cases"][name] = dict(params, **timeCase(fn, repeat, warmup))
+            if log is not None:
+                log(formatCase(name, report["cases"][name]))
+    return report
+
+
+def formatCase(name, case):
+    found = " %6d found" % case["found"] if "found" in case else ""
+    return "%-36s min %8.3f s  median %8.3f s%s" % (
+        name,
+        case["min"],
+        case["median"],
+        found,
+    )
+
+
+def compare(old, new, tolerance=0.1):
+    """Lines comparing the minimum time of each case in two reports, and the
+    names of the cases more than tolerance slower in new, or with a tour
+    (see semmatch.scaling) more than tolerance longer."""
+    lines = []
+    slower = []
+    for name in sorted(set(old["cases"]) | set(new["cases"])):
+        if name not in new["cases"]:
+            lines.append("%-36s only in old" % name)
+            continue
+        if name not in old["cases"]:
+            lines.append("%-36s only in new" % name)
+            continue
+        before, after = old["cases"][name], new["cases"][name]
+        if "min" not in before or "min" not in after:
+            lines.append(
+                "%-36s skipped in %s" % (name, "old" if "min" not in before else "new")
+            )
+            continue
+        ratio = after["min"] / before["min"] if before["min"] else float("inf")
+        note = ""
+        if ratio > 1 + tolerance:
+            note = "  SLOWER"
+            slower.append(name)
+        elif ratio < 1 - tolerance:
+            note = "  faster"
+        for key in ("found", "groups"):
+            if before.get(key) != after.get(key):
+                note += "  %s %s -> %s" % (key, before.get(key), after.get(key))
+        if "tourLength" in before and "tourLength" in after:
+            if after["tourLength"] > before["tourLength"] * (1 + tolerance):
+                note += "  LONGER tour x%.2f" % (
+                    after["tourLength"] / before["tourLength"]
+                )
+                if name not in slower:
+                    slower.append(name)
+        lines.append(
+            "%-36s %8.3f s -> %8.3f s  x%.2f%s"
+            % (name, before["min"], after["min"], ratio, note)
+        )
+    return lines, slower
+
+
+def compareMain(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m semmatch.bench compare",
+        description="compare two benchmark reports",
+    )
+    parser.add_argument("old", help="report of the baseline")
+    parser.add_argument("new", help="report to check")
+    parser.add_argument(
+        "--tolerance",
+        help="fraction a case can be slower before it's flagged",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--check",
+        help="fail if any case is slower, or any tour longer",
+        action="store_true",
+    )
+    args = parser.parse_args(argv)
+    reports = []
+    for path in (args.old, args.new):
+        with open(path) as f:
+            reports.append(json.load(f))
+
+    lines, slower = compare(*reports, tolerance=args.tolerance)
+    for report, path in zip(reports, (args.old, args.new)):
+        env = report["environment"]
+        print(
+            "%s: semmatch %s, numpy %s, opencv %s on %s (%s cpus), %s"
+            % (
+                path,
+                env["semmatch"],
+                env["numpy"],
+                env["opencv"],
+                env["machine"],
+                env["cpus"],
+                env["created"],
+            )
+        )
+    print("\n".join(lines))
+    if args.check and slower:
+        print("worse: %s" % ", ".join(slower))
+        return 1
+    return 0
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["compare"]:
+        return compareMain(argv[1:])
+
+    parser = argparse.ArgumentParser(
+        prog="python -m semmatch.bench", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument("-o", "--output", help="write the report to this JSON file")
+    parser.add_argument("--json", help="print the report as JSON", action="store_true")
+    parser.add_argument(
+        "--sizes",
+        help="sizes in pixels of the synthetic maps (default %s)"
+        % " ".join(map(str, SIZES)),
+        type=int,
+        nargs="*",
+        default=SIZES,
+    )
+    parser.add_argument(
+        "--only", help="only run the cases matching this regular expression"
+    )
+    parser.add_argument("--repeat", help="times each case is run", type=int, default=3)
+    parser.add_argument(
+        "--warmup", help="untimed runs before the timed ones", type=int, default=1
+    )
+    parser.add_argument(
+        "--data",
+        help="directory with MMM.jpg, T.jpg and nav.nav, such as tests/ in a"
+        " source checkout; the cases on them are skipped without it",
+    )
+    args = parser.parse_args(argv)
+
+    report = run(
+        args.data,
+        args.sizes,
+        args.only,
+        args.repeat,
+        args.warmup,
+        log=None if args.json else print,
+    )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import numpy as np
+
+from semmatch.timing import timed
+
+
+def _floats(navItem, key):
+    return [float(x) for x in navItem[key].split()]
+
+
+def mapScaleMat(navItem) -> "ndarray":
+    """2x2 matrix taking stage offsets (µm) to map pixel offsets."""
+    return np.array(_floats(navItem, "MapScaleMat")).reshape(2, 2)
+
+
+def loadedMapScale(navItem, width):
+    """Number of pixels in an image of the given width per map pixel.
+
+    Maps are usually loaded unbinned and/or reduced before semmatch sees them,
+    so points don't come in the MapWidthHeight pixels MapScaleMat refers to.
+    """
+    return width / _floats(navItem, "MapWidthHeight")[0]
+
+
+def mapPixelSize(navItem, width):
+    """Pixel size in nm of an image of the given width showing the whole map."""
+    pixelsPerMicron = np.sqrt(abs(np.linalg.det(mapScaleMat(navItem))))
+    return 1000 / pixelsPerMicron / loadedMapScale(navItem, width)
+
+
+def mapPtsToStage(pts, navItem, scale=1.0) -> "ndarray":
+    """Convert an (N, 2) array of map pixel coordinates to stage XY in µm.
+
+    pts follow the CoordsInMap convention used everywhere in semmatch, with
+    (0,0) at the bottom-left corner of the map. scale is the value returned by
+    loadedMapScale for the image the points were found in.
+    """
+    pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+    center = np.array(_floats(navItem, "StageXYZ")[:2])
+    halfSize = np.array(_floats(navItem, "MapWidthHeight")) / 2
+    return (pts / scale - halfSize) @ np.linalg.inv(mapScaleMat(navItem)).T + center
+
+
+def stageToMapPts(stagePts, navItem, scale=1.0) -> "ndarray":
+    """Inverse of mapPtsToStage."""
+    stagePts = np.asarray(stagePts, dtype=float).reshape(-1, 2)
+    center = np.array(_floats(navItem, "StageXYZ")[:2])
+    halfSize = np.array(_floats(navItem, "MapWidthHeight")) / 2
+    return ((stagePts - center) @ mapScaleMat(navItem).T + halfSize) * scale
+
+
+class NavPtsIndex:
+    """Spatial index over the stage positions of the items in a navigator.
+
+    Map items are left out since they cover a whole area rather than a
+    position anyone acquires at. Build it once per run and query it for every
+    map.
+    """
+
+    def __init__(self, nav: dict):
+        stagePts = []
+        drawnIDs = []
+        for item in nav.values():
+            if item.get("Type") == "2" or "StageXYZ" not in item:
+                continue
+            stagePts.append(_floats(item, "StageXYZ")[:2])
+            drawnIDs.append(int(item.get("DrawnID", 0)))
+        self.stagePts = np.array(stagePts, dtype=float).reshape(-1, 2)
+        self.drawnIDs = np.array(drawnIDs, dtype=np.int64)
+        self._tree = None
+
+    def add(self, stagePts, drawnID=0):
+        """Add new positions, e.g. points from a map processed earlier."""
+        stagePts = np.asarray(stagePts, dtype=float).reshape(-1, 2)
+        self.stagePts = np.concatenate([self.stagePts, stagePts])
+        self.drawnIDs = np.concatenate(
+            [self.drawnIDs, np.full(len(stagePts), drawnID, dtype=np.int64)]
+        )
+        self._tree = None
+
+    def near(self, stagePts, radius, drawnID=None) -> "ndarray":
+        """Boolean mask of the stagePts within radius µm of an indexed item.
+
+        If drawnID is given, only items drawn on that map are considered.
+        """
+        stagePts = np.asarray(stagePts, dtype=float).reshape(-1, 2)
+        if len(self.stagePts) == 0 or len(stagePts) == 0:
+            return np.zeros(len(stagePts), dtype=bool)
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+
+            self._tree = cKDTree(self.stagePts)
+        if drawnID is None:
+            dist, _ = self._tree.query(stagePts, distance_upper_bound=radius)
+            return dist <= radius
+        result = np.zeros(len(stagePts), dtype=bool)
+        for i, neighbors in enumerate(self._tree.query_ball_point(stagePts, radius)):
+            result[i] = np.any(self.drawnIDs[neighbors] == drawnID)
+        return result
+
+
+@timed
+def skipExistingPts(
+    pts, mapItem, index: "NavPtsIndex", scale, radius, sameMapOnly=True
+):
+    """Return the pts found in mapItem that are not within radius µm of an item
+    in index.
+
+    With sameMapOnly, only items drawn on mapItem count as existing.
+    """
+    stagePts = mapPtsToStage(pts, mapItem, scale)
+    drawnID = int(mapItem["MapID"]) if sameMapOnly else None
+    existing = index.near(stagePts, radius, drawnID)
+    return [pt for pt, skip in zip(pts, existing) if not skip]
+
+
+@timed
+def navPtsToStage(navPts, mapItem, scale=1.0) -> "ndarray":
+    """Stage XY in µm of NavFilePoints made by ptsToNavPts, as an (N, 2) array."""
+    return mapPtsToStage([pt.CoordsInMap[:2] for pt in navPts], mapItem, scale)
+
+
+def setStageCoords(navPts, stagePts):
+    """Turn NavFilePoints into plain stage-coordinate items.
+
+    PtsX/PtsY and StageXYZ are set from stagePts and CoordsInMap is removed,
+    so SerialEM adds the items as they are instead of converting them.
+    """
+    for pt, (x, y) in zip(navPts, np.round(stagePts, 3).tolist()):
+        z = pt.CoordsInMap[2]
+        del pt.CoordsInMap
+        pt.PtsX = x
+        pt.PtsY = y
+        pt.StageXYZ = f"{x} {y} {z}"
+
+
+@timed
+def writeSidecar(path, navPts, stagePts, pixelPts=None):
+    """Write label, map pixel and stage coordinates of navPts to a .npy file
+    (as a structured array) or, for any other extension, a CSV file.
+
+    pixelPts defaults to the CoordsInMap of navPts.
+    """
+    table = np.empty(
+        len(navPts),
+        dtype=[
+            ("label", "U32"),
+            ("x", "f8"),
+            ("y", "f8"),
+            ("stageX", "f8"),
+            ("stageY", "f8"),
+        ],
+    )
+    table["label"] = [str(pt._label) for pt in navPts]
+    if pixelPts is None:
+        pixelPts = [pt.CoordsInMap[:2] for pt in navPts]
+    pixelPts = np.asarray(pixelPts).reshape(-1, 2)
+    table["x"], table["y"] = pixelPts.T
+    table["stageX"], table["stageY"] = np.asarray(stagePts).reshape(-1, 2).T
+    if path.endswith(".npy"):
+        np.save(path, table)
+    else:
+        np.savetxt(
+            path,
+            table,
+            fmt=["%s", "%g", "%g", "%.3f", "%.3f"],
+            delimiter=",",
+            header=",".join(table.dtype.names),
+            comments="",
+        )
@@ -2,13 +2,13 @@ from collections import namedtuple
 import logging
 import math
 
-import cv2
 import numpy as np
-import PIL
-from PIL import Image, ImageFilter
-import scipy
-from scipy.ndimage.filters import gaussian_filter, maximum_filter
-import skimage.filters
+
+from semmatch.roi import asRoi, cropToRoi
+from semmatch.timing import span, timed
+
+# OpenCV, SciPy, Pillow and scikit-image are imported by the functions that use
+# them, so each detector only pays for its own dependencies at startup
 
 # ubiquitous Point type
 Pt = namedtuple("Pt", "x y")
@@ -24,39 +24,102 @@ def squareDist(pt1, pt2):
     return (pt1.x - pt2.x) ** 2 + (pt1.y - pt2.y) ** 2
 
 
-# prevent including the same hole multiple times
-def pointsExistWithinRadius(center: "Pt", coords, radius):
+class TemplateMatches:
+    """Every match of a template in an image down to some score, best first.
+
+    A match is a local maximum of the correlation that isn't within the
+    template size of a better one, so the matches above a threshold are just
+    the first few and any threshold is applied without correlating again.
+    """
+
+    def __init__(self, pts, scores):
+        self.pts = pts
+        self.scores = scores
+
+    def above(self, threshold):
+        """Matches scoring at least threshold, best first."""
+        return self.pts[: int(np.count_nonzero(self.scores >= threshold))]
+
+
+def _suppress(candidates, radius):
+    """Indices of the candidates, best first, with no better one within radius.
+
+    Accepted points are binned on a grid of radius sized cells, so only the
+    neighbouring cells are checked for each candidate.
+    """
     radius_2 = radius ** 2
-    if len(coords) == 0:
-        return False
-    for pt in coords:
-        if squareDist(pt, center) < radius_2:
-            return True
-    return False
+    cells = {}
+    kept = []
+    for i, (x, y) in enumerate(candidates):
+        cx, cy = x // radius, y // radius
+        near = (
+            pt
+            for dx in (-1, 0, 1)
+            for dy in (-1, 0, 1)
+            for pt in cells.get((cx + dx, cy + dy), ())
+        )
+        if any((px - x) ** 2 + (py - y) ** 2 < radius_2 for px, py in near):
+            continue
+        cells.setdefault((cx, cy), []).append((x, y))
+        kept.append(i)
+    return kept
 
 
 # modified from OpenCV docs
 # https://docs.opencv.org/3.4/d4/dc6/tutorial_py_template_matching.html
-def templateMatch(
+@timed
+def templateMatches(
     image,
     template,
-    threshold,
+    minScore=0,
     downSample: int = 1,
     blurImage=False,
     blurTemplate=False,
     sigma=10,
-):
-    """Return a list of (x,y) pixel coordinates where cross-correlation between
-    the image and template surpass the threshold value.
+    progress=None,
+    roi=None,
+) -> "TemplateMatches":
+    """Correlate the template with the image and rank the matches scoring at
+    least minScore; see templateMatch for the arguments."""
+    import time
+
+    if roi is not None:
+        roi = asRoi(roi)
+        # room for the correlation window of anything that could suppress a
+        # match in the region, and for blurring
+        margin = 2 * max(template.shape[:2])
+        if blurImage:
+            margin += int(4 * sigma) + 1
+        crop, (dx, dy) = cropToRoi(image, roi, margin)
+        if crop.shape[0] < template.shape[0] or crop.shape[1] < template.shape[1]:
+            return TemplateMatches([], np.empty(0, np.float32))
+        matches = templateMatches(
+            crop,
+            template,
+            minScore,
+            downSample,
+            blurImage,
+            blurTemplate,
+            sigma,
+            progress,
+        )
+        pts = [Pt(x + dx, y + dy) for x, y in matches.pts]
+        inside = roi.contains(pts)
+        return TemplateMatches(
+            [pt for pt, keep in zip(pts, inside) if keep], matches.scores[inside]
+        )
 
-    To prevent double counting, the minimum distance between coordinates is
-    constrained to the length of the larger dimension of the template image.
+    import cv2
+    from scipy.ndimage import gaussian_filter, maximum_filter
 
-    Following SerialEM conventions, (0,0) is at the bottom-left corner,
-    with +x axis to the right and +y axis upwards.
+    start = time.perf_counter()
 
-    Images can be downsampled for faster computation and noise reduction.
-    """
+    def done(stage):
+        nonlocal start
+        if progress is not None:
+            now = time.perf_counter()
+            progress(stage, now - start)
+            start = now
 
     if len(image.shape) == 3:
         image = image[:, :, 0]
@@ -65,35 +128,73 @@ def templateMatch(
     image = image[::downSample, ::downSample]
     template = template[::downSample, ::downSample]
     if blurImage:
-        image = gaussian_filter(image, sigma=sigma)
+        with span("blur image"):
+            image = gaussian_filter(image, sigma=sigma)
+        done("blur image")
     if blurTemplate:
-        template = gaussian_filter(template, sigma=sigma)
+        with span("blur template"):
+            template = gaussian_filter(template, sigma=sigma)
+        done("blur template")
 
     # flip both arrays upsidedown for coordinate conventions
-    image = np.flip(image, 0).copy()
-    template = np.flip(template, 0).copy()
+    with span("flip"):
+        image = np.flip(image, 0).copy()
+        template = np.flip(template, 0).copy()
     h, w, *_ = template.shape
-    xcorrScores = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
-    maxfilter = maximum_filter(
-        xcorrScores, size=(template.shape[0] // 2, template.shape[1] // 2)
-    )
-    loc = zip(*np.where((xcorrScores >= threshold) & (xcorrScores == maxfilter)))
+    with span("matchTemplate"):
+        xcorrScores = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+    done("correlate")
+    with span("maximum_filter"):
+        maxfilter = maximum_filter(
+            xcorrScores, size=(template.shape[0] // 2, template.shape[1] // 2)
+        )
+    with span("peaks"):
+        ys, xs = np.nonzero((xcorrScores >= minScore) & (xcorrScores == maxfilter))
+        scores = xcorrScores[ys, xs]
+        # stable, so equal scores stay in row order
+        order = np.argsort(-scores, kind="stable")
+    with span("suppress"):
+        candidates = zip(
+            (xs[order] + w // 2).tolist(), (ys[order] + h // 2).tolist()
+        )
+        kept = order[_suppress(list(candidates), radius=max(h, w))]
+    # multiply back to get correct coordinates
+    matches = [
+        Pt(downSample * (int(x) + w // 2), downSample * (int(y) + h // 2))
+        for x, y in zip(xs[kept], ys[kept])
+    ]
+    done("find peaks")
+    return TemplateMatches(matches, scores[kept])
 
-    scoresIndex = [(x, y, xcorrScores[y][x]) for y, x in loc]
-    scoresIndex.sort(key=lambda a: a[2], reverse=True)
 
-    matches = []
-    for x, y, _ in scoresIndex:
-        x += w // 2
-        y += h // 2
-        if not pointsExistWithinRadius(Pt(x, y), matches, radius=max(h, w)):
-            matches.append(Pt(x, y))
-    # multiply back to get correct coordinates
-    matches = [Pt(downSample * x, downSample * y) for x, y in matches]
-    return matches
+def templateMatch(image, template, threshold, downSample: int = 1, **options):
+    """Return a list of (x,y) pixel coordinates where cross-correlation between
+    the image and template surpass the threshold value.
+
+    To prevent double counting, the minimum distance between coordinates is
+    constrained to the length of the larger dimension of the template image.
+
+    Following SerialEM conventions, (0,0) is at the bottom-left corner,
+    with +x axis to the right and +y axis upwards.
+
+    Images can be downsampled for faster computation and noise reduction.
+    Other options (blurImage, blurTemplate, sigma) are passed on to
+    templateMatches.
+
+    roi, a semmatch.roi.Roi or a list of polygons in the same coordinates as
+    the matches, restricts the search to the region; only its bounding box,
+    plus a margin the size of the template, is correlated.
+
+    progress, if given, is called with the name of each stage and the seconds
+    it took as soon as it is done; an exception it raises stops the search.
+    """
+    matches = templateMatches(image, template, threshold, downSample, **options)
+    return matches.pts
 
 
 def imresize(img: "ndarray", factor):
+    import PIL.Image
+
     return np.array(
         PIL.Image.fromarray(img).resize(
             size=(int(img.shape[1] * factor), int(img.shape[0] * factor)),
@@ -103,6 +204,7 @@ def imresize(img: "ndarray", factor):
 
 
 # https://pastebin.com/sBsPX4Y7
+@timed
 def anisodiff(
     img, niter=10, kappa=50, gamma=0.1, step=(1.0, 1.0), option=1, ploton=False
 ):
@@ -233,37 +335,59 @@ def anisodiff(
 
 
 def median_filt(img, radius=5):
+    from PIL import Image, ImageFilter
+
     return np.array(Image.fromarray(img).filter(ImageFilter.MedianFilter(size=radius)))
 
 
 def scharr(img):
+    import skimage.filters
+
     return (2000 * skimage.filters.scharr(img)).astype("uint8")
 
 
 def prefilter_before_hough(img):
     img = anisodiff(img, niter=20)
-    img = median_filt(img)
-    img = scharr(img)
+    with span("median_filt"):
+        img = median_filt(img)
+    with span("scharr"):
+        img = scharr(img)
     return img
 
 
-def houghCircles(img, pixelSize, param1=50, param2=60, minDistNm=600, minRadiusNm=600, maxRadiusNm=1300):
+@timed
+def houghCircles(img, pixelSize, param1=50, param2=60, minDistNm=600, minRadiusNm=600, maxRadiusNm=1300, roi=None):
+    import cv2
+
     minRadius = int(minRadiusNm / pixelSize)
     maxRadius = int(maxRadiusNm / pixelSize)
     minDist = int(minDistNm / pixelSize)
 
+    if roi is not None:
+        roi = asRoi(roi)
+        # the widest circle plus the prefiltering
+        crop, (dx, dy) = cropToRoi(img, roi, 2 * maxRadius + 32)
+        if crop.size == 0:
+            return []
+        pts = houghCircles(
+            crop, pixelSize, param1, param2, minDistNm, minRadiusNm, maxRadiusNm
+        )
+        pts = [(x + dx, y + dy) for x, y in pts]
+        return [pt for pt, keep in zip(pts, roi.contains(pts)) if keep]
+
     img = prefilter_before_hough(img)
 
-    circles = cv2.HoughCircles(
-        img,
-        cv2.HOUGH_GRADIENT,
-        dp=1,
-        minDist=minDist,
-        param1=param1,
-        param2=param2,
-        minRadius=minRadius,
-        maxRadius=maxRadius,
-    )
+    with span("HoughCircles"):
+        circles = cv2.HoughCircles(
+            img,
+            cv2.HOUGH_GRADIENT,
+            dp=1,
+            minDist=minDist,
+            param1=param1,
+            param2=param2,
+            minRadius=minRadius,
+            maxRadius=maxRadius,
+        )
     try:
         circles = np.uint16(np.around(circles))
     except Exception as e:
@@ -283,31 +407,58 @@ def to_binary(img, lower, upper):
     return ((lower < img) & (img < upper)).astype(np.uint8) * 255
 
 
-def find_segment_centers(labelled_img, num_features, maxPts):
-    results = []
-    segments = []
-    for label in range(1, num_features + 1):
-        segment = labelled_img == label
-        area = np.sum(segment)
-        segments.append((label, segment, area))
-    segments = sorted(segments, key=lambda x: x[2])[::-1][:maxPts]
-    for label, segment, _ in segments:
-        center = scipy.ndimage.measurements.center_of_mass(segment)
-        center = (int(center[0]), int(center[1]))
-        results.append(center)
-    return results
-
-
-def find_lacey_holes(img, maxPts, theshold_low, threshold_high):
-    binary_img = to_binary(
-        anisodiff(img, niter=30, kappa=20), theshold_low, threshold_high
-    )
-    img_erosion = cv2.erode(binary_img, np.ones((5, 5), np.uint8), iterations=1)
-    labelled_img, num_features = scipy.ndimage.measurements.label(img_erosion)
-    return find_segment_centers(labelled_img, num_features, maxPts)
-
-
-def laceySearch(img, maxPts, theshold_low, threshold_high):
-    pts = find_lacey_holes(img, maxPts, theshold_low, threshold_high)
+def find_segment_centers(labelled_img, num_features, maxPts, withAreas=False):
+    """(row, column) centers of the maxPts largest segments, largest first,
+    and with withAreas their areas in pixels."""
+    import scipy.ndimage
+
+    if num_features == 0:
+        return ([], []) if withAreas else []
+    # areas and centers of all the segments in a pass over the image each,
+    # rather than a full-size mask per segment
+    areas = np.bincount(labelled_img.ravel(), minlength=num_features + 1)[1:]
+    # equal areas in reverse label order, as sorted(...)[::-1] used to give
+    labels = (np.argsort(areas, kind="stable")[::-1][:maxPts] + 1).tolist()
+    centers = scipy.ndimage.center_of_mass(labelled_img > 0, labelled_img, labels)
+    centers = [(int(y), int(x)) for y, x in centers]
+    if withAreas:
+        return centers, areas[np.array(labels, int) - 1].tolist()
+    return centers
+
+
+def find_lacey_holes(img, maxPts, theshold_low, threshold_high, withAreas=False):
+    import cv2
+    import scipy.ndimage
+
+    diffused = anisodiff(img, niter=30, kappa=20)
+    with span("threshold"):
+        binary_img = to_binary(diffused, theshold_low, threshold_high)
+        img_erosion = cv2.erode(binary_img, np.ones((5, 5), np.uint8), iterations=1)
+    with span("label"):
+        labelled_img, num_features = scipy.ndimage.label(img_erosion)
+    with span("segment centers"):
+        return find_segment_centers(labelled_img, num_features, maxPts, withAreas)
+
+
+@timed
+def laceySearch(img, maxPts, theshold_low, threshold_high, roi=None, withAreas=False):
+    """Centers of the maxPts largest holes, largest first, and with withAreas
+    the areas in pixels of their segments."""
+    if roi is not None:
+        roi = asRoi(roi)
+        crop, (dx, dy) = cropToRoi(img, roi, 64)
+        if crop.size == 0:
+            return ([], []) if withAreas else []
+        # largest holes first, so the largest ones in the region are kept
+        pts, areas = laceySearch(
+            crop, None, theshold_low, threshold_high, withAreas=True
+        )
+        pts = [Pt(x + dx, y + dy) for x, y in pts]
+        keep = roi.contains(pts)
+        pts = [pt for pt, inside in zip(pts, keep) if inside][:maxPts]
+        areas = [area for area, inside in zip(areas, keep) if inside][:maxPts]
+        return (pts, areas) if withAreas else pts
+    found = find_lacey_holes(img, maxPts, theshold_low, threshold_high, withAreas)
+    pts, areas = found if withAreas else (found, None)
     pts_sem = [Pt(x, img.shape[0] - y) for y, x in pts]
-    return pts_sem
+    return (pts_sem, areas) if withAreas else pts_sem
@@ -4,8 +4,11 @@ import operator
 import random
 
 import numpy as np
-from sklearn.cluster import KMeans
 from semmatch.core import squareDist, Pt
+from semmatch.timing import timed
+
+# groupOptions grouping with k-means, which take seconds on thousands of points
+KMEANS_OPTIONS = (3, 4)
 
 
 # https://stackoverflow.com/a/51075698
@@ -34,6 +37,7 @@ def centroid(pts: "ndarray"):
     return Pt(sum_x / length, sum_y / length)
 
 
+@timed
 def closestPtToCentroid(pts):
     """Returns the coordinate closest to the center of mass"""
     center = centroid(np.array(pts))
@@ -47,6 +51,7 @@ def closestPtToCentroid(pts):
     return closestPoint
 
 
+@timed
 def greedyPathThroughPts(coords):
     """Returns a list with the first item being the left most coordinate,
        and successive items being the minimum distance from the previous item.
@@ -74,6 +79,7 @@ def greedyPathThroughPts(coords):
     return result
 
 
+@timed
 def makeGroupsOfPoints(pts, max_radius):
     max_radius_2 = max_radius ** 2
     groups = []
@@ -99,7 +105,10 @@ def makeGroupsOfPoints(pts, max_radius):
     return groups
 
 
+@timed
 def k_means(pts, k):
+    from sklearn.cluster import KMeans
+
     if len(pts) < k:
         print(
             "only %d points were found, which is less than %d (numGroups); setting number of groups to 1"
@@ -108,7 +117,8 @@ def k_means(pts, k):
         k = 1
         if len(pts) == 1:
             return [pts]
-    labels = KMeans(k).fit(pts).labels_
+    # seeded so the GUI shows the same groups that end up in the nav file
+    labels = KMeans(k, random_state=0).fit(pts).labels_
     groups = []
     for i in range(k):
         group = []
@@ -118,6 +128,38 @@ def k_means(pts, k):
             groups.append(group)
     return groups
 
+
+@timed
+def groupPts(pts, options: "NavOptions"):
+    """Split points into the groups they are labeled in, each one in the order
+    it is acquired.
+
+    groupOption 0 (no groups) and 2 (all points as one group) both give one
+    group with every point.
+    """
+    if options.groupOption == 1:  # groups by radius
+        groupRadiusPix = options.groupRadius * 1000 / options.pixelSize
+        return [
+            greedyPathThroughPts(group)
+            for group in makeGroupsOfPoints(pts, groupRadiusPix)
+        ]
+    if options.groupOption not in KMEANS_OPTIONS:
+        return [greedyPathThroughPts(pts)]
+
+    if options.groupOption == 3:  # numGroups
+        numGroups = options.numGroups
+    else:  # points per group
+        numGroups = max(len(pts) // options.ptsPerGroup, 1)
+    groups = []
+    for group in k_means(pts, numGroups):
+        groupLeader = closestPtToCentroid(group)
+        group.remove(groupLeader)
+        group = [groupLeader] + greedyPathThroughPts(group)
+        groups.append(group)
+    groups.sort(key=lambda group: group[0][0])  # sort by group leader's x position
+    return groups
+
+
 def getRandPts(pts, maxPts):
     try:
         return random.sample(pts, maxPts)
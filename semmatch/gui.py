@@ -1,7 +1,18 @@
+import collections
 import os
 import sys
-import time
-from PyQt5.QtCore import Qt, QRect, QSize, QPoint, QSettings
+from PyQt5.QtCore import (
+    Qt,
+    QRect,
+    QRectF,
+    QSize,
+    QPoint,
+    QPointF,
+    QSettings,
+    QThread,
+    QTimer,
+    pyqtSignal,
+)
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -24,9 +35,27 @@ from PyQt5.QtWidgets import (
     QSpinBox,
     QSizePolicy,
 )
-from PyQt5.QtGui import QImage, QPixmap, QKeySequence, QPainter, QBrush, QColor
-from semmatch.core import NavOptions, templateMatch
-from semmatch.image import npToQImage, qImgToNp, drawCoords
+from PyQt5.QtGui import (
+    QImage,
+    QPixmap,
+    QKeySequence,
+    QPainter,
+    QPen,
+    QBrush,
+    QColor,
+    QPolygonF,
+)
+from semmatch.core import NavOptions, templateMatches
+from semmatch.groups import KMEANS_OPTIONS, groupPts
+from semmatch.image import npToQImage, qImgToNp
+from semmatch.pyramid import ImagePyramid, MAX_LEVEL
+from semmatch.roi import Roi, rectangle
+
+
+# decimals of the threshold slider; searches rank the matches down to its
+# smallest nonzero step, since windows with no contrast score exactly 0
+THRESHOLD_DECIMALS = 3
+MIN_SCORE = 10**-THRESHOLD_DECIMALS
 
 
 # popup messages
@@ -36,7 +65,111 @@ def popup(parent, message):
     messagebox.show()
 
 
+class SearchCancelled(Exception):
+    pass
+
+
+class SearchWorker(QThread):
+    """Runs templateMatches off the GUI thread.
+
+    stageDone is emitted with the name and duration of each stage of the
+    search and found with the TemplateMatches scoring at least minScore, and
+    all the stage timings. After cancel, the search stops
+    at the end of the current stage without emitting found.
+    """
+
+    stageDone = pyqtSignal(str, float)
+    found = pyqtSignal(object, list)
+
+    def __init__(
+        self, image, template, minScore, blurImage, blurTemplate, roi=None, key=None
+    ):
+        super().__init__()
+        self.image = image
+        self.template = template
+        self.minScore = minScore
+        self.roi = roi
+        self.key = key
+        self.blurImage = blurImage
+        self.blurTemplate = blurTemplate
+        self.timings = []
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _progress(self, stage, seconds):
+        self.timings.append((stage, seconds))
+        self.stageDone.emit(stage, seconds)
+        if self.cancelled:
+            raise SearchCancelled
+
+    def run(self):
+        try:
+            matches = templateMatches(
+                self.image,
+                self.template,
+                self.minScore,
+                blurImage=self.blurImage,
+                blurTemplate=self.blurTemplate,
+                progress=self._progress,
+                roi=self.roi,
+            )
+        except SearchCancelled:
+            return
+        self.found.emit(matches, self.timings)
+
+
+class GroupWorker(QThread):
+    """Runs groupPts off the GUI thread, like SearchWorker a search.
+
+    grouped is emitted with the groups and the points and NavOptions they
+    were made from, so groups of points or options changed since can be
+    dropped.
+    """
+
+    grouped = pyqtSignal(object, list, object)
+
+    def __init__(self, pts, options):
+        super().__init__()
+        self.pts = pts
+        self.options = options
+
+    def run(self):
+        try:
+            groups = groupPts(list(self.pts), self.options)
+        except (TypeError, ZeroDivisionError):  # group radius or pixel size unset
+            groups = [self.pts]
+        self.grouped.emit(groups, self.pts, self.options)
+
+
+class _Canvas(QWidget):
+    """Draws the visible tiles of an ImageViewer's map at its zoom, then the
+    search region and markers on top in view coordinates."""
+
+    def __init__(self, viewer):
+        super().__init__()
+        self.viewer = viewer
+
+    def paintEvent(self, event):
+        viewer = self.viewer
+        if viewer.pyramid is None:
+            return
+        painter = QPainter(self)
+        viewer.paintTiles(painter, event.rect())
+        viewer.paintRoi(painter)
+        viewer.paintMarkers(painter, event.rect())
+        painter.end()
+
+
 class ImageViewer(QScrollArea):
+    MARKER_SIZE = 15
+    TILE_SIZE = 256
+    # 256 x 256 x 512 tiles is 32 MB of 8-bit pixmaps at most
+    MAX_TILES = 512
+    MIN_ZOOM = 1 / 64
+    MAX_ZOOM = 32
+
     def __init__(self):
         super().__init__()
         self.initUI()
@@ -44,12 +177,19 @@ class ImageViewer(QScrollArea):
     def initUI(self):
         self.zoom = 1
         self.originalImg = QImage()
-        self.activeImg = QImage()
-
-        # need QLabel to setPixmap for images
-        self.label = QLabel(self)
+        self.pyramid = None
+        self.tiles = collections.OrderedDict()
+        # groups of (x, y) points, (0,0) at the bottom-left corner
+        self.markerGroups = []
+        self.numberGroups = True
+        # polygons of the search region, and one being drawn, in the same
+        # coordinates as the points
+        self.roi = []
+        self.roiDraft = []
+
+        self.canvas = _Canvas(self)
         self._refresh()
-        self.setWidget(self.label)
+        self.setWidget(self.canvas)
 
     def _refresh(self):
         # save slider values to calculate new positions after zoom
@@ -65,33 +205,173 @@ class ImageViewer(QScrollArea):
         except ZeroDivisionError:
             vbarRatio = 0.5
 
-        # resize
-        img = self.activeImg.scaled(
-            self.zoom * self.activeImg.size(), aspectRatioMode=Qt.KeepAspectRatio
-        )
-        self.label.setPixmap(QPixmap(img))
-        self.label.resize(img.size())
-        self.label.repaint()
+        self._resizeCanvas()
 
         hbar.setValue(int(hbarRatio * hbar.maximum()))
         vbar.setValue(int(vbarRatio * vbar.maximum()))
 
-    def _setActiveImg(self, img):
-        self.activeImg = img
-        self._refresh()
+    def _resizeCanvas(self):
+        # only the tiles in view are ever scaled, when painted
+        self.canvas.resize(self.zoom * self.originalImg.size())
+        self.canvas.update()
 
     def newImg(self, img):
         self.zoom = 1
         self.originalImg = img
-        self._setActiveImg(self.originalImg)
+        if img.format() != QImage.Format_Grayscale8:
+            img = img.convertToFormat(QImage.Format_Grayscale8)
+        self.pyramid = ImagePyramid(qImgToNp(img))
+        self.tiles.clear()
+        self.markerGroups = []
+        self.roi = []
+        self.roiDraft = []
+        self._refresh()
+
+    def viewToImage(self, pos) -> QPointF:
+        """Image pixel (top row first) under a point of the viewport."""
+        return QPointF(
+            (self.horizontalScrollBar().value() + pos.x()) / self.zoom,
+            (self.verticalScrollBar().value() + pos.y()) / self.zoom,
+        )
+
+    def viewToPt(self, pos):
+        """(x, y) of a point of the viewport in the coordinates of the points,
+        with pixel centers at whole numbers and (0,0) at the bottom left."""
+        imagePos = self.viewToImage(pos)
+        height = self.originalImg.height()
+        return (imagePos.x() - 0.5, height - 0.5 - imagePos.y())
+
+    def _ptToCanvas(self, x, y) -> QPointF:
+        height = self.originalImg.height()
+        return QPointF((x + 0.5) * self.zoom, (height - 0.5 - y) * self.zoom)
+
+    def _tile(self, k, tx, ty):
+        key = (k, tx, ty)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        size = self.TILE_SIZE
+        level = self.pyramid.level(k)
+        tile = level[ty * size : (ty + 1) * size, tx * size : (tx + 1) * size]
+        pixmap = QPixmap.fromImage(npToQImage(tile))
+        self.tiles[key] = pixmap
+        if len(self.tiles) > self.MAX_TILES:
+            self.tiles.popitem(last=False)
+        return pixmap
+
+    def paintTiles(self, painter, rect):
+        """Draw the tiles under rect from the pyramid level closest to, but
+        not coarser than, the zoom."""
+        k = 0
+        while k < MAX_LEVEL and self.zoom * 2 ** (k + 1) <= 1:
+            k += 1
+        level = self.pyramid.level(k)
+        factor = 2**k
+        # the pyramid drops odd rows at the top of each level
+        top = self.originalImg.height() - level.shape[0] * factor
+        scale = self.zoom * factor
+        if scale < 1:
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+
+        size = self.TILE_SIZE
+        rows, cols = level.shape[:2]
+        x0 = max(int(rect.left() / scale) // size, 0)
+        x1 = min(int(rect.right() / scale) // size, (cols - 1) // size)
+        y0 = max(int((rect.top() / self.zoom - top) / factor) // size, 0)
+        y1 = min(
+            int((rect.bottom() / self.zoom - top) / factor) // size, (rows - 1) // size
+        )
+        for ty in range(y0, y1 + 1):
+            for tx in range(x0, x1 + 1):
+                pixmap = self._tile(k, tx, ty)
+                target = QRectF(
+                    tx * size * scale,
+                    (ty * size * factor + top) * self.zoom,
+                    pixmap.width() * scale,
+                    pixmap.height() * scale,
+                )
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+
+    def setMarkers(self, groups, numberGroups=True):
+        """Mark groups of points, each group in its own color. Groups are
+        numbered from 1 at their first point, or with numberGroups False,
+        every point is numbered."""
+        self.markerGroups = [list(group) for group in groups]
+        self.numberGroups = numberGroups
+        self.canvas.update()
+
+    def setRoi(self, polygons):
+        self.roi = [list(polygon) for polygon in polygons]
+        self.roiDraft = []
+        self.canvas.update()
+
+    def paintRoi(self, painter):
+        if not self.roi and not self.roiDraft:
+            return
+        painter.setPen(QPen(QColor(255, 255, 0), 2, Qt.DashLine))
+        for polygon in self.roi:
+            painter.drawPolygon(
+                QPolygonF([self._ptToCanvas(x, y) for x, y in polygon])
+            )
+        if self.roiDraft:
+            painter.drawPolyline(
+                QPolygonF([self._ptToCanvas(x, y) for x, y in self.roiDraft])
+            )
+
+    def paintMarkers(self, painter, rect):
+        if not self.markerGroups:
+            return
+        height = self.originalImg.height()
+        size = self.MARKER_SIZE
+        visible = rect.adjusted(-size, -size, size, size)
+        number = 1
+        for i, group in enumerate(self.markerGroups):
+            # golden angle steps keep neighbouring groups' colors apart
+            color = QColor.fromHsv(int(i * 137.5) % 360, 255, 255)
+            painter.setPen(QPen(color, 2))
+            for j, (x, y) in enumerate(group):
+                viewX = (x + 0.5) * self.zoom
+                viewY = (height - 1 - y + 0.5) * self.zoom
+                if visible.contains(int(viewX), int(viewY)):
+                    center = QPointF(viewX, viewY)
+                    painter.drawLine(
+                        center - QPointF(size, 0), center + QPointF(size, 0)
+                    )
+                    painter.drawLine(
+                        center - QPointF(0, size), center + QPointF(0, size)
+                    )
+                    if not self.numberGroups or j == 0:
+                        painter.drawText(center + QPointF(4, -4), str(number))
+                if not self.numberGroups:
+                    number += 1
+            number += self.numberGroups
+
+    def setZoom(self, zoom, anchor=None):
+        """Zoom to zoom, keeping the image point under the viewport position
+        anchor where it is, or the same fraction of the image in view."""
+        zoom = min(max(zoom, self.MIN_ZOOM), self.MAX_ZOOM)
+        if anchor is None:
+            self.zoom = zoom
+            self._refresh()
+            return
+        imagePos = self.viewToImage(anchor)
+        self.zoom = zoom
+        self._resizeCanvas()
+        self.horizontalScrollBar().setValue(int(imagePos.x() * zoom - anchor.x()))
+        self.verticalScrollBar().setValue(int(imagePos.y() * zoom - anchor.y()))
+
+    def wheelEvent(self, event):
+        # 120 is one notch; touchpads send smaller steps
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.setZoom(self.zoom * 1.25**steps, anchor=event.pos())
+        event.accept()
 
     def zoomIn(self):
-        self.zoom *= 1.25
-        self._refresh()
+        self.setZoom(self.zoom * 1.25)
 
     def zoomOut(self):
-        self.zoom *= 0.8
-        self._refresh()
+        self.setZoom(self.zoom * 0.8)
 
 
 class ImageViewerCrop(ImageViewer):
@@ -108,21 +388,22 @@ class ImageViewerCrop(ImageViewer):
     def __init__(self):
         super().__init__()
         self.image = None
-        self.searchedImg = QImage()
+        self.rband = None
 
     def loadImage(self, image: "ndarray"):
-        self.zoom = 1
         self.image = image
-        self.originalImg = npToQImage(image)
+        self.newImg(npToQImage(image))
         self.parentWidget().sidebar._clearPts()
 
-        self.zoom = 1
         hsb = self.horizontalScrollBar()
         vsb = self.verticalScrollBar()
         hsb.setValue((hsb.minimum() + hsb.maximum()) // 2)
         vsb.setValue((vsb.minimum() + vsb.maximum()) // 2)
         self._refresh()
 
+    def _drawingRoi(self):
+        return self.parentWidget().sidebar.cbDrawRoi.isChecked()
+
     def mousePressEvent(self, mouseEvent):
         self.shiftPressed = QApplication.keyboardModifiers() == Qt.ShiftModifier
         self.center = mouseEvent.pos()
@@ -131,6 +412,11 @@ class ImageViewerCrop(ImageViewer):
         self.rband.show()
 
     def mouseMoveEvent(self, mouseEvent):
+        if self._drawingRoi():
+            # region rectangles are dragged from corner to corner
+            self.rband.setGeometry(QRect(self.center, mouseEvent.pos()).normalized())
+            self.repaint()
+            return
         # unnormalized QRect can have negative width/height
         crop = QRect(2 * self.center - mouseEvent.pos(), mouseEvent.pos()).normalized()
         if self.shiftPressed:
@@ -145,22 +431,49 @@ class ImageViewerCrop(ImageViewer):
             self.rband.setGeometry(crop)
         self.repaint()
 
+    def mouseDoubleClickEvent(self, mouseEvent):
+        # the click before this one added the last vertex
+        if self._drawingRoi() and len(self.roiDraft) >= 3:
+            self.setRoi(self.roi + [self.roiDraft])
+            self.parentWidget().sidebar._roiChanged()
+        self.rband = None
+
+    def _releaseRoi(self, area, pos):
+        if area.height() < 10 and area.width() < 10:
+            # a click adds a vertex to the polygon being drawn
+            self.roiDraft.append(self.viewToPt(pos))
+            self.canvas.update()
+            return
+        x0, y0 = self.viewToPt(area.bottomLeft())
+        x1, y1 = self.viewToPt(area.topRight())
+        self.setRoi(self.roi + [rectangle(x0, y0, x1, y1)])
+        self.parentWidget().sidebar._roiChanged()
+
     def mouseReleaseEvent(self, mouseEvent):
+        if self.rband is None:  # release of a double click
+            return
         self.rband.hide()
         crop = self.rband.geometry()
         if self.originalImg.isNull():  # no image loaded in
             return
+        if self._drawingRoi():
+            self._releaseRoi(crop, mouseEvent.pos())
+            return
         # handle single click initializing default QRect selecting entire image
         if crop.height() < 10 and crop.width() < 10:
             return
         # calculate X and Y position in original image
-        X = int((self.horizontalScrollBar().value() + crop.x()) / self.zoom)
-        Y = int((self.verticalScrollBar().value() + crop.y()) / self.zoom)
+        topLeft = self.viewToImage(crop.topLeft())
         origScaleCropWidth = int(crop.width() / self.zoom)
         origScaleCropHeight = int(crop.height() / self.zoom)
         # save crop
         cropQImage = self.originalImg.copy(
-            QRect(X, Y, origScaleCropWidth, origScaleCropHeight)
+            QRect(
+                int(topLeft.x()),
+                int(topLeft.y()),
+                origScaleCropWidth,
+                origScaleCropHeight,
+            )
         )
         sidebar = self.parentWidget().sidebar
         sidebar.crop_template.newImg(cropQImage)
@@ -174,7 +487,7 @@ class Sidebar(QWidget):
     def initUI(self):
         self.width = 230
         self.setFixedWidth(self.width)
-        self.sldPrec = 3
+        self.sldPrec = THRESHOLD_DECIMALS
         self.thresholdVal = 0.8
 
         # widgets
@@ -185,6 +498,7 @@ class Sidebar(QWidget):
         self.slider = QSlider(Qt.Horizontal)
         self.slider.setMaximum(10 ** self.sldPrec)
         self.slider.valueChanged.connect(self._setThreshDisp)
+        self.slider.sliderReleased.connect(self._showPts)
         self.slider.setFixedHeight(25)
         self.threshDisp = QDoubleSpinBox()
         self.threshDisp.setFixedHeight(40)
@@ -195,12 +509,35 @@ class Sidebar(QWidget):
         buttonSearch = QPushButton("Search")
         buttonSearch.clicked.connect(self._templateSearch)
         buttonSearch.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.MinimumExpanding)
+        self.buttonCancel = QPushButton("Cancel")
+        self.buttonCancel.clicked.connect(self._cancelSearch)
+        self.buttonCancel.setShortcut(Qt.Key_Escape)
+        self.buttonCancel.setEnabled(False)
         self.searchLay = QGridLayout()
         self.searchLay.addWidget(self.slider, 0, 0, 1, 3)
         self.searchLay.addWidget(self.threshDisp, 1, 0, 1, 2)
         self.searchLay.addWidget(buttonSearch, 1, 2)
+        self.searchLay.addWidget(self.buttonCancel, 2, 2)
+        self.searchWorker = None
+        self.searchAgain = False
+        self.groupWorker = None
+        self.groupAgain = False
+        # matches of the last search at every threshold, and what was searched
+        self.matches = None
+        self.matchesKey = None
+        self.threshDisp.valueChanged.connect(self._thresholdChanged)
+        # changing a setting during a search restarts it with the new value
+        self.cbBlurImg.toggled.connect(self._searchSettingChanged)
+        self.cbBlurTemp.toggled.connect(self._searchSettingChanged)
         buttonClearPts = QPushButton("Clear Points")
         buttonClearPts.clicked.connect(self._clearPts)
+        self.cbDrawRoi = QCheckBox("Draw search region")
+        self.cbDrawRoi.setToolTip(
+            "drag for a rectangle, or click the corners of a polygon and"
+            " double-click to close it; only the regions drawn are searched"
+        )
+        buttonClearRoi = QPushButton("Clear Region")
+        buttonClearRoi.clicked.connect(self._clearRoi)
 
         self.cbAcquire = QCheckBox("Acquire")
         self.cmboxGroupPts = QComboBox()
@@ -258,6 +595,8 @@ class Sidebar(QWidget):
         vlay.addWidget(QLabel())
         vlay.addLayout(self.searchLay)
         vlay.addWidget(buttonClearPts)
+        vlay.addWidget(self.cbDrawRoi)
+        vlay.addWidget(buttonClearRoi)
         vlay.addWidget(QLabel())
         vlay.addWidget(self.cbAcquire)
         vlay.addWidget(QLabel("Grouping option"))
@@ -296,6 +635,20 @@ class Sidebar(QWidget):
         except ValueError:
             pass
 
+    def _statusBar(self):
+        return self.parentWidget().parentWidget().statusBar()
+
+    def _searchKey(self):
+        """What a search depends on, other than the threshold."""
+        viewer = self.parentWidget().viewer
+        return (
+            viewer.originalImg.cacheKey(),
+            self.crop_template.originalImg.cacheKey(),
+            self.cbBlurImg.isChecked(),
+            self.cbBlurTemp.isChecked(),
+            tuple(tuple(polygon) for polygon in viewer.roi),
+        )
+
     def _templateSearch(self):
         template = self.crop_template.originalImg
         image = self.parentWidget().viewer.originalImg
@@ -303,35 +656,167 @@ class Sidebar(QWidget):
             popup(self, "either image or template missing")
             return
 
-        self.parentWidget().parentWidget().statusBar().showMessage("searching...")
-        startTime = time.time()
-        global pts
-        pts = templateMatch(
+        if self.searchWorker is None and self.matchesKey == self._searchKey():
+            # only the threshold changed since the last search
+            self._applyThreshold()
+            return
+
+        if self.searchWorker is not None:
+            # start over with the current settings once this search stops
+            self.searchWorker.cancel()
+            self.searchAgain = True
+            self._statusBar().showMessage("restarting search...")
+            return
+
+        roi = self.parentWidget().viewer.roi
+        worker = SearchWorker(
             qImgToNp(image),
             qImgToNp(template),
-            self.thresholdVal,
-            blurImage=self.cbBlurImg.isChecked(),
-            blurTemplate=self.cbBlurTemp.isChecked(),
+            MIN_SCORE,
+            self.cbBlurImg.isChecked(),
+            self.cbBlurTemp.isChecked(),
+            roi=Roi(roi) if roi else None,
+            key=self._searchKey(),
         )
-        endTime = time.time()
-
-        viewer = self.parentWidget().viewer
-        viewer.searchedImg = drawCoords(viewer.originalImg, pts)
-        viewer._setActiveImg(viewer.searchedImg)
+        worker.stageDone.connect(self._searchProgress)
+        worker.found.connect(self._searchDone)
+        worker.finished.connect(self._searchFinished)
+        self.searchWorker = worker
+        self.buttonCancel.setEnabled(True)
+        self._statusBar().showMessage("searching...")
+        worker.start()
+
+    def _searchProgress(self, stage, seconds):
+        if not self.searchWorker.cancelled:
+            self._statusBar().showMessage(
+                "searching... %s took %.2f sec" % (stage, seconds)
+            )
 
-        self.parentWidget().parentWidget().statusBar().showMessage(
-            "%d matches found in %.2f sec" % (len(pts), endTime - startTime)
+    def _searchDone(self, matches, timings):
+        if self.searchWorker.cancelled:
+            return
+        self.matches = matches
+        self.matchesKey = self.searchWorker.key
+        self._applyThreshold()
+
+        self._statusBar().showMessage(
+            "%d matches found in %.2f sec (%s)"
+            % (
+                len(pts),
+                sum(seconds for _, seconds in timings),
+                ", ".join("%s %.2f" % timing for timing in timings),
+            )
         )
 
         self.repaint()
 
+    def _searchFinished(self):
+        self.searchWorker.wait()
+        self.searchWorker = None
+        self.buttonCancel.setEnabled(False)
+        if self.searchAgain:
+            self.searchAgain = False
+            self._templateSearch()
+
+    def setMatches(self, matches):
+        """Show matches found in advance for the current map and settings."""
+        self.matches = matches
+        self.matchesKey = self._searchKey()
+        self._applyThreshold()
+
+    def _applyThreshold(self):
+        """Show the last search's matches above the current threshold."""
+        global pts
+        pts = self.matches.above(self.thresholdVal)
+        viewer = self.parentWidget().viewer
+        if not pts:
+            viewer.setMarkers([])
+        elif self.slider.isSliderDown():
+            # grouping can take longer than a slider step, so it waits for
+            # the slider to be let go
+            viewer.setMarkers([pts], numberGroups=False)
+        else:
+            self._showPts()
+        self._statusBar().showMessage(
+            "%d matches above %.3f" % (len(pts), self.thresholdVal)
+        )
+
+    def _thresholdChanged(self):
+        # no need to correlate again, unless something else changed too
+        if self.searchWorker is None and self.matchesKey == self._searchKey():
+            self._applyThreshold()
+
+    def _searchSettingChanged(self):
+        if self.searchWorker is not None:
+            self._templateSearch()
+
+    def _cancelSearch(self):
+        if self.searchWorker is not None:
+            self.searchWorker.cancel()
+            self.searchAgain = False
+            self._statusBar().showMessage("search cancelled")
+
+    def _showPts(self):
+        """Mark the points found, grouped the way they will be saved."""
+        global pts
+        global navOptions
+        if not pts:
+            return
+        viewer = self.parentWidget().viewer
+        if navOptions.groupOption in KMEANS_OPTIONS:
+            # k-means takes too long for the GUI thread; the points are shown
+            # ungrouped until it's done
+            viewer.setMarkers([pts], numberGroups=False)
+            self._groupInBackground()
+            return
+        try:
+            groups = groupPts(pts, navOptions)
+        except (TypeError, ZeroDivisionError):  # group radius or pixel size unset
+            groups = [pts]
+        viewer.setMarkers(groups, numberGroups=navOptions.groupOption != 0)
+
+    def _groupInBackground(self):
+        if self.groupWorker is not None:
+            # group the current points once this grouping is done
+            self.groupAgain = True
+            return
+        worker = GroupWorker(list(pts), navOptions)
+        worker.grouped.connect(self._groupsDone)
+        worker.finished.connect(self._groupFinished)
+        self.groupWorker = worker
+        worker.start()
+
+    def _groupsDone(self, groups, groupedPts, options):
+        # drop the groups if the points or options changed meanwhile
+        if groupedPts == pts and options == navOptions:
+            self.parentWidget().viewer.setMarkers(groups, numberGroups=True)
+
+    def _groupFinished(self):
+        self.groupWorker.wait()
+        self.groupWorker = None
+        if self.groupAgain:
+            self.groupAgain = False
+            self._showPts()
+
+    def _stopGrouping(self):
+        if self.groupWorker is not None:
+            self.groupAgain = False
+            self.groupWorker.wait()
+
+    def _roiChanged(self):
+        # a search in progress restarts with the new region
+        self._searchSettingChanged()
+
+    def _clearRoi(self):
+        self.parentWidget().viewer.setRoi([])
+        self._roiChanged()
+
     def _clearPts(self):
         global pts
         pts = []
-        viewer = self.parentWidget().viewer
-        viewer._setActiveImg(viewer.originalImg)
-        viewer.searchedImg = QImage()
-        viewer._refresh()
+        self.matches = None
+        self.matchesKey = None
+        self.parentWidget().viewer.setMarkers([])
         self.parentWidget().parentWidget().statusBar().clearMessage()
 
     def saveAndQuit(self):
@@ -344,6 +829,10 @@ class Sidebar(QWidget):
             navOptions.ptsPerGroup,
             int(self.cbAcquire.isChecked()),
         )
+        if self.searchWorker is not None:
+            self._cancelSearch()
+            self.searchWorker.wait()
+        self._stopGrouping()
         global pts
         global finalPts
         finalPts = pts
@@ -368,6 +857,7 @@ class Sidebar(QWidget):
             navOptions.ptsPerGroup,
             navOptions.acquire,
         )
+        self._showPts()
 
     def _setPixelSize(self, s: str):
         try:
@@ -387,6 +877,7 @@ class Sidebar(QWidget):
             navOptions.ptsPerGroup,
             navOptions.acquire,
         )
+        self._showPts()
 
     def _setNumGroups(self, numGroups):
         global navOptions
@@ -399,6 +890,7 @@ class Sidebar(QWidget):
             navOptions.acquire,
         )
         self.numGroupsSB.setValue(navOptions.numGroups)
+        self._showPts()
 
     def _setPtsPerGroup(self, ptsPerGroup):
         global navOptions
@@ -411,6 +903,7 @@ class Sidebar(QWidget):
             navOptions.acquire,
         )
         self.ptsPerGroupSB.setValue(navOptions.ptsPerGroup)
+        self._showPts()
 
     def _selectGroupOption(self, groupOption):
         global navOptions
@@ -466,6 +959,7 @@ class Sidebar(QWidget):
             self.numGroupsSB.hide()
             self.ptsPerGroupLabel.hide()
             self.ptsPerGroupSB.hide()
+        self._showPts()
         self.repaint()
 
     def _refreshNavOptions(self):
@@ -497,6 +991,9 @@ class MainWidget(QWidget):
     def openImage(self, image):
         self.viewer.loadImage(image)
 
+    def setRoi(self, polygons):
+        self.viewer.setRoi(polygons)
+
     def setTemplate(self, template):
         self.sidebar.crop_template.newImg(npToQImage(template))
 
@@ -544,6 +1041,9 @@ class MainWindow(QMainWindow):
     def openImage(self, image):
         self.root.openImage(image)
 
+    def setRoi(self, polygons):
+        self.root.setRoi(polygons)
+
     def setTemplate(self, template):
         self.root.setTemplate(template)
 
@@ -600,8 +1100,178 @@ class MainWindow(QMainWindow):
         settings.endGroup()
 
 
+class ReviewWindow(MainWindow):
+    """MainWindow stepping through the maps of a review.Prefetcher.
+
+    Accept (A) keeps the points shown for the current map and Skip (S) drops
+    them; both go on to the next map, or end the session after the last one.
+    The maps are searched in advance with the blur options given and the
+    template of templates for the reduction they were read at.
+    """
+
+    def __init__(self, maps, templates, blurImage, blurTemplate):
+        self.maps = maps
+        self.templates = templates
+        self.blurImage = blurImage
+        self.blurTemplate = blurTemplate
+        self.current = -1
+        # (map index, points, image width, NavOptions) of each accepted map
+        self.accepted = []
+        self.prefetched = None
+        super().__init__()
+        # cacheKey of the template shown for each reduction
+        self.templateKeys = {}
+        self.waitTimer = QTimer(self)
+        self.waitTimer.setInterval(50)
+        self.waitTimer.timeout.connect(self._showWhenReady)
+
+    def initUI(self):
+        super().initUI()
+        reviewMenu = self.menuBar().addMenu("Review")
+        accept = QAction("Accept", self)
+        accept.setShortcut(Qt.Key_A)
+        accept.triggered.connect(self.accept)
+        skip = QAction("Skip", self)
+        skip.setShortcut(Qt.Key_S)
+        skip.triggered.connect(self.nextMap)
+        reviewMenu.addAction(accept)
+        reviewMenu.addAction(skip)
+
+    def start(self):
+        # matches found in advance are for the templates given at the start
+        if self.templates:
+            self.templateKeys[min(self.templates)] = self._templateKey()
+        self.nextMap()
+
+    def _templateKey(self):
+        return self.root.sidebar.crop_template.originalImg.cacheKey()
+
+    def _useMapTemplate(self, reduction):
+        """Show the template a map read at reduction was searched with,
+        unless the template was changed during the session; False if it was
+        or there is none."""
+        if reduction not in self.templates:
+            return False
+        key = self._templateKey()
+        if key not in self.templateKeys.values():
+            return False
+        if self.templateKeys.get(reduction) != key:
+            self.setTemplate(self.templates[reduction])
+            self.templateKeys[reduction] = self._templateKey()
+        return True
+
+    def acceptCurrent(self):
+        global pts
+        global navOptions
+        if self.prefetched is None or not pts:
+            return
+        options = navOptions._replace(
+            acquire=int(self.root.sidebar.cbAcquire.isChecked())
+        )
+        width = self.root.viewer.originalImg.width()
+        self.accepted.append((self.current, list(pts), width, options))
+
+    def accept(self):
+        if self.prefetched is not None:
+            self.acceptCurrent()
+            self.nextMap()
+
+    def nextMap(self):
+        if self.waitTimer.isActive():
+            return
+        sidebar = self.root.sidebar
+        if sidebar.searchWorker is not None:
+            sidebar._cancelSearch()
+        self.prefetched = None
+        self.current += 1
+        if self.current >= len(self.maps):
+            sidebar._stopGrouping()
+            QApplication.quit()
+            return
+        self._showWhenReady()
+
+    def _showWhenReady(self):
+        prefetched = self.maps.poll(self.current)
+        label = self.maps.label(self.current)
+        if prefetched is None:
+            self.statusBar().showMessage("waiting for %s..." % label)
+            self.waitTimer.start()
+            return
+        self.waitTimer.stop()
+        if prefetched.error is not None:
+            print("could not read map %s: %s; skipping" % (label, prefetched.error))
+            self.nextMap()
+            return
+
+        self.setWindowTitle(
+            "semmatch review: %s (%d of %d)"
+            % (label, self.current + 1, len(self.maps))
+        )
+        self.openImage(prefetched.image)
+        if prefetched.roi:
+            self.setRoi(prefetched.roi)
+        sidebar = self.root.sidebar
+        sidebar._setPixelSize(str(prefetched.pixelSize))
+        self.prefetched = prefetched
+        if prefetched.matches is None:
+            global pts
+            pts = list(prefetched.pts)
+            sidebar._showPts()
+            self.statusBar().showMessage("%d points found" % len(pts))
+        elif (
+            self._useMapTemplate(prefetched.reduction)
+            and sidebar.cbBlurImg.isChecked() == self.blurImage
+            and sidebar.cbBlurTemp.isChecked() == self.blurTemplate
+        ):
+            sidebar.setMatches(prefetched.matches)
+        else:
+            # the template or blur options were changed during the session
+            sidebar._templateSearch()
+
+
+def review(maps, templates, threshold, options: "NavOptions", blurImage, blurTemplate):
+    """Review the maps of a review.Prefetcher in one window and return the
+    (map index, points, image width, NavOptions) of each map accepted.
+
+    templates is the template by the reduction maps are read at, as
+    batch.readTemplates returns them."""
+    global inputThreshold
+    inputThreshold = threshold
+
+    global navOptions
+    navOptions = options
+
+    global pts
+    pts = []
+
+    global finalPts
+    finalPts = []
+
+    QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
+    app = QApplication([])
+    w = ReviewWindow(maps, templates, blurImage, blurTemplate)
+    w.setBlurImage(blurImage)
+    w.setBlurTemplate(blurTemplate)
+    if templates:
+        w.setTemplate(templates[min(templates)])
+    QTimer.singleShot(0, w.start)
+
+    app.exec_()
+
+    if finalPts:
+        # Save and Quit keeps the map shown too
+        w.acceptCurrent()
+    return w.accepted
+
+
 def main(
-    image, template, threshold, options: "NavOptions", blurImage=True, blurTemplate=True
+    image,
+    template,
+    threshold,
+    options: "NavOptions",
+    blurImage=True,
+    blurTemplate=True,
+    roi=None,
 ):
     global inputThreshold
     inputThreshold = threshold
@@ -619,6 +1289,8 @@ def main(
     app = QApplication([])
     w = MainWindow()
     w.openImage(image)
+    if roi:
+        w.setRoi(roi)
     if template is not None:
         w.setTemplate(template)
         w.search()
@@ -1,44 +1,77 @@
-import io
-import cv2
 import numpy as np
-import PIL
-import PIL.ImageQt
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import QBuffer
+import PIL.Image
+from PyQt5 import sip
+from PyQt5.QtGui import QImage
 
 # Unset PIL max size
 PIL.Image.MAX_IMAGE_PIXELS = None
 
+# QImage formats whose pixels are plain uint8 arrays, by number of channels
+_FORMATS = {
+    1: QImage.Format_Grayscale8,
+    3: QImage.Format_RGB888,
+    4: QImage.Format_RGBA8888,
+}
+_CHANNELS = {
+    QImage.Format_Grayscale8: 1,
+    QImage.Format_RGB888: 3,
+    QImage.Format_RGBA8888: 4,
+    QImage.Format_RGBX8888: 4,
+}
 
-def npToQImage(ndArr):
-    pilImageQt = PIL.ImageQt.ImageQt(PIL.Image.fromarray(ndArr))
-    return QPixmap.fromImage(pilImageQt).toImage()
 
+class _QImageBuffer:
+    """Array interface over a QImage's pixels that keeps the QImage alive."""
 
-def qImgToPilRGBA(qimg):
-    buf = QBuffer()
-    buf.open(QBuffer.ReadWrite)
-    qimg.save(buf, "PNG")
-    return PIL.Image.open(io.BytesIO(buf.data().data())).convert("RGBA")
+    def __init__(self, qimg, writable):
+        channels = _CHANNELS[qimg.format()]
+        ptr = qimg.bits() if writable else qimg.constBits()
+        shape = (qimg.height(), qimg.width(), channels)
+        strides = (qimg.bytesPerLine(), channels, 1)
+        if channels == 1:
+            shape, strides = shape[:2], strides[:2]
+        self.qimg = qimg
+        self.__array_interface__ = {
+            "shape": shape,
+            "typestr": "|u1",
+            "data": (int(ptr), not writable),
+            "strides": strides,
+            "version": 3,
+        }
 
 
-def qImgToNp(qimg):
-    return np.array(qImgToPilRGBA(qimg))
+def npToQImage(ndArr) -> QImage:
+    """QImage sharing the memory of a uint8 (H, W) grayscale, (H, W, 3) RGB or
+    (H, W, 4) RGBA array.
 
+    Arrays whose rows aren't contiguous are copied first. The QImage keeps the
+    array alive, but copies Qt makes of it don't; use QImage.copy() for an
+    image that outlives this one.
+    """
+    ndArr = np.asarray(ndArr, dtype=np.uint8)
+    channels = 1 if ndArr.ndim == 2 else ndArr.shape[2]
+    if ndArr.strides[1:] != ((channels, 1) if channels > 1 else (1,)):
+        ndArr = np.ascontiguousarray(ndArr)
+    height, width = ndArr.shape[:2]
+    qimg = QImage(
+        sip.voidptr(ndArr.ctypes.data),
+        width,
+        height,
+        ndArr.strides[0],
+        _FORMATS[channels],
+    )
+    qimg._ndArr = ndArr
+    return qimg
 
-def drawCross(img: "ndarray", x, y):
-    red = (255, 0, 0, 255)
-    thickness = 2
-    cv2.line(img, (x - 15, y), (x + 15, y), red, thickness)
-    cv2.line(img, (x, y - 15), (x, y + 15), red, thickness)
 
+def qImgToNp(qimg, writable=False) -> "ndarray":
+    """Array view of a QImage's pixels: (H, W) for grayscale images, (H, W, 3)
+    for RGB888 and (H, W, 4) RGBA otherwise.
 
-def drawCrosses(img: "ndarray", coords):
-    img = np.flip(img, 0).copy()
-    for x, y in coords:
-        drawCross(img, x, y)
-    return np.flip(img, 0).copy()
-
-
-def drawCoords(qimg, coords):
-    return npToQImage(drawCrosses(qImgToNp(qimg), coords))
+    Other formats are converted to RGBA first, which copies them. The array
+    keeps the QImage alive; it is read-only unless writable is set, which
+    makes the QImage detach from any image it shares its pixels with.
+    """
+    if qimg.format() not in _CHANNELS:
+        qimg = qimg.convertToFormat(QImage.Format_RGBA8888)
+    return np.asarray(_QImageBuffer(qimg, writable))
@@ -0,0 +1,189 @@
+"""Memory use of a run: measured per stage, and estimated before it starts.
+
+profiling() (see semmatch.timing) records for every span the peak RSS of the
+process by the time the stage ended, which shows the stage at which a run
+that ran out of memory would have died, including memory that OpenCV
+allocates outside Python's view. With memory=True it also records the most
+memory the stage had allocated at once on top of what it started with, as
+traced by tracemalloc (NumPy's arrays included), which bounds the stage's
+largest allocation.
+
+estimateMemory works out how much a search of a map will need from the size
+of its image file alone, so a run that wouldn't fit can be refused, or
+searched piece by piece, before the map is read.
+"""
+
+import os
+import sys
+
+# peak bytes allocated per pixel of the searched pyramid level, measured on
+# the synthetic maps of semmatch.bench: the blurred and flipped copies, the
+# float32 correlation and its maximum_filter for template matching, and the
+# float32 scratch arrays of anisodiff for the other two
+SEARCH_BYTES_PER_PIXEL = {"template": 22, "hough": 48, "lacey": 48}
+# peak bytes per pixel and band of decoding a JPEG, TIFF or PNG with imageio,
+# which holds Pillow's copy and NumPy's at once
+DECODE_BYTES_PER_PIXEL = 3.2
+
+
+def peakRss():
+    """Peak resident set size of this process in bytes, or None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return _windowsPeakRss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _windowsPeakRss():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    try:
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(
+            process, ctypes.byref(counters), counters.cb
+        ):
+            return None
+    except (AttributeError, OSError):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def availableMemory():
+    """Bytes of physical memory available to a new allocation, or None if
+    unknown."""
+    if sys.platform == "win32":
+        return _windowsAvailableMemory()
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        # total rather than free memory on macOS, which counts its file cache
+        # as used
+        pages = os.sysconf(
+            "SC_AVPHYS_PAGES" if sys.platform != "darwin" else "SC_PHYS_PAGES"
+        )
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _windowsAvailableMemory():
+    import ctypes
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [
+            ("dwLength", ctypes.c_ulong),
+            ("dwMemoryLoad", ctypes.c_ulong),
+            ("ullTotalPhys", ctypes.c_ulonglong),
+            ("ullAvailPhys", ctypes.c_ulonglong),
+            ("ullTotalPageFile", ctypes.c_ulonglong),
+            ("ullAvailPageFile", ctypes.c_ulonglong),
+            ("ullTotalVirtual", ctypes.c_ulonglong),
+            ("ullAvailVirtual", ctypes.c_ulonglong),
+            ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+        ]
+
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(status)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return None
+    return status.ullAvailPhys
+
+
+def searchMethod(args):
+    """Name of the detector args select: template, hough or lacey."""
+    if args.houghCircles:
+        return "hough"
+    if args.laceySearch:
+        return "lacey"
+    return "template"
+
+
+def estimateSearch(shape, method, level=0, bands=1, mrc=False, roi=None):
+    """Bytes needed to decode an image of shape (height, width) and search it
+    with method at pyramid level.
+
+    bands is the number of color channels the image file has; an image read
+    from an MRC file (mrc) is converted to 8 bits a block of rows at a time,
+    without a decoded copy. roi, a Roi in the image's pixels, limits the
+    search to its bounding box.
+    """
+    height, width = shape[:2]
+    pixels = height * width
+    needed = pixels if mrc else pixels * bands * DECODE_BYTES_PER_PIXEL
+    # the binned levels, and the 16-bit sums each is averaged from
+    needed += sum(3 * pixels // 4**k for k in range(1, level + 1))
+    if roi is not None:
+        xmin, ymin, xmax, ymax = roi.bounds()
+        width = min(max(xmax - xmin + 1, 0), width)
+        height = min(max(ymax - ymin + 1, 0), height)
+    searched = (height / 2**level) * (width / 2**level)
+    return int(needed + searched * SEARCH_BYTES_PER_PIXEL[method])
+
+
+def estimateMemory(imagefile, mapItem, template, pixelSize, args):
+    """Bytes a run with args will need to read imagefile, the image of
+    mapItem, and search it whole, without reading the image.
+
+    Like findPts, template is the template image, or None, and pixelSize
+    the map's pixel size in nm; args.gui searches the full size map, as the
+    GUI does.
+    """
+    from semmatch.mrc import imageShape, isMrcFile
+    from semmatch.pyramid import houghLevel, laceyLevel, templateLevel
+    from semmatch.roi import Roi
+
+    height, width, bands = imageShape(imagefile, mapItem)
+    method = searchMethod(args)
+    if getattr(args, "gui", False):
+        level = 0
+    elif method == "hough":
+        level = houghLevel(pixelSize)
+    elif method == "lacey":
+        level = laceyLevel(width)
+    elif template is not None:
+        level = templateLevel(template)
+    else:
+        # the GUI's search without a template, at full size
+        level = 0
+    roi = getattr(args, "roi", None)
+    return estimateSearch(
+        (height, width),
+        method,
+        level,
+        bands,
+        mrc=isMrcFile(imagefile),
+        roi=Roi(roi) if roi else None,
+    )
+
+
+def formatBytes(n):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            break
+        n /= 1024
+    return "%d %s" % (n, unit) if unit == "bytes" else "%.1f %s" % (n, unit)
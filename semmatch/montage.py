@@ -0,0 +1,193 @@
+"""Search a montage map piece by piece.
+
+Instead of stitching the whole montage and searching it in one go, the
+stitched map is split into one tile per montage piece and the tiles are
+searched in a pool of worker processes. Each worker reads its tile straight
+from the memory-mapped MRC file, so only a few pieces are ever in memory.
+
+Every tile owns the part of the map closer to its piece than to any other
+(the pieces' overlaps are split down the middle) and is searched with a band
+of its neighbours' pixels around it, so a hole cut by a piece edge is still
+found whole. Points outside the part a tile owns are dropped, which removes
+the duplicates found in the overlaps.
+"""
+
+import argparse
+import concurrent.futures
+
+from semmatch.core import Pt
+from semmatch.mrc import MrcFile, mapMinMax, montageLayout, readRegion
+from semmatch.pyramid import ImagePyramid, MAX_LEVEL
+from semmatch.roi import Roi
+from semmatch.timing import timed
+
+ALIGN = 2**MAX_LEVEL
+
+# set in each worker process by _initWorker
+_template = None
+_mrcFiles = {}
+
+
+def _initWorker(template):
+    import cv2
+
+    global _template
+    _template = template
+    # the pool already keeps every core busy
+    cv2.setNumThreads(1)
+
+
+def _owned(starts, size, total):
+    """Start and end of the part of [0, total) each piece owns, given the
+    sorted distinct starts of pieces of the given size."""
+    bounds = [0]
+    for prev, start in zip(starts, starts[1:]):
+        bounds.append((prev + size + start) // 2)
+    bounds.append(total)
+    return dict(zip(starts, zip(bounds, bounds[1:])))
+
+
+def pieceTiles(mrc, layout, band):
+    """(owned, searched) rectangles of each piece as (left, top, right, bottom)
+    in stitched image pixels; searched is owned plus at least band on every
+    side, with its bottom-left corner on the grid of the map's pyramid."""
+    _, xy, (width, height) = layout
+    _, ny, nx = mrc.shape
+    columns = _owned(sorted(set(xy[:, 0].tolist())), nx, width)
+    rows = _owned(sorted(set(xy[:, 1].tolist())), ny, height)
+    tiles = []
+    for x, y in xy.tolist():
+        left, right = columns[x]
+        top, bottom = rows[y]
+        searched = (
+            max((left - band) // ALIGN * ALIGN, 0),
+            max(top - band, 0),
+            min(right + band, width),
+            height - max((height - bottom - band) // ALIGN * ALIGN, 0),
+        )
+        tiles.append(((left, top, right, bottom), searched))
+    return tiles
+
+
+def defaultBand(template, pixelSize, args):
+    """Pixels of context each tile needs so nothing is cut at its edges."""
+    if args.houghCircles:
+        # widest circle houghCircles looks for, plus its prefiltering
+        return int(2 * 1300 / pixelSize) + 32
+    if args.laceySearch:
+        return 64
+    # the template plus the blur applied to the image
+    return max(template.shape[:2]) + 32
+
+
+def _laceyTile(pyramid, args):
+    """Every hole laceySearch finds in a tile, largest first, and the areas
+    of their segments, so the largest of the whole map can be kept."""
+    from semmatch.core import laceySearch
+    from semmatch.pyramid import laceyLevel, toBase
+
+    # the level findPts searches, which is the same for every tile
+    k = laceyLevel(pyramid.mapWidth)
+    roi = Roi(args.roi).binned(2**k) if args.roi else None
+    pts, areas = laceySearch(
+        pyramid.level(k),
+        None,
+        args.laceyThreshLow,
+        args.laceyThreshHigh,
+        roi=roi,
+        withAreas=True,
+    )
+    return toBase(pts, 2**k), areas
+
+
+def _searchTile(path, mapItem, owned, searched, pixelSize, args):
+    """Points found in the part of the map a tile owns, and with
+    --laceySearch the areas of their segments."""
+    from semmatch.__main__ import findPts
+
+    if path not in _mrcFiles:
+        _mrcFiles[path] = MrcFile(path)
+    mrc = _mrcFiles[path]
+    layout = montageLayout(mrc, int(mapItem.get("MapSection", 0)))
+    width, height = layout[2]
+    image = readRegion(mrc, layout, mapMinMax(mapItem), *searched)
+
+    if args.roi:
+        # the region in the tile's pixels
+        args = argparse.Namespace(**vars(args))
+        args.roi = Roi(args.roi).shifted(searched[0], height - searched[3]).polygons
+
+    pyramid = ImagePyramid(image, width)
+    if args.laceySearch:
+        found, areas = _laceyTile(pyramid, args)
+    else:
+        found = findPts(pyramid, _template, pixelSize, args)
+        areas = [None] * len(found)
+    left, top, right, bottom = owned
+    pts = []
+    ptAreas = []
+    for (x, y), area in zip(found, areas):
+        # back to the stitched image, with y from the bottom like CoordsInMap
+        x += searched[0]
+        y += height - searched[3]
+        if left <= x < right and height - bottom <= y < height - top:
+            pts.append(Pt(x, y))
+            ptAreas.append(area)
+    return pts, ptAreas
+
+
+@timed
+def findPtsInPieces(path, mapItem, template, pixelSize, args, workers=None):
+    """Search a montage map in its MRC file piece by piece.
+
+    Takes the same arguments as findPts, plus the number of worker processes
+    (default one per core), and returns the points in the same coordinates
+    as for the stitched map, and the width of that map.
+    """
+    from semmatch.groups import getRandPts
+
+    mrc = MrcFile(path)
+    layout = montageLayout(mrc, int(mapItem.get("MapSection", 0)))
+    band = args.pieceBand
+    if band is None:
+        band = defaultBand(template, pixelSize, args)
+    tileArgs = argparse.Namespace(**vars(args))
+    if args.houghCircles or args.laceySearch:
+        # maxPts is applied to the whole map below
+        tileArgs.maxPts = None
+    tiles = pieceTiles(mrc, layout, band)
+    if args.roi:
+        # only the pieces that own part of the region's bounding box
+        xmin, ymin, xmax, ymax = Roi(args.roi).bounds()
+        height = layout[2][1]
+        tiles = [
+            (owned, searched)
+            for owned, searched in tiles
+            if xmin < owned[2]
+            and xmax >= owned[0]
+            and ymin < height - owned[1]
+            and ymax >= height - owned[3]
+        ]
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_initWorker, initargs=(template,)
+    ) as pool:
+        futures = [
+            pool.submit(
+                _searchTile, path, mapItem, owned, searched, pixelSize, tileArgs
+            )
+            for owned, searched in tiles
+        ]
+        results = [future.result() for future in futures]
+    pts = [pt for tilePts, _ in results for pt in tilePts]
+
+    if args.laceySearch:
+        # the largest holes of the whole map, as a search of the stitched map
+        # keeps
+        areas = [area for _, tileAreas in results for area in tileAreas]
+        order = sorted(range(len(pts)), key=lambda i: -areas[i])
+        maxPts = 999 if args.maxPts is None else args.maxPts
+        pts = [pts[i] for i in order[:maxPts]]
+    elif args.maxPts is not None and args.houghCircles:
+        pts = getRandPts(pts, args.maxPts)
+    return pts, layout[2][0]
@@ -0,0 +1,234 @@
+"""Read maps straight from SerialEM's MRC files.
+
+The image data is memory mapped, so only the pages of the section or montage
+pieces a map is made of are ever read, and they are scaled to 8 bits with the
+map's MapMinMaxScale one piece (or a few rows) at a time instead of as a
+floating point copy of the whole file. Montages are stitched from their
+pieces using the piece coordinates in SerialEM's extended header, or in the
+.mdoc file next to the image file.
+
+Arrays are returned top row first, like an exported JPEG, even though MRC
+files store the bottom row first.
+"""
+
+import ntpath
+import os
+
+import numpy as np
+
+from semmatch.timing import timed
+
+MRC_EXTENSIONS = (".mrc", ".st", ".map")
+
+_MODES = {0: np.uint8, 1: np.int16, 2: np.float32, 6: np.uint16, 12: np.float16}
+
+# rows scaled at a time for single frames
+_CHUNK_ROWS = 512
+
+
+def isMrcFile(path):
+    return os.path.splitext(path)[1].lower() in MRC_EXTENSIONS
+
+
+def toUint8(image, minMax=None, out=None) -> "ndarray":
+    """Scale an image to 8 bits the way SerialEM does for JPEG export.
+
+    uint8 images are returned as they are. Otherwise minMax (for example a
+    map's MapMinMaxScale) or the image's own range is mapped to 0-255, a block
+    of rows at a time so no full size floating point copy is made.
+    """
+    if image.dtype == np.uint8:
+        if out is None:
+            return image
+        out[...] = image
+        return out
+    low, high = minMax if minMax is not None else (image.min(), image.max())
+    scale = 255 / max(float(high) - float(low), 1e-6)
+    if out is None:
+        out = np.empty(image.shape, np.uint8)
+    for start in range(0, image.shape[0], _CHUNK_ROWS):
+        rows = np.subtract(image[start : start + _CHUNK_ROWS], low, dtype=np.float32)
+        rows *= scale
+        np.clip(rows, 0, 255, out=rows)
+        out[start : start + _CHUNK_ROWS] = rows
+    return out
+
+
+class MrcFile:
+    """Memory-mapped MRC image stack with its SerialEM piece coordinates."""
+
+    def __init__(self, path):
+        self.path = path
+        header = np.fromfile(path, dtype=np.uint8, count=1024)
+        if len(header) < 1024:
+            raise ValueError("%s is too short to be an MRC file" % path)
+        # machine stamp 0x11 0x11 marks a big-endian file
+        byteorder = ">" if header[212] == 0x11 else "<"
+        words = header[:96].view(byteorder + "i4")
+        nx, ny, nz, mode = (int(x) for x in words[:4])
+        if mode not in _MODES or min(nx, ny, nz) <= 0:
+            raise ValueError("%s is not an MRC file semmatch can read" % path)
+        extendedSize = int(words[23])
+        self.shape = (nz, ny, nx)
+        self._extType = bytes(header[104:108])
+        self._bytesPerSection, self._flags = (
+            int(x) for x in header[128:132].view(byteorder + "i2")
+        )
+        self._extended = (
+            np.memmap(
+                path, dtype=np.uint8, mode="r", offset=1024, shape=(extendedSize,)
+            )
+            if extendedSize
+            else np.empty(0, np.uint8)
+        )
+        self._byteorder = byteorder
+        self.data = np.memmap(
+            path,
+            dtype=np.dtype(_MODES[mode]).newbyteorder(byteorder),
+            mode="r",
+            offset=1024 + extendedSize,
+            shape=self.shape,
+        )
+
+    def section(self, z) -> "ndarray":
+        """View of section z, top row first."""
+        return self.data[z, ::-1]
+
+    def pieceCoords(self) -> "ndarray":
+        """(nz, 3) int array of the x, y, z piece coordinates of each section.
+
+        Coordinates are in the file's pixels, with y counted from the bottom
+        as in the file. Raises ValueError if the file has none.
+        """
+        nz = self.shape[0]
+        hasCoords = self._flags & 2 and self._extType in (b"SERI", b"\0\0\0\0")
+        if hasCoords and self._bytesPerSection * nz <= len(self._extended):
+            # SerialEM puts the tilt angle, if any, before the piece coordinates
+            offset = 2 if self._flags & 1 else 0
+            records = self._extended[: self._bytesPerSection * nz].reshape(nz, -1)
+            coords = records[:, offset : offset + 6].copy()
+            return coords.view(self._byteorder + "i2").astype(int)
+        mdoc = self.path + ".mdoc"
+        if os.path.exists(mdoc):
+            return _mdocPieceCoords(mdoc, nz)
+        raise ValueError("no piece coordinates for %s" % self.path)
+
+
+def _mdocPieceCoords(mdoc, nz):
+    coords = np.full((nz, 3), -1, dtype=int)
+    z = None
+    with open(mdoc) as f:
+        for line in f:
+            key, _, val = (s.strip() for s in line.partition("="))
+            if key == "[ZValue":
+                z = int(val.rstrip("]"))
+            elif key == "PieceCoordinates" and z is not None and z < nz:
+                coords[z] = [int(x) for x in val.split()[:3]]
+    if (coords[:, 2] < 0).any():
+        raise ValueError("%s is missing piece coordinates" % mdoc)
+    return coords
+
+
+def findMapFile(mapItem, navfile=None):
+    """Path of the MRC file holding a map, or None if it can't be found.
+
+    MapFile is an absolute path on the SerialEM computer, so the file is also
+    looked for by name next to the navigator.
+    """
+    mapFile = mapItem.get("MapFile")
+    if mapFile is None:
+        return None
+    if os.path.exists(mapFile):
+        return mapFile
+    if navfile is not None:
+        nearby = os.path.join(os.path.dirname(navfile), ntpath.basename(mapFile))
+        if os.path.exists(nearby):
+            return nearby
+    return None
+
+
+def mapMinMax(mapItem):
+    if "MapMinMaxScale" not in mapItem:
+        return None
+    return [float(x) for x in mapItem["MapMinMaxScale"].split()[:2]]
+
+
+def montageLayout(mrc, section):
+    """Where the pieces of a montage section go in the stitched image.
+
+    Returns the piece indices, an (N, 2) int array of the left column and top
+    row of each piece in the stitched image, and its (width, height).
+    """
+    coords = mrc.pieceCoords()
+    pieces = np.flatnonzero(coords[:, 2] == section)
+    if len(pieces) == 0:
+        raise ValueError("no montage pieces of section %d in %s" % (section, mrc.path))
+    _, ny, nx = mrc.shape
+    xy = coords[pieces, :2]
+    xy -= xy.min(axis=0)
+    width, height = (int(v) for v in xy.max(axis=0) + (nx, ny))
+    # y counts from the bottom; image rows from the top
+    xy[:, 1] = height - xy[:, 1] - ny
+    return pieces, xy, (width, height)
+
+
+def readRegion(mrc, layout, minMax, left, top, right, bottom) -> "ndarray":
+    """8-bit image of part of a stitched montage, reading only the pieces
+    (and pages of them) that overlap it."""
+    pieces, xy, _ = layout
+    _, ny, nx = mrc.shape
+    region = np.zeros((bottom - top, right - left), np.uint8)
+    for piece, (x, y) in zip(pieces, xy):
+        x0, x1 = max(x, left), min(x + nx, right)
+        y0, y1 = max(y, top), min(y + ny, bottom)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        toUint8(
+            mrc.section(piece)[y0 - y : y1 - y, x0 - x : x1 - x],
+            minMax,
+            out=region[y0 - top : y1 - top, x0 - left : x1 - left],
+        )
+    return region
+
+
+def readMap(path, mapItem) -> "ndarray":
+    """8-bit image of a map from its MRC file, top row first.
+
+    The section is MapSection; for montages (MapMontage = 1) it is the z value
+    of the pieces that are stitched together.
+    """
+    mrc = MrcFile(path)
+    section = int(mapItem.get("MapSection", 0))
+    if mapItem.get("MapMontage", "0") == "0":
+        return toUint8(mrc.section(section), mapMinMax(mapItem))
+    layout = montageLayout(mrc, section)
+    width, height = layout[2]
+    return readRegion(mrc, layout, mapMinMax(mapItem), 0, 0, width, height)
+
+
+def imageShape(path, mapItem):
+    """(height, width, bands) of the image readImage returns, read from the
+    file's header."""
+    if not isMrcFile(path):
+        import PIL.Image
+
+        # maps are large
+        PIL.Image.MAX_IMAGE_PIXELS = None
+        with PIL.Image.open(path) as image:
+            return image.height, image.width, len(image.getbands())
+    mrc = MrcFile(path)
+    if mapItem.get("MapMontage", "0") == "0":
+        _, ny, nx = mrc.shape
+        return ny, nx, 1
+    width, height = montageLayout(mrc, int(mapItem.get("MapSection", 0)))[2]
+    return height, width, 1
+
+
+@timed
+def readImage(path, mapItem):
+    """Read a map image from an MRC file or any format imageio reads."""
+    if not isMrcFile(path):
+        import imageio
+
+        return imageio.imread(path)
+    return readMap(path, mapItem)
@@ -0,0 +1,343 @@
+"""How navigator reading and writing scale with the size of a session.
+
+    python -m semmatch.navscaling [-o nav.json] [--sizes 1000 10000 100000]
+
+Synthetic navigators of --sizes items are generated from a fixed seed with the
+items of a real session (see tests/nav.nav): maps, each with two registration
+points, a polygon and the points picked on it in groups, all with the fields
+SerialEM writes for them. On each one, the cases time
+
+    openNavfile      parsing the whole navigator
+    lookup           finding one map's item by label, as a run does, which
+                     parses the whole navigator to do it
+    createAutodoc    writing as many new points as the navigator has items
+    appendToNavfile  merging a map's worth of new points into the navigator
+
+and record the items handled per second and the most memory a run allocated
+at once, traced with tracemalloc in an extra untimed run. Reports are JSON in
+the format of semmatch.bench, so python -m semmatch.bench compare flags a
+case that got slower between two of them.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+
+from semmatch.bench import SEED, environment, timeCase
+from semmatch.memory import formatBytes
+from semmatch.timing import profiling
+
+SIZES = (1000, 10000, 100000)
+# items picked on each map, in groups of GROUP_SIZE, as in tests/nav.nav
+PTS_PER_MAP = 50
+GROUP_SIZE = 10
+REGISTRATION_PTS = 2
+# points appended by appendToNavfile, about what one map's search finds
+APPEND_PTS = 1000
+
+_MAP_FIELDS = """Color = 2
+StageXYZ = {x:.4f} {y:.4f} {z:.4f}
+NumPts = 5
+Regis = 6
+Type = 2
+Note = Sec {section} - MMM.mrc -
+BklshXY = 5 -5
+RawStageXY = {x:.4f} {y:.4f}
+MapFile = C:\\Users\\semmatch\\Desktop\\session\\\\MMM.mrc
+MapID = {mapID}
+MapMontage = 1
+MapSection = {section}
+MapBinning = 32
+MapMagInd = 17
+MapCamera = 1
+MapScaleMat = 0.0692718 18.6919 18.7944 -0.378149
+MapWidthHeight = 852 884
+MapMinMaxScale = 20 7295
+MapFramesXY = 4 4
+MontBinning = 8
+MapExposure = 1
+MapSettling = 0
+ShutterMode = 0
+MapSpotSize = 6
+MapIntensity = 0.730588
+MapSlitIn = 0
+MapSlitWidth = 0
+ImageType = 0
+MontUseStage = 1
+DefocusOffset = -200
+K2ReadMode = 1
+NetViewShiftXY = 0.0426714 0.467959
+ViewBeamShiftXY = -2.11182 1.41924
+MapProbeMode = 1
+MapLDConSet = 0
+MapTiltAngle = -0.00184767
+PtsX = {xs}
+PtsY = {ys}"""
+
+_POINT_FIELDS = """Color = 0
+StageXYZ = {x:.4f} {y:.4f} {z:.4f}
+NumPts = 1
+Regis = 6
+Type = 0{extra}
+DrawnID = {drawnID}
+BklshXY = 5 -5
+PieceOn = {piece}
+MapID = {mapID}
+PtsX = {x:.4f}
+PtsY = {y:.4f}"""
+
+_POLYGON_FIELDS = """Color = 1
+StageXYZ = {x:.4f} {y:.4f} {z:.4f}
+NumPts = {numPts}
+Regis = 6
+Type = 1
+DrawnID = {drawnID}
+BklshXY = 5 -5
+MapID = {mapID}
+PtsX = {xs}
+PtsY = {ys}"""
+
+
+def _coords(values):
+    return " ".join("%.4f" % v for v in values)
+
+
+def _mapItems(rng, newID, label, section):
+    """(label, fields) of a map labelled label-A and the items drawn on it,
+    numbered from label + 1, and the last number used."""
+    # a 50 µm map somewhere on the grid
+    x, y = rng.uniform(-900, 900), rng.uniform(-900, 900)
+    z = rng.uniform(-40, 40)
+    drawnID = newID()
+    corners = [(-25, -25), (-25, 25), (25, 25), (25, -25), (-25, -25)]
+    items = [
+        (
+            "%d-A" % label,
+            _MAP_FIELDS.format(
+                x=x,
+                y=y,
+                z=z,
+                section=section,
+                mapID=drawnID,
+                xs=_coords(x + dx for dx, _ in corners),
+                ys=_coords(y + dy for _, dy in corners),
+            ),
+        )
+    ]
+
+    def point(extra):
+        return _POINT_FIELDS.format(
+            x=x + rng.uniform(-25, 25),
+            y=y + rng.uniform(-25, 25),
+            z=z,
+            extra=extra,
+            drawnID=drawnID,
+            piece=rng.randrange(16),
+            mapID=newID(),
+        )
+
+    for regPt in range(1, REGISTRATION_PTS + 1):
+        label += 1
+        items.append((str(label), point("\nRegPt = %d" % regPt)))
+
+    # a closed outline around part of the map
+    label += 1
+    angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(9))
+    radii = [rng.uniform(5, 15) for _ in angles]
+    outline = [(r * math.cos(a), r * math.sin(a)) for r, a in zip(radii, angles)]
+    outline.append(outline[0])
+    items.append(
+        (
+            str(label),
+            _POLYGON_FIELDS.format(
+                x=x,
+                y=y,
+                z=z,
+                numPts=len(outline),
+                drawnID=drawnID,
+                mapID=newID(),
+                xs=_coords(x + dx for dx, _ in outline),
+                ys=_coords(y + dy for _, dy in outline),
+            ),
+        )
+    )
+
+    for _ in range(PTS_PER_MAP // GROUP_SIZE):
+        label += 1
+        groupID = "\nGroupID = %d" % newID()
+        items.append(("%d-1" % label, point("\nAcquire = 1" + groupID)))
+        for sub in range(2, GROUP_SIZE + 1):
+            items.append(("%d-%d" % (label, sub), point(groupID)))
+    return items, label
+
+
+def syntheticNavItems(n, seed=SEED):
+    """Yield (label, fields) of the n items of a synthetic navigator, fields
+    being the text of the item's section after its [Item = label] line."""
+    rng = random.Random(seed)
+    used = set()
+
+    def newID():
+        mapID = rng.randint(10**9, 2 * 10**9)
+        while mapID in used:
+            mapID = rng.randint(10**9, 2 * 10**9)
+        used.add(mapID)
+        return mapID
+
+    label = 0
+    section = 0
+    while n > 0:
+        items, label = _mapItems(rng, newID, label + 1, section)
+        yield from items[:n]
+        n -= len(items)
+        section += 1
+
+
+def writeSyntheticNav(path, n, seed=SEED):
+    """Write a synthetic navigator of n items to path, with the CRLF line
+    endings SerialEM writes on Windows, and return the label of its last
+    map."""
+    lastMap = None
+    with open(path, "w", newline="\r\n") as f:
+        f.write("AdocVersion = 2.00\nLastSavedAs = %s\n\n" % path)
+        for label, fields in syntheticNavItems(n, seed):
+            f.write("[Item = %s]\n%s\n\n" % (label, fields))
+            if label.endswith("-A"):
+                lastMap = label
+    return lastMap
+
+
+def _newNavPts(nav, mapLabel, n):
+    """n new points on a lattice of holes on mapLabel, labelled after the
+    items in nav, as ptsToNavPts makes them without groups.
+
+    They're made here rather than by ptsToNavPts, whose path through the
+    points would take longer than the cases for 100k points.
+    """
+    from semmatch.autodoc import NavFilePoint
+    from semmatch.batch import nextLabel
+    from semmatch.scaling import pointSet
+
+    mapItem = nav[mapLabel]
+    regis = int(mapItem["Regis"])
+    drawnID = int(mapItem["MapID"])
+    zHeight = float(mapItem["StageXYZ"].split()[2])
+    start = nextLabel(nav)
+    return [
+        NavFilePoint(start + i, regis, *pt, zHeight, drawnID, acquire=1)
+        for i, pt in enumerate(pointSet("lattice", n))
+    ]
+
+
+def navCases(navfile, mapLabel, n, scratch):
+    """(name, run, params) of the cases on navfile, a navigator of n items
+    whose last map is mapLabel."""
+    from semmatch.autodoc import appendToNavfile, createAutodoc, openNavfile
+
+    nav = openNavfile(navfile)
+    written = _newNavPts(nav, mapLabel, n)
+    appended = _newNavPts(nav, mapLabel, APPEND_PTS)
+    del nav
+    output = os.path.join(scratch, "out.nav")
+    size = os.path.getsize(navfile)
+
+    def append():
+        appendToNavfile(navfile, appended)
+        # back to the original navigator for the next run
+        os.truncate(navfile, size)
+
+    params = {"items": n, "bytes": size}
+    return [
+        ("openNavfile/items-%d" % n, lambda: openNavfile(navfile), params),
+        ("lookup/items-%d" % n, lambda: openNavfile(navfile)[mapLabel], params),
+        (
+            "createAutodoc/points-%d" % n,
+            lambda: createAutodoc(output, written),
+            {"items": n},
+        ),
+        (
+            "appendToNavfile/items-%d" % n,
+            append,
+            dict(params, points=APPEND_PTS),
+        ),
+    ]
+
+
+def peakMemory(run):
+    """Most bytes allocated at once by a call of run, as traced by
+    tracemalloc."""
+    with profiling("case", memory=True) as profile:
+        run()
+    return profile.root.peakMemory
+
+
+def run(sizes=SIZES, repeat=3, warmup=1, log=None):
+    """Time the cases on a synthetic navigator of each size and return the
+    report."""
+    report = {
+        "environment": environment(),
+        "repeat": repeat,
+        "warmup": warmup,
+        "cases": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="semmatch-navscaling") as scratch:
+        for n in sizes:
+            navfile = os.path.join(scratch, "nav-%d.nav" % n)
+            mapLabel = writeSyntheticNav(navfile, n)
+            for name, fn, params in navCases(navfile, mapLabel, n, scratch):
+                case = dict(params, **timeCase(fn, repeat, warmup))
+                case["itemsPerSecond"] = (
+                    case["items"] / case["min"] if case["min"] else None
+                )
+                case["peakMemory"] = peakMemory(fn)
+                report["cases"][name] = case
+                if log is not None:
+                    log(formatCase(name, case))
+            os.remove(navfile)
+    return report
+
+
+def formatCase(name, case):
+    return "%-36s %8.3f s  %10.0f items/s  peak %s" % (
+        name,
+        case["min"],
+        case["itemsPerSecond"] or float("inf"),
+        formatBytes(case["peakMemory"]),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m semmatch.navscaling", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument("-o", "--output", help="write the report to this JSON file")
+    parser.add_argument("--json", help="print the report as JSON", action="store_true")
+    parser.add_argument(
+        "--sizes",
+        help="numbers of items of the navigators (default %s)"
+        % " ".join(map(str, SIZES)),
+        type=int,
+        nargs="+",
+        default=SIZES,
+    )
+    parser.add_argument("--repeat", help="times each case is run", type=int, default=3)
+    parser.add_argument(
+        "--warmup", help="untimed runs before the timed ones", type=int, default=1
+    )
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, args.warmup, log=None if args.json else print)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
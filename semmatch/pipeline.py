@@ -0,0 +1,179 @@
+"""Overlap reading, searching, grouping and writing of many maps.
+
+Maps go through four stages:
+
+    decode  read the image file or header    thread pool
+    detect  search the image                 process pool
+    group   turn points into nav items       calling thread, in map order
+    write   write the results                background thread
+
+Bounded queues between the stages let the next maps be read while the
+current ones are searched and the previous results are written, without
+holding more than a few decoded maps in memory. Whatever decode returns is
+pickled to detect's process, so for large maps decode can check just the
+header and leave the reading to detect. Pipeline.run returns how busy
+each stage was and how long each one waited on its neighbours.
+"""
+
+import collections
+import concurrent.futures
+import queue
+import threading
+import time
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class Pipeline:
+    """decode(job) and detect(job, decoded) run in pools, so detect must be
+    picklable; group(job, detected) returns what write(job, grouped) gets.
+    Jobs are grouped and written in the order they are given.
+
+    If decode, detect or group raises an Exception for a job, onError(job,
+    stage, exception) is called and the job is dropped, so the other jobs
+    still go through; without onError the exception stops the run.
+    """
+
+    def __init__(
+        self,
+        decode,
+        detect,
+        group,
+        write,
+        pool,
+        decodeThreads=2,
+        depth=4,
+        onError=None,
+    ):
+        self.decode = decode
+        self.detect = detect
+        self.group = group
+        self.write = write
+        self.pool = pool
+        self.decodeThreads = decodeThreads
+        self.depth = depth
+        self.onError = onError
+
+    def _failed(self, job, stage, e):
+        if self.onError is None:
+            raise e
+        self.onError(job, stage, e)
+
+    def run(self, jobs):
+        busy = collections.Counter()
+        waits = collections.Counter()
+        start = time.perf_counter()
+
+        writeQueue = queue.Queue(maxsize=self.depth)
+        writeErrors = []
+
+        def writer():
+            while True:
+                t = time.perf_counter()
+                item = writeQueue.get()
+                waits["write waiting for group"] += time.perf_counter() - t
+                if item is None:
+                    return
+                if writeErrors:
+                    continue
+                try:
+                    _, seconds = _timed(self.write, *item)
+                    busy["write"] += seconds
+                except BaseException as e:
+                    writeErrors.append(e)
+
+        writerThread = threading.Thread(target=writer, daemon=True)
+        writerThread.start()
+
+        jobs = iter(jobs)
+        decoding = collections.deque()
+        detecting = collections.deque()
+        numJobs = 0
+        failed = 0
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.decodeThreads) as decoders:
+                while True:
+                    for job in jobs:
+                        decoding.append(
+                            (job, decoders.submit(_timed, self.decode, job))
+                        )
+                        if len(decoding) >= self.depth:
+                            break
+                    while decoding and len(detecting) < self.depth:
+                        job, future = decoding.popleft()
+                        t = time.perf_counter()
+                        try:
+                            decoded, seconds = future.result()
+                        except Exception as e:
+                            self._failed(job, "decode", e)
+                            failed += 1
+                            continue
+                        finally:
+                            waits["detect waiting for decode"] += (
+                                time.perf_counter() - t
+                            )
+                        busy["decode"] += seconds
+                        detecting.append(
+                            (job, self.pool.submit(_timed, self.detect, job, decoded))
+                        )
+                        del decoded
+                    if not detecting:
+                        break
+
+                    job, future = detecting.popleft()
+                    t = time.perf_counter()
+                    try:
+                        detected, seconds = future.result()
+                    except Exception as e:
+                        self._failed(job, "detect", e)
+                        failed += 1
+                        continue
+                    finally:
+                        waits["group waiting for detect"] += time.perf_counter() - t
+                    busy["detect"] += seconds
+                    try:
+                        grouped, seconds = _timed(self.group, job, detected)
+                    except Exception as e:
+                        self._failed(job, "group", e)
+                        failed += 1
+                        continue
+                    busy["group"] += seconds
+                    t = time.perf_counter()
+                    writeQueue.put((job, grouped))
+                    waits["group waiting for write"] += time.perf_counter() - t
+                    numJobs += 1
+                    if writeErrors:
+                        raise writeErrors[0]
+        finally:
+            writeQueue.put(None)
+            writerThread.join()
+        if writeErrors:
+            raise writeErrors[0]
+
+        wallTime = time.perf_counter() - start
+        return {
+            "maps": numJobs,
+            "failed": failed,
+            "seconds": wallTime,
+            "mapsPerMinute": 60 * numJobs / wallTime if wallTime else 0.0,
+            "busy": dict(busy),
+            "waits": dict(waits),
+        }
+
+
+def formatStats(stats):
+    lines = [
+        "%d maps in %.1f s (%.1f maps/min)"
+        % (stats["maps"], stats["seconds"], stats["mapsPerMinute"])
+    ]
+    if stats.get("failed"):
+        lines[0] += ", %d failed" % stats["failed"]
+    for stage, seconds in stats["busy"].items():
+        lines.append("    %-26s busy %6.2f s" % (stage, seconds))
+    for stage, seconds in stats["waits"].items():
+        lines.append("    %-26s %6.2f s" % (stage, seconds))
+    return "\n".join(lines)
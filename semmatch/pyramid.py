@@ -0,0 +1,95 @@
+"""Area-averaged image pyramid shared by the detectors.
+
+Level k of a pyramid is the map binned by 2**k: every pixel is the mean of a
+2x2 block of the level below, which is cheaper than SerialEM's ReduceImage and
+doesn't alias. Levels are built once, when a detector first asks for them.
+
+Each detector picks the coarsest level at which the feature it looks for is
+still big enough (see templateLevel, houghLevel and laceyLevel), and toBase
+takes its points back to the full-size map. Odd rows and columns are dropped
+at the top and right, so every level lines up with the bottom-left corner that
+CoordsInMap counts from, and a pixel center x at level k is exactly
+(x + 0.5) * 2**k - 0.5 at level 0.
+"""
+
+import numpy as np
+
+from semmatch.core import Pt
+from semmatch.timing import span
+
+# coarsest level any detector uses; tiles of a map searched separately line up
+# with the full map's pyramid if they start on multiples of 2**MAX_LEVEL
+MAX_LEVEL = 4
+
+# smallest template side, in pixels, that template matching is run at
+TEMPLATE_MIN_PX = 64
+# smallest hole radius, in pixels, that houghCircles is run at
+HOUGH_MIN_RADIUS_PX = 12
+# widest image laceySearch is tuned for, about what the scripts reduced to
+LACEY_MAX_WIDTH = 2048
+
+
+def _halve(image):
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    # drop odd rows at the top, since rows are stored top row first
+    image = image[image.shape[0] - height :, :width]
+    total = image[0::2, 0::2].astype(np.uint16)
+    total += image[1::2, 0::2]
+    total += image[0::2, 1::2]
+    total += image[1::2, 1::2]
+    total += 2
+    total //= 4
+    return total.astype(np.uint8)
+
+
+class ImagePyramid:
+    """Binned copies of an 8-bit image, made on demand.
+
+    mapWidth is the width of the whole map when image is only part of it, so
+    every part is searched at the same level.
+    """
+
+    def __init__(self, image, mapWidth=None):
+        if image.ndim == 3:
+            image = image[:, :, 0]
+        self.levels = [image]
+        self.mapWidth = image.shape[1] if mapWidth is None else mapWidth
+
+    def level(self, k) -> "ndarray":
+        while len(self.levels) <= k:
+            with span("pyramid"):
+                self.levels.append(_halve(self.levels[-1]))
+        return self.levels[k]
+
+
+def _levelFor(size, minSize):
+    """Coarsest level at which size, in level 0 pixels, is still minSize."""
+    k = 0
+    while k < MAX_LEVEL and size / 2 ** (k + 1) >= minSize:
+        k += 1
+    return k
+
+
+def templateLevel(template):
+    return _levelFor(min(template.shape[:2]), TEMPLATE_MIN_PX)
+
+
+def houghLevel(pixelSize, minRadiusNm=600):
+    return _levelFor(minRadiusNm / pixelSize, HOUGH_MIN_RADIUS_PX)
+
+
+def laceyLevel(mapWidth):
+    k = 0
+    while k < MAX_LEVEL and mapWidth / 2**k > LACEY_MAX_WIDTH:
+        k += 1
+    return k
+
+
+def toBase(pts, factor):
+    """Points found in an image binned by factor, in the unbinned image."""
+    if factor == 1:
+        return [Pt(int(x), int(y)) for x, y in pts]
+    return [
+        Pt(int(round((x + 0.5) * factor - 0.5)), int(round((y + 0.5) * factor - 0.5)))
+        for x, y in pts
+    ]
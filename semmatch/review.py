@@ -0,0 +1,206 @@
+"""Review the points found in many maps in one GUI session.
+
+    semmatch review --navfile nav.nav --template T.jpg -o out.nav
+
+The maps are shown one after another in the GUI. While the operator reviews
+one map, the next --prefetch maps are read and searched in worker processes,
+so the next map is usually ready the moment the current one is accepted (A)
+or skipped (S). Template matches are found for every threshold at once, so
+the threshold can still be changed on every map without searching again.
+Accepted points are written to one output at the end of the session, as in
+batch mode.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import functools
+
+import numpy as np
+
+from semmatch.__main__ import addSearchArgs, addNavArgs, findPts
+from semmatch.autodoc import openNavfile
+from semmatch.batch import (
+    _initWorker,
+    addMapArgs,
+    checkArgs,
+    mapJobs,
+    mapNavPts,
+    mapReduction,
+    nextLabel,
+    readTemplates,
+    writeResults,
+)
+from semmatch.coords import NavPtsIndex, mapPixelSize, setStageCoords
+from semmatch.mrc import readImage
+from semmatch.roi import Roi
+
+# a map read and searched ahead: matches (a TemplateMatches) for template
+# matching, or pts for the other methods, and the search region in the image's
+# pixels; error if the map couldn't be read, and the reduction the image was
+# read at
+Prefetched = collections.namedtuple(
+    "Prefetched",
+    "image matches pts pixelSize roi error reduction",
+    defaults=(None, 1.0),
+)
+
+
+def _prefetchMap(job, args, minScore):
+    from semmatch import batch
+    from semmatch.core import templateMatches
+
+    label, imagefile, mapItem = job
+    try:
+        image = readImage(imagefile, mapItem)
+    except (OSError, ValueError) as e:
+        return Prefetched(None, None, [], None, None, str(e))
+    pixelSize = args.pixelSize
+    if pixelSize is None:
+        pixelSize = mapPixelSize(mapItem, image.shape[1])
+    reduction = mapReduction(imagefile, args)
+    roi = None
+    if args.roi:
+        roi = [polygon.tolist() for polygon in Roi(args.roi).binned(reduction).polygons]
+        args = argparse.Namespace(**vars(args))
+        args.roi = roi
+    if args.houghCircles or args.laceySearch:
+        pts = findPts(image, None, pixelSize, args)
+        return Prefetched(image, None, pts, pixelSize, roi, reduction=reduction)
+    # the same search as the GUI's, which doesn't use the image pyramid
+    matches = templateMatches(
+        image,
+        batch._templates[reduction],
+        minScore,
+        blurImage=not args.noBlurImage,
+        blurTemplate=not args.noBlurTemplate,
+        roi=roi,
+    )
+    return Prefetched(image, matches, None, pixelSize, roi, reduction=reduction)
+
+
+class Prefetcher:
+    """The maps of a review session, each read and searched in a pool ahead
+    of the one being reviewed."""
+
+    def __init__(self, jobs, pool, search, ahead):
+        self.jobs = jobs
+        self.pool = pool
+        self.search = search
+        self.ahead = ahead
+        self.futures = {}
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def label(self, i):
+        return self.jobs[i][0]
+
+    def poll(self, i):
+        """Prefetched map i if it's ready, else None.
+
+        Either way, maps i to i + ahead are queued and earlier ones dropped.
+        """
+        for j in range(i, min(i + 1 + self.ahead, len(self.jobs))):
+            if j not in self.futures:
+                self.futures[j] = self.pool.submit(self.search, self.jobs[j])
+        for j in [j for j in self.futures if j < i]:
+            self.futures.pop(j).cancel()
+        future = self.futures[i]
+        return future.result() if future.done() else None
+
+    def cancel(self):
+        """Cancel the maps queued but not started, as
+        pool.shutdown(cancel_futures=True) does from Python 3.9."""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="semmatch review",
+        description="review the points found in many maps of a SerialEM navigator",
+    )
+    addMapArgs(parser)
+    parser.add_argument(
+        "--prefetch",
+        help="number of maps read and searched ahead of the one shown",
+        type=int,
+        default=2,
+    )
+    addSearchArgs(parser)
+    addNavArgs(parser)
+
+    args = parser.parse_args(argv)
+    checkArgs(parser, args)
+    if args.output is not None and "{label}" in args.output:
+        parser.error("review writes all maps to one output; {label} isn't supported")
+    run(args)
+
+
+def run(args):
+    import semmatch.gui
+    from semmatch.core import NavOptions
+
+    nav = openNavfile(args.navfile)
+    jobs = mapJobs(nav, args)
+
+    # MRC maps are read unreduced, so they need the template unreduced too
+    templates = {}
+    if args.template is not None:
+        templates = readTemplates(args, jobs)
+        if templates is None:
+            if not (args.houghCircles or args.laceySearch):
+                exit()
+            templates = {}
+
+    options = NavOptions(
+        args.groupOption,
+        args.groupRadius,
+        args.pixelSize,
+        args.numGroups,
+        args.ptsPerGroup,
+        args.acquire,
+    )
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max(args.prefetch, 1),
+        initializer=_initWorker,
+        initargs=(templates,),
+    ) as pool:
+        search = functools.partial(
+            _prefetchMap, args=args, minScore=semmatch.gui.MIN_SCORE
+        )
+        maps = Prefetcher(jobs, pool, search, args.prefetch)
+        accepted = semmatch.gui.review(
+            maps,
+            templates,
+            args.threshold,
+            options,
+            blurImage=not args.noBlurImage,
+            blurTemplate=not args.noBlurTemplate,
+        )
+        # the maps still being searched are waited for on leaving the pool
+        maps.cancel()
+
+    newLabel = nextLabel(nav) if args.newLabel is None else args.newLabel
+    index = NavPtsIndex(nav) if args.skipExisting is not None else None
+    allNavPts = []
+    allStagePts = []
+    allPixelPts = []
+    for i, pts, width, mapOptions in accepted:
+        navPts, stagePts = mapNavPts(
+            nav, jobs[i], pts, width, mapOptions, newLabel, index, args
+        )
+        if navPts:
+            newLabel = int(str(navPts[-1]._label).split("-")[0]) + 1
+        allPixelPts.extend(pt.CoordsInMap[:2] for pt in navPts)
+        if args.stageCoords:
+            setStageCoords(navPts, stagePts)
+        allNavPts.extend(navPts)
+        allStagePts.append(stagePts)
+
+    print("%d points from %d accepted maps" % (len(allNavPts), len(accepted)))
+    if not allNavPts:
+        exit()
+    writeResults(args, allNavPts, np.concatenate(allStagePts), allPixelPts)
@@ -0,0 +1,94 @@
+"""Regions of interest: the part of a map a search is restricted to.
+
+A region is the union of one or more polygons (a rectangle is just four
+vertices) in image pixels, with (0,0) at the bottom-left corner like the points
+the detectors return. A detector given a region only searches its bounding box,
+plus the margin the detector needs to see whole features at the edges, and
+drops the points outside the polygons, so search time scales with the area of
+the region instead of the map.
+"""
+
+import numpy as np
+
+
+class Roi:
+    """Union of polygons, each a sequence of at least 3 (x, y) vertices."""
+
+    def __init__(self, polygons):
+        self.polygons = []
+        for polygon in polygons:
+            polygon = np.asarray(polygon, dtype=float).reshape(-1, 2)
+            if len(polygon) < 3:
+                raise ValueError("a region polygon needs at least 3 vertices")
+            self.polygons.append(polygon)
+        if not self.polygons:
+            raise ValueError("a region needs at least one polygon")
+
+    def bounds(self):
+        """(xmin, ymin, xmax, ymax) of all the polygons."""
+        vertices = np.concatenate(self.polygons)
+        return (*vertices.min(axis=0).tolist(), *vertices.max(axis=0).tolist())
+
+    def contains(self, pts) -> "ndarray":
+        """Boolean array, True for the points inside any of the polygons."""
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        x, y = pts[:, :1], pts[:, 1:]
+        inside = np.zeros(len(pts), bool)
+        for polygon in self.polygons:
+            x0, y0 = polygon.T
+            x1, y1 = np.roll(polygon, -1, axis=0).T
+            # even-odd rule: count the edges a ray from each point to +x crosses
+            spans = (y0 > y) != (y1 > y)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crossX = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+            inside |= np.count_nonzero(spans & (x < crossX), axis=1) % 2 == 1
+        return inside
+
+    def shifted(self, dx, dy) -> "Roi":
+        """The region in an image whose bottom-left corner is at (dx, dy)."""
+        return Roi([polygon - (dx, dy) for polygon in self.polygons])
+
+    def binned(self, factor) -> "Roi":
+        """The region in the image binned by factor; see pyramid.toBase."""
+        return Roi([(polygon + 0.5) / factor - 0.5 for polygon in self.polygons])
+
+
+def asRoi(roi):
+    """roi as a Roi, if it's a list of polygons."""
+    return roi if isinstance(roi, Roi) else Roi(roi)
+
+
+def rectangle(x0, y0, x1, y1):
+    """Polygon of the rectangle with corners (x0, y0) and (x1, y1)."""
+    return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+
+
+def parseRoi(text):
+    """Polygon from the --roi option: X0,Y0,X1,Y1 for a rectangle's corners,
+    or X,Y of 3 or more vertices for a polygon."""
+    try:
+        values = [float(v) for v in text.replace(" ", ",").split(",") if v]
+    except ValueError:
+        raise ValueError("region must be comma separated numbers: %s" % text)
+    if len(values) == 4:
+        return rectangle(*values)
+    if len(values) < 6 or len(values) % 2:
+        raise ValueError(
+            "region must be X0,Y0,X1,Y1 or the X,Y of 3 or more vertices: %s" % text
+        )
+    return list(zip(values[0::2], values[1::2]))
+
+
+def cropToRoi(image, roi, margin):
+    """Part of image around roi's bounding box, with margin more pixels on
+    every side, and the (x, y) of its bottom-left corner in image."""
+    height, width = image.shape[:2]
+    xmin, ymin, xmax, ymax = roi.bounds()
+    left = max(int(np.floor(xmin)) - margin, 0)
+    right = min(int(np.ceil(xmax)) + 1 + margin, width)
+    # rows count from the top
+    top = max(height - 1 - int(np.ceil(ymax)) - margin, 0)
+    bottom = min(height - int(np.floor(ymin)) + margin, height)
+    if left >= right or top >= bottom:
+        return image[:0, :0], (0, 0)
+    return image[top:bottom, left:right], (left, height - bottom)
@@ -0,0 +1,283 @@
+"""How grouping scales with the number of points.
+
+    python -m semmatch.scaling [-o groups.json] [--sizes 10 100 1000 ...] [--options 0 1 2 3 4]
+
+groupPts runs with every --groupOption on uniform, clustered and lattice point
+sets of 10 to 100k points, made from a fixed seed at the density of the holes
+of a holey carbon map, so the area grows with the number of points. For every
+run the report keeps the time, the number of groups and the largest one, and
+the length of the tour through all the points in acquisition order, so a
+change that makes the path worse shows up as well as one that makes it
+slower.
+
+The report prints the times against the number of points on log-log axes: the
+exponent fitted to each row is 1 for linear scaling and 2 for quadratic,
+whatever the machine. Each size runs --repeat times, or once when a run takes
+over a tenth of --budget seconds; after such a run larger sizes of the case are
+skipped, since a quadratic step up in size would go over the budget. Reports
+are JSON in the format of semmatch.bench, so python -m semmatch.bench compare
+flags slower cases and longer tours between two of them.
+"""
+
+import argparse
+import json
+import math
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from semmatch.bench import HOLE_PITCH, LATTICE_PIXEL_SIZE, SEED, environment
+from semmatch.core import NavOptions, Pt
+
+SIZES = (10, 32, 100, 316, 1000, 3162, 10000, 31623, 100000)
+KINDS = ("uniform", "clustered", "lattice")
+GROUP_OPTIONS = (0, 1, 2, 3, 4)
+BUDGET = 30.0
+# points around each cluster center, about one grid square's worth
+CLUSTER_SIZE = 50
+
+
+def pointSet(kind, n, seed=SEED):
+    """n distinct integer points, one per HOLE_PITCH² pixels on average, with
+    (0,0) at the bottom-left corner: uniformly random, in random clusters of
+    about CLUSTER_SIZE points or on a square lattice filled row by row."""
+    rng = np.random.default_rng(seed)
+    side = math.ceil(math.sqrt(n)) * HOLE_PITCH
+    if kind == "lattice":
+        cols = math.ceil(math.sqrt(n))
+        i = np.arange(n)
+        pts = np.stack([i % cols, i // cols], axis=1) * HOLE_PITCH + HOLE_PITCH // 2
+    elif kind == "uniform":
+        cells = rng.choice(side * side, n, replace=False)
+        pts = np.stack([cells % side, cells // side], axis=1)
+    elif kind == "clustered":
+        centers = rng.uniform(0, side, (max(n // CLUSTER_SIZE, 1), 2))
+        pts = np.empty((0, 2), int)
+        while len(pts) < n:
+            more = centers[rng.integers(0, len(centers), n)]
+            more += rng.normal(0, 2 * HOLE_PITCH, more.shape)
+            more = np.clip(np.round(more), 0, side - 1).astype(int)
+            pts = np.concatenate([pts, more])
+            # the first of any repeated points, in the order they were made
+            _, first = np.unique(pts, axis=0, return_index=True)
+            pts = pts[np.sort(first)]
+        pts = pts[:n]
+    else:
+        raise ValueError("unknown point set: %s" % kind)
+    return [Pt(x, y) for x, y in pts.tolist()]
+
+
+def tourLength(groups):
+    """Length in pixels of the path through the points of groups in order."""
+    pts = np.array([pt for group in groups for pt in group], float)
+    if len(pts) < 2:
+        return 0.0
+    return float(np.hypot(*np.diff(pts, axis=0).T).sum())
+
+
+def navOptions(groupOption):
+    # 7 µm groups hold about 10 holes of the lattice
+    return NavOptions(groupOption, 7.0, LATTICE_PIXEL_SIZE, 10, 8, 1)
+
+
+def timeGrouping(pts, groupOption, repeat, budget):
+    """Times of grouping pts, and the groups they were split into."""
+    from semmatch.groups import groupPts
+
+    options = navOptions(groupOption)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        groups = groupPts(list(pts), options)
+        seconds.append(time.perf_counter() - start)
+        if seconds[-1] > budget / 10:
+            break
+    return seconds, groups
+
+
+def run(
+    sizes=SIZES,
+    groupOptions=GROUP_OPTIONS,
+    kinds=KINDS,
+    repeat=3,
+    budget=BUDGET,
+    log=None,
+):
+    """Time grouping each point set of each size with each option and return
+    the report."""
+    from semmatch.groups import groupPts
+
+    report = {
+        "environment": environment(),
+        "repeat": repeat,
+        "budget": budget,
+        "cases": {},
+    }
+    for groupOption in groupOptions:
+        # imports and first-call setup, such as scikit-learn's for k-means
+        groupPts(pointSet("uniform", 10), navOptions(groupOption))
+        for kind in kinds:
+            skipping = False
+            for n in sizes:
+                name = "groupPts/option%d/%s-%d" % (groupOption, kind, n)
+                if skipping:
+                    case = {"points": n, "skipped": "over budget"}
+                else:
+                    pts = pointSet(kind, n)
+                    seconds, groups = timeGrouping(pts, groupOption, repeat, budget)
+                    length = tourLength(groups)
+                    case = {
+                        "points": n,
+                        "seconds": seconds,
+                        "min": min(seconds),
+                        "median": statistics.median(seconds),
+                        "groups": len(groups),
+                        "largestGroup": max(
+                            (len(group) for group in groups), default=0
+                        ),
+                        "tourLength": length,
+                        # in lattice pitches per point: 1 for a lattice walked
+                        # row by row, about 0.7 for the best tour of uniform
+                        # points and 25% more for a greedy one
+                        "tourPerPoint": length / (n * HOLE_PITCH),
+                    }
+                    skipping = seconds[-1] > budget / 10
+                report["cases"][name] = case
+                if log is not None:
+                    log(formatCase(name, case))
+    report["exponents"] = exponents(report["cases"])
+    return report
+
+
+def formatCase(name, case):
+    if "min" not in case:
+        return "%-36s skipped (%s)" % (name, case["skipped"])
+    return "%-36s %9.4f s  %6d groups  %6.3f pitches per point" % (
+        name,
+        case["min"],
+        case["groups"],
+        case["tourPerPoint"],
+    )
+
+
+def _series(cases):
+    """{(option, kind): [(points, case), ...]} of the cases of a report."""
+    series = {}
+    for name, case in cases.items():
+        _, option, kindSize = name.split("/")
+        kind = kindSize.rsplit("-", 1)[0]
+        series.setdefault((option, kind), []).append((case["points"], case))
+    return {
+        key: sorted(points, key=lambda point: point[0])
+        for key, points in series.items()
+    }
+
+
+def exponents(cases, minSeconds=1e-3):
+    """Slope of log time against log points of each option and point set,
+    fitted to the runs that took at least minSeconds; None with fewer than
+    two of those."""
+    result = {}
+    for (option, kind), points in _series(cases).items():
+        fit = [
+            (n, case["min"]) for n, case in points if case.get("min", 0) >= minSeconds
+        ]
+        slope = None
+        if len(fit) >= 2:
+            x, y = np.log10(np.array(fit, float)).T
+            slope = round(float(np.polyfit(x, y, 1)[0]), 2)
+        result["%s/%s" % (option, kind)] = slope
+    return result
+
+
+def formatReport(report):
+    """Log-log table of the times in report: a row per option and point set,
+    a column per size, and the fitted exponent."""
+    series = _series(report["cases"])
+    sizes = sorted({n for points in series.values() for n, _ in points})
+    lines = [
+        "%-20s" % "seconds"
+        + "".join("%10s" % ("%g" % n if n < 1e5 else "%.0e" % n) for n in sizes)
+        + "  exponent  tour/pt"
+    ]
+    for (option, kind), points in sorted(series.items()):
+        bySize = dict(points)
+        cells = []
+        for n in sizes:
+            case = bySize.get(n)
+            cells.append(
+                "%10s" % ("%.2e" % case["min"] if case and "min" in case else "-")
+            )
+        measured = [case for _, case in points if "min" in case]
+        slope = report["exponents"].get("%s/%s" % (option, kind))
+        tour = "%.3f" % measured[-1]["tourPerPoint"] if measured else "-"
+        lines.append(
+            "%-20s" % ("%s %s" % (option, kind))
+            + "".join(cells)
+            + "  %8s" % ("%.2f" % slope if slope is not None else "-")
+            + "  %7s" % tour
+        )
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m semmatch.scaling", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument("-o", "--output", help="write the report to this JSON file")
+    parser.add_argument("--json", help="print the report as JSON", action="store_true")
+    parser.add_argument(
+        "--sizes",
+        help="numbers of points (default %s)" % " ".join(map(str, SIZES)),
+        type=int,
+        nargs="+",
+        default=SIZES,
+    )
+    parser.add_argument(
+        "--options",
+        help="groupOptions to run (default all)",
+        type=int,
+        nargs="+",
+        choices=GROUP_OPTIONS,
+        default=GROUP_OPTIONS,
+    )
+    parser.add_argument(
+        "--kinds",
+        help="point sets to run (default all)",
+        nargs="+",
+        choices=KINDS,
+        default=KINDS,
+    )
+    parser.add_argument("--repeat", help="times each case is run", type=int, default=3)
+    parser.add_argument(
+        "--budget",
+        help="seconds a case may take; sizes after a run over a tenth of it are"
+        " skipped (default %g)" % BUDGET,
+        type=float,
+        default=BUDGET,
+    )
+    args = parser.parse_args(argv)
+
+    report = run(
+        args.sizes,
+        args.options,
+        args.kinds,
+        args.repeat,
+        args.budget,
+        log=None if args.json else print,
+    )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print()
+        print("\n".join(formatReport(report)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
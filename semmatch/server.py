@@ -0,0 +1,277 @@
+"""Keep semmatch warm between calls from SerialEM.
+
+    semmatch serve [--address ADDRESS] [--workers N]
+
+starts a server that runs semmatch command lines sent to it by
+``semmatch --client ...``. Its worker processes import OpenCV, SciPy and the
+rest once at startup, so a request only pays for the search itself. When no
+server is running, ``semmatch --client`` runs the command itself.
+
+The server listens on a named pipe on Windows and a Unix socket elsewhere, in
+a directory only the user can open, never on the network. Each time it starts
+it writes a new random key to a file only the user can read, and it drops
+any connection that can't prove it has the key, so other users and processes
+on the machine can't make it run commands.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import traceback
+from multiprocessing.connection import (
+    AuthenticationError,
+    Client,
+    Listener,
+    answer_challenge,
+    deliver_challenge,
+)
+
+# where the socket and key live; ~/.semmatch by default
+STATE_DIR = os.environ.get("SEMMATCH_HOME", os.path.join("~", ".semmatch"))
+
+
+def _stateDir():
+    path = os.path.expanduser(STATE_DIR)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def defaultAddress():
+    """Named pipe or socket path of the server: SEMMATCH_ADDRESS if set, else
+    one per user."""
+    if "SEMMATCH_ADDRESS" in os.environ:
+        return os.environ["SEMMATCH_ADDRESS"]
+    if os.name == "nt":
+        import getpass
+
+        return r"\\.\pipe\semmatch-%s" % getpass.getuser()
+    return os.path.join(_stateDir(), "server.sock")
+
+
+def keyPath():
+    return os.path.join(_stateDir(), "server.key")
+
+
+def _writeKey():
+    """Write a new random key readable only by the user and return it."""
+    key = os.urandom(32)
+    path = keyPath()
+    tmpfile = path + ".tmp"
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+    fd = os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key.hex().encode())
+    os.replace(tmpfile, path)
+    return key
+
+
+def _readKey():
+    with open(keyPath(), "rb") as f:
+        return bytes.fromhex(f.read().decode())
+
+
+def _warmUp():
+    """Import what the detectors need and run each of them once on a tiny
+    image, so the first request of a worker doesn't pay for it; the detectors
+    import their dependencies only when they first run."""
+    import imageio
+    import numpy as np
+    import semmatch.autodoc
+    import semmatch.coords
+    from semmatch.core import houghCircles, laceySearch, templateMatch
+    from semmatch.groups import k_means
+
+    image = np.full((64, 64), 128, np.uint8)
+    templateMatch(image, image[:8, :8], 0.8)
+    houghCircles(image, 10)
+    laceySearch(image, 10, 195, 245)
+    k_means([(0, 0), (0, 1), (5, 5), (5, 6)], 2)
+
+
+def _workerPid(_):
+    return os.getpid()
+
+
+def runCommand(argv, cwd):
+    """Run a semmatch command line in this process.
+
+    Returns the exit status, everything printed to stdout and stderr, and
+    whether the command ran to the end rather than stopping early, which
+    semmatch also does with status 0 when it aborts.
+    """
+    from semmatch.__main__ import main
+
+    output = io.StringIO()
+    finished = False
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            os.chdir(cwd)
+            main(argv)
+            returncode = 0
+            finished = True
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                returncode = e.code or 0
+            else:
+                print(e.code)
+                returncode = 1
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+    return returncode, output.getvalue(), finished
+
+
+def _parseRequest(data):
+    """argv and cwd of a JSON request; ValueError if it isn't one that can
+    be run."""
+    try:
+        request = json.loads(data)
+        argv = [str(arg) for arg in request["argv"]]
+        cwd = request.get("cwd", os.getcwd())
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("bad request: %r" % e)
+    if argv[:1] == ["serve"] or "--client" in argv:
+        raise ValueError("can't forward to the server")
+    return argv, cwd
+
+
+def _serverRunning(address):
+    try:
+        Client(address, authkey=_readKey()).close()
+    except (OSError, ValueError):
+        return False
+    except (EOFError, AuthenticationError):
+        pass  # something is listening, with another key
+    return True
+
+
+class Server:
+    """Runs the command lines sent to address in a pool of worker processes,
+    a thread per connection."""
+
+    def __init__(self, address, workers):
+        if _serverRunning(address):
+            raise OSError("a semmatch server is already listening on %s" % address)
+        self.address = address
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_warmUp
+        )
+        # start all the workers now instead of on the first requests
+        list(self.pool.map(_workerPid, range(workers)))
+        self.key = _writeKey()
+        if os.name != "nt" and os.path.exists(address):
+            # left behind by a server that didn't shut down cleanly
+            os.remove(address)
+        # the key is checked in each connection's thread rather than by
+        # accept, so a client that never answers can't hold up the others
+        self.listener = Listener(address)
+        self.stopping = False
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                deliver_challenge(conn, self.key)
+                answer_challenge(conn, self.key)
+            except (AuthenticationError, EOFError, OSError):
+                return
+            try:
+                try:
+                    argv, cwd = _parseRequest(conn.recv_bytes())
+                except ValueError as e:
+                    reply = {"returncode": 2, "output": "%s\n" % e}
+                else:
+                    returncode, output, _ = self.pool.submit(
+                        runCommand, argv, cwd
+                    ).result()
+                    reply = {"returncode": returncode, "output": output}
+                conn.send_bytes(json.dumps(reply).encode())
+            except (EOFError, OSError):
+                pass  # the client went away
+
+    def serve_forever(self):
+        """Serve until shutdown is called from another thread."""
+        while True:
+            try:
+                conn = self.listener.accept()
+            except ConnectionError:
+                continue  # the client went away before it was accepted
+            if self.stopping:
+                conn.close()
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def shutdown(self):
+        self.stopping = True
+        # wake the accept in serve_forever
+        with contextlib.suppress(OSError):
+            Client(self.address).close()
+
+    def server_close(self):
+        self.listener.close()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="semmatch serve",
+        description="run semmatch commands sent by semmatch --client",
+    )
+    parser.add_argument(
+        "--address",
+        help="named pipe or Unix socket to listen on; default one per user,"
+        " or SEMMATCH_ADDRESS",
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of commands to run at once",
+        type=int,
+        default=os.cpu_count(),
+    )
+    args = parser.parse_args(argv)
+
+    address = args.address or defaultAddress()
+    try:
+        server = Server(address, args.workers)
+    except OSError as e:
+        print(e)
+        return 1
+    with server:
+        print("semmatch server listening on %s" % address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def client(argv, address=None):
+    """Run a semmatch command line on the server, or here if none is running.
+
+    Returns the command's exit status.
+    """
+    address = address or defaultAddress()
+    try:
+        conn = Client(address, authkey=_readKey())
+    except (OSError, ValueError, EOFError, AuthenticationError):
+        # no server, or a key from an earlier one
+        from semmatch.__main__ import main
+
+        main(argv)
+        return 0
+
+    with conn:
+        conn.send_bytes(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode())
+        reply = json.loads(conn.recv_bytes())
+    sys.stdout.write(reply["output"])
+    return reply["returncode"]
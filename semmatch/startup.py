@@ -0,0 +1,137 @@
+"""Measure how long semmatch takes to start in each mode.
+
+    python -m semmatch.startup [--json] [--check]
+
+Every mode is run in a fresh interpreter with ``-X importtime`` so the
+numbers match what a SerialEM ``RunInShell`` call pays before any pixel is
+processed. The report lists the wall time of each mode, the total import time
+and the packages that cost the most. With --check the exit status is nonzero
+if a mode is over its entry in COLD_START_BUDGET.
+"""
+
+import argparse
+import collections
+import json
+import subprocess
+import sys
+import time
+
+_tinyImage = "import numpy as np; img = np.full((64, 64), 128, np.uint8); "
+
+# code that goes through the same imports as each mode, on tiny inputs
+MODES = {
+    # the arguments of a SerialEM script parsed, stopping before the run
+    "cli": "import semmatch.__main__ as cli; cli.run = lambda args: None; "
+    + "cli.main(['--navfile', 'nav.nav', '--mapLabel', '30-A', '--newLabel', '1', "
+    + "'--pixelSize', '13', '--template', 'T.jpg', '--appendTo', 'nav.nav'])",
+    "template": _tinyImage
+    + "import imageio; from semmatch.core import templateMatch; "
+    + "templateMatch(img, img[:8, :8], 0.8)",
+    "hough": _tinyImage
+    + "import imageio; from semmatch.core import houghCircles; houghCircles(img, 10)",
+    "lacey": _tinyImage
+    + "import imageio; from semmatch.core import laceySearch; "
+    + "laceySearch(img, 10, 195, 245)",
+    "kmeans": "from semmatch.groups import k_means; "
+    + "k_means([(0, 0), (0, 1), (5, 5), (5, 6)], 2)",
+    "gui": "import semmatch.gui",
+}
+
+# seconds from interpreter start to the first pixel on a warm disk cache;
+# documented in the README
+COLD_START_BUDGET = {
+    "cli": 0.3,
+    "template": 1.0,
+    "hough": 2.0,
+    "lacey": 1.0,
+    "kmeans": 2.0,
+    "gui": 1.5,
+}
+
+
+def parseImportTimes(stderr):
+    """Cumulative import time in seconds of each top-level import."""
+    times = collections.Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # nested imports are indented and already counted by their parent
+        if name[1:2] != " ":
+            times[name.strip().split(".")[0]] += int(cumulative) / 1e6
+    return times
+
+
+def measure(mode):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", MODES[mode]],
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    wallTime = time.perf_counter() - start
+    if result.returncode != 0:
+        return {"mode": mode, "error": result.stderr.strip().splitlines()[-1]}
+    importTimes = parseImportTimes(result.stderr)
+    return {
+        "mode": mode,
+        "wallTime": wallTime,
+        "importTime": sum(importTimes.values()),
+        "budget": COLD_START_BUDGET[mode],
+        "imports": dict(importTimes.most_common()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m semmatch.startup", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument(
+        "modes", help="modes to measure: %s" % ", ".join(MODES), nargs="*"
+    )
+    parser.add_argument("--json", help="print the report as JSON", action="store_true")
+    parser.add_argument(
+        "--check", help="fail if a mode is over its budget", action="store_true"
+    )
+    parser.add_argument(
+        "--top", help="number of packages listed per mode", type=int, default=5
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error("unknown modes: %s" % ", ".join(sorted(unknown)))
+
+    report = [measure(mode) for mode in args.modes or MODES]
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for result in report:
+            if "error" in result:
+                print("%-9s failed: %s" % (result["mode"], result["error"]))
+                continue
+            print(
+                "%-9s %6.2f s (budget %.1f s), imports %.2f s"
+                % (
+                    result["mode"],
+                    result["wallTime"],
+                    result["budget"],
+                    result["importTime"],
+                )
+            )
+            for name, seconds in list(result["imports"].items())[: args.top]:
+                print("    %-20s %6.3f s" % (name, seconds))
+
+    overBudget = [
+        result["mode"]
+        for result in report
+        if "error" in result or result["wallTime"] > result["budget"]
+    ]
+    if args.check and overBudget:
+        print("over budget: %s" % ", ".join(overBudget))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""Timing spans: where the time of a run goes.
+
+    from semmatch.timing import span, timed
+
+    @timed
+    def detector(image):
+        with span("correlate"):
+            ...
+
+Spans nest into a tree of the stages of a run, with the seconds and number
+of calls of each; repeated spans with the same parent, like the groups of a
+map, add up into one node. They are only recorded in a thread running under
+profiling(). Elsewhere span returns a shared do-nothing context manager and a
+timed function calls straight through, so they stay in the production code
+paths at the cost of a function call each. profiling(memory=True) records
+the memory each stage used as well; see semmatch.memory.
+"""
+
+import contextlib
+import functools
+import threading
+import time
+import tracemalloc
+
+from semmatch.memory import peakRss
+
+_local = threading.local()
+_NOT_PROFILING = contextlib.nullcontext()
+# new in Python 3.9; before that a span's peak is the most traced at once
+# since tracing started, which can only be more than the span's own
+_resetPeak = getattr(tracemalloc, "reset_peak", lambda: None)
+
+
+class Span:
+    """Total seconds and calls of one stage, and of the stages inside it.
+
+    peakRss is the process's peak RSS in bytes when the stage last ended and,
+    when memory is traced, peakMemory the most bytes any call of the stage
+    allocated at once.
+    """
+
+    __slots__ = ("name", "seconds", "calls", "children", "peakMemory", "peakRss")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.children = {}
+        self.peakMemory = None
+        self.peakRss = None
+
+    def child(self, name) -> "Span":
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = Span(name)
+        return node
+
+    def toDict(self) -> dict:
+        node = {"name": self.name, "seconds": self.seconds, "calls": self.calls}
+        if self.peakRss is not None:
+            node["peakRss"] = self.peakRss
+        if self.peakMemory is not None:
+            node["peakMemory"] = self.peakMemory
+        if self.children:
+            node["children"] = [child.toDict() for child in self.children.values()]
+        return node
+
+
+class _Timer:
+    __slots__ = ("profile", "name", "node", "start")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        profile = self.profile
+        self.node = profile.stack[-1].child(self.name)
+        profile.stack.append(self.node)
+        if profile.memory:
+            profile._enterMemory()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.node.seconds += time.perf_counter() - self.start
+        self.node.calls += 1
+        if self.profile.memory:
+            self.profile._exitMemory(self.node)
+        self.node.peakRss = peakRss()
+        self.profile.stack.pop()
+
+
+class Profile:
+    """The tree of spans recorded in one thread, under a root span.
+
+    With memory, the memory each span allocates is traced as well, starting
+    tracemalloc if it isn't tracing already (and stopping it again in stop).
+    Tracing slows allocation-heavy Python code, such as navigator parsing,
+    several times over; NumPy and OpenCV stages hardly notice.
+    """
+
+    def __init__(self, name="run", memory=False):
+        self.root = Span(name)
+        self.stack = [self.root]
+        self.memory = memory
+        self.stopped = False
+        if memory:
+            self.startedTracing = not tracemalloc.is_tracing()
+            if self.startedTracing:
+                tracemalloc.start()
+            # bytes traced at the start of each open span, and the most
+            # traced since
+            current = tracemalloc.get_traced_memory()[0]
+            _resetPeak()
+            self.memoryStack = [[current, current]]
+        self.start = time.perf_counter()
+
+    def span(self, name):
+        return _Timer(self, name)
+
+    def _enterMemory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        parent = self.memoryStack[-1]
+        parent[1] = max(parent[1], peak)
+        _resetPeak()
+        self.memoryStack.append([current, current])
+
+    def _exitMemory(self, node):
+        start, highest = self.memoryStack.pop()
+        highest = max(highest, tracemalloc.get_traced_memory()[1])
+        _resetPeak()
+        if self.memoryStack:
+            parent = self.memoryStack[-1]
+            parent[1] = max(parent[1], highest)
+        node.peakMemory = max(node.peakMemory or 0, highest - start)
+
+    def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        self.root.seconds = time.perf_counter() - self.start
+        self.root.calls = 1
+        self.root.peakRss = peakRss()
+        if self.memory:
+            self._exitMemory(self.root)
+            if self.startedTracing:
+                tracemalloc.stop()
+
+    def toDict(self) -> dict:
+        return self.root.toDict()
+
+
+def span(name):
+    """Context manager timing the stage name, if this thread is profiling."""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return _NOT_PROFILING
+    return _Timer(profile, name)
+
+
+def addSpans(tree):
+    """Add a tree of spans from Profile.toDict, e.g. recorded in a worker
+    process, inside the current span of this thread, if it's profiling."""
+    profile = getattr(_local, "profile", None)
+    if profile is not None:
+        _merge(profile.stack[-1], tree)
+
+
+def _merge(parent, tree):
+    node = parent.child(tree["name"])
+    node.seconds += tree["seconds"]
+    node.calls += tree["calls"]
+    if tree.get("peakRss") is not None:
+        node.peakRss = max(node.peakRss or 0, tree["peakRss"])
+    if "peakMemory" in tree:
+        node.peakMemory = max(node.peakMemory or 0, tree["peakMemory"])
+    for child in tree.get("children", ()):
+        _merge(node, child)
+
+
+def timed(fn=None, name=None):
+    """Decorator timing each call of fn as a span, named after fn by default."""
+    if fn is None:
+        return functools.partial(timed, name=name)
+    name = fn.__name__ if name is None else name
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = getattr(_local, "profile", None)
+        if profile is None:
+            return fn(*args, **kwargs)
+        with _Timer(profile, name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def profiling(name="run", memory=False):
+    """Record the spans of this thread, and with memory the memory they use,
+    in the Profile yielded until the with block exits; profiling in an outer
+    block resumes afterwards."""
+    previous = getattr(_local, "profile", None)
+    profile = Profile(name, memory)
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _local.profile = previous
+
+
+@contextlib.contextmanager
+def profiledRun(profile=None, cprofile=None, memory=False, **info):
+    """Profile the with block for the --profile, --traceMemory and --cprofile
+    options.
+
+    The span tree, with the memory of each stage if memory is set, is written
+    to profile as JSON along with the items of info, and cProfile's
+    statistics to cprofile for pstats or snakeviz.
+    Either is written even if the block exits with an error, so aborted runs
+    can be looked at too.
+    """
+    with contextlib.ExitStack() as stack:
+        if cprofile is not None:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            stack.callback(profiler.dump_stats, cprofile)
+            stack.callback(profiler.disable)
+            profiler.enable()
+        if profile is None:
+            yield None
+            return
+        recorded = stack.enter_context(profiling(memory=memory))
+        stack.callback(_writeProfile, profile, recorded, info)
+        yield recorded
+
+
+def _writeProfile(path, profile, info):
+    import json
+
+    # written before profiling() exits, so the root's time is taken here
+    profile.stop()
+    report = dict(info, spans=profile.toDict())
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
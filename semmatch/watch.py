@@ -0,0 +1,263 @@
+"""Process maps as soon as they show up in a folder.
+
+    semmatch watch DIR [--workers N] [--images]
+
+Every job is a JSON file in DIR whose keys are semmatch's command line options
+without the dashes, e.g.
+
+    {"mapLabel": "30-A", "image": "30-A.jpg", "pixelSize": 13.3, "houghCircles": true}
+
+Options shared by all jobs can go in DIR/defaults.json. With --images, a new
+image on its own is a job too, with its file name (minus the extension) as
+the map label, unless defaults.json or a JSON job refers to it. Paths are
+relative to DIR. If a job has no newLabel, it gets its own block of labels
+after the last one in the navigator.
+
+For each job file, e.g. 30-A.json, results/30-A.json.nav is written
+atomically for MergeNavFile, next to results/30-A.json.status.json with the
+job's state (done, aborted or failed) and timing and results/30-A.json.log
+with its output.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+
+from semmatch.server import runCommand
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+
+def writeJson(path, data):
+    """Write data to path as JSON, atomically."""
+    tmpfile = path + ".tmp"
+    with open(tmpfile, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmpfile, path)
+
+
+def jobArgv(job):
+    """Command line for a job dict of option names and values."""
+    argv = []
+    for key, val in job.items():
+        if val is True:
+            argv.append("--" + key)
+        elif val is not False and val is not None:
+            argv += ["--" + key, str(val)]
+    return argv
+
+
+def jobImages(job):
+    """Files a job dict refers to as its map image or template."""
+    return {
+        os.path.normpath(job[key])
+        for key in ("image", "template")
+        if isinstance(job.get(key), str)
+    }
+
+
+def _runJob(argv, cwd, statusPath, outputPath, logPath, status):
+    status.update(state="running", startedAt=time.time())
+    writeJson(statusPath, status)
+    returncode, output, finished = runCommand(argv, cwd)
+    with open(logPath, "w") as f:
+        f.write(output)
+    points = 0
+    if os.path.exists(outputPath):
+        with open(outputPath) as f:
+            points = sum(line.startswith("[Item") for line in f)
+    if returncode != 0:
+        state = "failed"
+    elif not finished:
+        # semmatch exits with status 0 when it aborts, e.g. on a missing map
+        # label, leaving an empty output
+        state = "aborted"
+    else:
+        state = "done"
+    status.update(
+        state=state,
+        returncode=returncode,
+        points=points,
+        finishedAt=time.time(),
+    )
+    status["queuedSeconds"] = status["startedAt"] - status["queuedAt"]
+    status["runSeconds"] = status["finishedAt"] - status["startedAt"]
+    writeJson(statusPath, status)
+    return status
+
+
+class Watcher:
+    """Finds new jobs in a folder and runs them in a pool of processes."""
+
+    def __init__(self, directory, workers, images=False, settle=1.0, labelBlock=1000):
+        self.directory = os.path.abspath(directory)
+        self.results = os.path.join(self.directory, "results")
+        os.makedirs(self.results, exist_ok=True)
+        self.images = images
+        self.settle = settle
+        self.labelBlock = labelBlock
+        self.seen = set()
+        # images that JSON jobs use, which aren't jobs of their own
+        self.referenced = set()
+        self.nextLabel = None
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    def _defaults(self):
+        path = os.path.join(self.directory, "defaults.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _readJob(self, name):
+        with open(os.path.join(self.directory, name)) as f:
+            job = json.load(f)
+        if not isinstance(job, dict):
+            raise ValueError("not a JSON object of options")
+        return job
+
+    def _newJobs(self):
+        """Names of job files that are complete and haven't been queued yet.
+
+        JSON jobs come first, so the images they refer to are known before
+        the images are looked at.
+        """
+        now = time.time()
+        names = sorted(os.listdir(self.directory))
+        names.sort(key=lambda name: not name.endswith(".json"))
+        try:
+            self.referenced |= jobImages(self._defaults())
+        except (OSError, ValueError):
+            pass
+        for name in names:
+            ext = os.path.splitext(name)[1]
+            if name in self.seen or name == "defaults.json":
+                continue
+            if ext != ".json" and not (
+                self.images
+                and ext.lower() in IMAGE_EXTENSIONS
+                and name not in self.referenced
+            ):
+                continue
+            path = os.path.join(self.directory, name)
+            # SerialEM may still be writing it
+            if now - os.path.getmtime(path) < self.settle:
+                continue
+            self.seen.add(name)
+            if ext == ".json":
+                try:
+                    self.referenced |= jobImages(self._readJob(name))
+                except (OSError, ValueError):
+                    pass  # reported when the job is submitted
+            status = os.path.join(self.results, name + ".status.json")
+            if os.path.exists(status):  # done in an earlier session
+                continue
+            yield name
+
+    def _allocateLabel(self, navfile):
+        if self.nextLabel is None:
+            from semmatch.autodoc import openNavfile
+            from semmatch.batch import nextLabel
+
+            self.nextLabel = nextLabel(
+                openNavfile(os.path.join(self.directory, navfile))
+            )
+        label = self.nextLabel
+        self.nextLabel += self.labelBlock
+        return label
+
+    def submit(self, name):
+        stem, ext = os.path.splitext(name)
+        job = self._defaults()
+        try:
+            if ext == ".json":
+                job.update(self._readJob(name))
+            else:
+                job.update(image=name, mapLabel=stem)
+            if "newLabel" not in job and "navfile" in job:
+                job["newLabel"] = self._allocateLabel(job["navfile"])
+        except (OSError, ValueError) as e:
+            print("%s: could not read job: %s" % (name, e))
+            return
+        job.pop("appendTo", None)
+        # results are named after the whole file name, so 30-A.json and
+        # 30-A.jpg don't share them
+        job["output"] = os.path.join(self.results, name + ".nav")
+
+        status = {"job": name, "state": "queued", "queuedAt": time.time()}
+        statusPath = os.path.join(self.results, name + ".status.json")
+        writeJson(statusPath, status)
+        future = self.pool.submit(
+            _runJob,
+            jobArgv(job),
+            self.directory,
+            statusPath,
+            job["output"],
+            os.path.join(self.results, name + ".log"),
+            status,
+        )
+        future.add_done_callback(self._report)
+        print("%s: queued" % name)
+
+    def _report(self, future):
+        try:
+            status = future.result()
+        except Exception as e:
+            print("job failed: %r" % e)
+            return
+        print(
+            "%s: %s, %d points in %.1f s"
+            % (status["job"], status["state"], status["points"], status["runSeconds"])
+        )
+
+    def poll(self):
+        for name in self._newJobs():
+            self.submit(name)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="semmatch watch", description="process maps as they show up in a folder"
+    )
+    parser.add_argument("directory", help="folder to watch for jobs")
+    parser.add_argument(
+        "--workers",
+        help="number of jobs to run at once",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--images", help="treat new images as jobs too", action="store_true"
+    )
+    parser.add_argument(
+        "--interval",
+        help="seconds between checks for new jobs",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--once",
+        help="run the jobs that are there now, then exit",
+        action="store_true",
+    )
+    args = parser.parse_args(argv)
+
+    watcher = Watcher(args.directory, args.workers, images=args.images)
+    print("watching %s" % watcher.directory)
+    try:
+        if args.once:
+            watcher.settle = 0
+            watcher.poll()
+        else:
+            while True:
+                watcher.poll()
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
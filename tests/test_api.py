@@ -0,0 +1,39 @@
+import sys
+import numpy as np
+import PIL.Image
+import pytest
+from scipy.ndimage import gaussian_filter
+import semmatch.api
+from semmatch.core import NavOptions, templateMatch
+from semmatch.autodoc import openNavfile
+
+
+def test_find_points():
+    MMM = gaussian_filter(np.array(PIL.Image.open("MMM.jpg")), sigma=1)
+    template = gaussian_filter(np.array(PIL.Image.open("T.jpg")), sigma=1)
+
+    pts = semmatch.api.find_points(MMM, 13, "template", template=template)
+    assert pts.tolist() == [list(pt) for pt in templateMatch(MMM, template, 0.8)]
+
+    # 16-bit buffers are scaled to 8 bits first
+    pts16 = semmatch.api.find_points(
+        MMM.astype(np.uint16) * 64, 13, "template", template=template
+    )
+    assert len(pts16) == len(pts)
+    assert "PyQt5" not in sys.modules
+
+
+def test_nav_items():
+    nav = openNavfile("nav.nav")
+    items = semmatch.api.nav_items(np.array([[10, 20], [5, 6]]), nav["30-A"], 9000)
+    assert [item.CoordsInMap for item in items] == [[5, 6, 31.9355], [10, 20, 31.9355]]
+    assert str(items[0]).startswith("[Item = 9000]\n")
+
+    # bad options raise rather than exiting SerialEM's interpreter
+    for options in (
+        NavOptions(1, 7.0, None, 10, 8, 1),
+        NavOptions(1, 7.0, 0, 10, 8, 1),
+        NavOptions(4, 7.0, 13, 10, 0, 1),
+    ):
+        with pytest.raises(ValueError):
+            semmatch.api.nav_items([[10, 20]], nav["30-A"], 9000, options)
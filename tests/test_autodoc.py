@@ -0,0 +1,109 @@
+import os
+import shutil
+import pytest
+import semmatch.autodoc
+from semmatch.core import Pt, NavOptions
+from semmatch.autodoc import (
+    ptsToNavPts,
+    openNavfile,
+    createAutodoc,
+    appendToNavfile,
+    appendingTo,
+)
+
+coords = [
+    Pt(2149, 1904),
+    Pt(2637, 1448),
+    Pt(1732, 1229),
+    Pt(2239, 1535),
+    Pt(2293, 2128),
+    Pt(2897, 1120),
+    Pt(2111, 2088),
+    Pt(1769, 1044),
+    Pt(2819, 1488),
+    Pt(2019, 1680),
+    Pt(2095, 1311),
+    Pt(2598, 1633),
+]
+options = NavOptions(
+    groupOption=0, groupRadius=123, pixelSize=1, numGroups=1, ptsPerGroup=8, acquire=1
+)
+
+
+def test_clearOutput(tmp_path, monkeypatch):
+    import semmatch.__main__
+
+    output = str(tmp_path / "out.nav")
+    nav = openNavfile("nav.nav")
+    createAutodoc(output, ptsToNavPts(coords, nav, "30-A", 9000, options))
+
+    # a run that fails any way leaves no points behind for MergeNavFile
+    def fail(args):
+        raise RuntimeError
+
+    monkeypatch.setattr(semmatch.__main__, "run", fail)
+    with pytest.raises(RuntimeError):
+        semmatch.__main__.main(
+            [
+                "--navfile",
+                "nav.nav",
+                "--mapLabel",
+                "30-A",
+                "--newLabel",
+                "500",
+                "--pixelSize",
+                "13",
+                "-o",
+                output,
+            ]
+        )
+    assert openNavfile(output) == {}
+
+
+def test_appendToNavfile(tmp_path):
+    navfile = str(tmp_path / "nav.nav")
+    with open("nav.nav") as f:
+        original = f.read()
+    with open(navfile, "w") as f:
+        f.write(original)
+
+    nav = openNavfile(navfile)
+    navPts = ptsToNavPts(coords, nav, "30-A", startLabel=9000, options=options)
+    appendToNavfile(navfile, navPts)
+
+    with open(navfile) as f:
+        appended = f.read()
+    assert appended.startswith(original)
+    newNav = openNavfile(navfile)
+    assert len(newNav) == len(nav) + len(coords)
+    mapIDs = [item["MapID"] for item in newNav.values()]
+    assert len(set(mapIDs)) == len(mapIDs)
+
+    # labels 9000.. are taken now; nothing should be written
+    with pytest.raises(ValueError):
+        appendToNavfile(navfile, navPts)
+    with open(navfile) as f:
+        assert f.read() == appended
+
+    # failures inside the transaction roll back earlier appends
+    navPts = ptsToNavPts(coords, nav, "30-A", startLabel=10000, options=options)
+    with pytest.raises(RuntimeError):
+        with appendingTo(navfile) as append:
+            append(navPts)
+            raise RuntimeError
+    with open(navfile) as f:
+        assert f.read() == appended
+
+
+def test_appendToLockedNavfile(tmp_path, monkeypatch):
+    navfile = str(tmp_path / "nav.nav")
+    shutil.copy("nav.nav", navfile)
+    nav = openNavfile(navfile)
+    navPts = ptsToNavPts(coords, nav, "30-A", startLabel=9000, options=options)
+    monkeypatch.setattr(semmatch.autodoc, "LOCK_TIMEOUT", 0.3)
+    # another program holding the navigator makes the append give up
+    with appendingTo(navfile):
+        with pytest.raises(TimeoutError):
+            appendToNavfile(navfile, navPts)
+    appendToNavfile(navfile, navPts)
+    assert len(openNavfile(navfile)) == len(nav) + len(coords)
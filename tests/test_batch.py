@@ -0,0 +1,178 @@
+import argparse
+import concurrent.futures
+import shutil
+import numpy as np
+import PIL.Image
+import semmatch.batch
+from semmatch.autodoc import openNavfile
+from semmatch.pipeline import Pipeline
+from semmatch.roi import Roi, rectangle
+
+
+def test_batch(tmp_path):
+    shutil.copy("MMM.jpg", tmp_path / "30-A.jpg")
+    shutil.copy("MMM.jpg", tmp_path / "58-A.jpg")
+    output = str(tmp_path / "out.nav")
+    semmatch.batch.main(
+        [
+            "--navfile",
+            "nav.nav",
+            "--image",
+            str(tmp_path / "{label}.jpg"),
+            "--maps",
+            "30-A",
+            "58-A",
+            "--template",
+            "T.jpg",
+            "--workers",
+            "2",
+            "-o",
+            output,
+        ]
+    )
+
+    newNav = openNavfile(output)
+    drawnIDs = [item["DrawnID"] for item in newNav.values()]
+    nav = openNavfile("nav.nav")
+    assert drawnIDs.count(nav["30-A"]["MapID"]) == len(drawnIDs) // 2
+    assert drawnIDs.count(nav["58-A"]["MapID"]) == len(drawnIDs) // 2
+    start = semmatch.batch.nextLabel(nav)
+    assert list(newNav) == [str(label) for label in range(start, start + len(newNav))]
+
+
+def test_batchPerMapOutput(tmp_path, capsys):
+    shutil.copy("MMM.jpg", tmp_path / "30-A.jpg")
+    shutil.copy("MMM.jpg", tmp_path / "58-A.jpg")
+    semmatch.batch.main(
+        [
+            "--navfile",
+            "nav.nav",
+            "--image",
+            str(tmp_path / "{label}.jpg"),
+            "--maps",
+            "30-A",
+            "58-A",
+            "--template",
+            "T.jpg",
+            "--workers",
+            "2",
+            "-o",
+            str(tmp_path / "{label}-pts.nav"),
+        ]
+    )
+
+    first = openNavfile(str(tmp_path / "30-A-pts.nav"))
+    second = openNavfile(str(tmp_path / "58-A-pts.nav"))
+    assert len(first) == len(second) > 0
+    assert not set(first) & set(second)
+    assert "2 maps in" in capsys.readouterr().out
+
+
+def test_batchReductionRoi(tmp_path):
+    # a map exported at half size, searched in a region given in map pixels
+    MMM = PIL.Image.open("MMM.jpg")
+    MMM.resize((MMM.width // 2, MMM.height // 2)).save(tmp_path / "30-A.jpg")
+    output = str(tmp_path / "out.nav")
+    semmatch.batch.main(
+        [
+            "--navfile",
+            "nav.nav",
+            "--image",
+            str(tmp_path / "{label}.jpg"),
+            "--maps",
+            "30-A",
+            "--template",
+            "T.jpg",
+            "--reduction",
+            "2",
+            "--threshold",
+            "0.5",
+            "--roi",
+            "1700,1000,2700,2000",
+            "-o",
+            output,
+        ]
+    )
+
+    nav = openNavfile(output)
+    coords = [item["CoordsInMap"].split()[:2] for item in nav.values()]
+    assert len(coords) > 0
+    assert (
+        Roi([rectangle(1700, 1000, 2700, 2000)]).contains(np.array(coords, float)).all()
+    )
+
+
+def test_batchSkipsFailedMaps(tmp_path, capsys):
+    shutil.copy("MMM.jpg", tmp_path / "30-A.jpg")
+    (tmp_path / "58-A.jpg").write_bytes(b"not a JPEG")
+    output = str(tmp_path / "out.nav")
+    semmatch.batch.main(
+        [
+            "--navfile",
+            "nav.nav",
+            "--image",
+            str(tmp_path / "{label}.jpg"),
+            "--maps",
+            "58-A",
+            "30-A",
+            "--template",
+            "T.jpg",
+            "--workers",
+            "2",
+            "-o",
+            output,
+        ]
+    )
+
+    out = capsys.readouterr().out
+    assert "58-A: decode failed" in out and "1 failed" in out
+    assert "skipped 1 maps that failed: 58-A" in out
+    newNav = openNavfile(output)
+    nav = openNavfile("nav.nav")
+    assert len(newNav) > 0
+    assert {item["DrawnID"] for item in newNav.values()} == {nav["30-A"]["MapID"]}
+
+
+def _detect(job, decoded):
+    if job == 2:
+        raise ValueError("bad map")
+    return decoded
+
+
+def test_pipelineErrors():
+    def group(job, detected):
+        if job == 3:
+            raise RuntimeError("no groups")
+        return detected
+
+    written = []
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        pipeline = Pipeline(
+            lambda job: job * 10,
+            _detect,
+            group,
+            lambda job, grouped: written.append(grouped),
+            pool,
+            onError=lambda job, stage, e: errors.append((job, stage, str(e))),
+        )
+        stats = pipeline.run(range(5))
+    assert written == [0, 10, 40]
+    assert errors == [(2, "detect", "bad map"), (3, "group", "no groups")]
+    assert stats["maps"] == 3 and stats["failed"] == 2
+
+
+def test_readTemplates():
+    args = argparse.Namespace(template="T.jpg", reduction=2.0)
+    jobs = [("30-A", "MMM.jpg", None), ("58-A", "MMM.mrc", None)]
+    # MRC maps are read unreduced, so they're searched with the template
+    # unreduced
+    assert semmatch.batch.mapReduction("MMM.mrc", args) == 1.0
+    assert semmatch.batch.mapReduction("MMM.jpg", args) == 2.0
+    templates = semmatch.batch.readTemplates(args, jobs)
+    assert sorted(templates) == [1.0, 2.0]
+    height, width = templates[1.0].shape[:2]
+    assert templates[2.0].shape[:2] == (round(height / 2), round(width / 2))
+    assert sorted(semmatch.batch.readTemplates(args, jobs[:1])) == [2.0]
+    args.template = "missing.jpg"
+    assert semmatch.batch.readTemplates(args, jobs) is None
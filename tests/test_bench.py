@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+import semmatch.bench
+
+
+def test_syntheticMaps():
+    image, template = semmatch.bench.holeLattice(512)
+    assert image.shape == (512, 512) and image.dtype == np.uint8
+    assert np.array_equal(semmatch.bench.holeLattice.__wrapped__(512)[0], image)
+    assert len(semmatch.bench.latticeCenters(512)) == 9
+    lacey = semmatch.bench.laceyTexture(512)
+    assert lacey.shape == (512, 512)
+    assert np.array_equal(semmatch.bench.laceyTexture.__wrapped__(512), lacey)
+
+
+def test_run(tmp_path, capsys):
+    output = str(tmp_path / "report.json")
+    semmatch.bench.main(
+        [
+            "--sizes",
+            "--only",
+            "groupPts/option[02]|Navfile|Autodoc",
+            "--repeat",
+            "2",
+            "--data",
+            ".",
+            "-o",
+            output,
+        ]
+    )
+    with open(output) as f:
+        report = json.load(f)
+    assert sorted(report["cases"]) == [
+        "createAutodoc/lattice-4096",
+        "groupPts/option0",
+        "groupPts/option2",
+        "openNavfile/nav.nav",
+    ]
+    case = report["cases"]["groupPts/option0"]
+    assert len(case["seconds"]) == 2 and case["min"] <= case["median"]
+    assert case["points"] == 625 and case["found"] == 1
+
+    # the cases on the test map need --data
+    report = semmatch.bench.run(sizes=(), only="MMM|Navfile|Autodoc", repeat=1)
+    assert report["cases"] == {
+        name: {"skipped": "no --data"}
+        for name in (
+            "templateMatch/MMM",
+            "houghCircles/MMM",
+            "laceySearch/MMM",
+            "anisodiff/MMM",
+            "openNavfile/nav.nav",
+            "createAutodoc/lattice-4096",
+        )
+    }
+    lines, _ = semmatch.bench.compare(report, report)
+    assert all("skipped in old" in line for line in lines)
+
+
+def test_compare(tmp_path, capsys):
+    old = {"environment": semmatch.bench.environment(), "cases": {}}
+    old["cases"] = {
+        "a": {"min": 1.0, "found": 5},
+        "b": {"min": 1.0},
+        "c": {"min": 1.0},
+    }
+    new = dict(old, cases={"a": {"min": 1.05, "found": 6}, "b": {"min": 2.0}})
+    lines, slower = semmatch.bench.compare(old, new, tolerance=0.1)
+    assert slower == ["b"]
+    assert "found 5 -> 6" in lines[0] and "SLOWER" in lines[1]
+    assert "only in old" in lines[2]
+
+    paths = []
+    for name, report in (("old", old), ("new", new)):
+        paths.append(str(tmp_path / (name + ".json")))
+        with open(paths[-1], "w") as f:
+            json.dump(report, f)
+    assert semmatch.bench.main(["compare"] + paths) == 0
+    assert semmatch.bench.main(["compare", "--check"] + paths) == 1
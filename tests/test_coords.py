@@ -0,0 +1,74 @@
+import numpy as np
+from semmatch.core import Pt, NavOptions
+from semmatch.autodoc import openNavfile, ptsToNavPts
+from semmatch.coords import (
+    NavPtsIndex,
+    mapPtsToStage,
+    stageToMapPts,
+    loadedMapScale,
+    skipExistingPts,
+    navPtsToStage,
+    setStageCoords,
+    writeSidecar,
+)
+
+
+def test_mapPtsToStage():
+    nav = openNavfile("nav.nav")
+    mapItem = nav["30-A"]
+    scale = loadedMapScale(mapItem, 3408)
+    assert scale == 4
+
+    # map corners land on the corners of the map's outline
+    corners = [(0, 0), (3408, 0), (3408, 3536), (0, 3536)]
+    outline = np.array(
+        [
+            [float(x) for x in mapItem["PtsX"].split()[:4]],
+            [float(y) for y in mapItem["PtsY"].split()[:4]],
+        ]
+    ).T
+    stagePts = mapPtsToStage(corners, mapItem, scale)
+    assert np.allclose(stagePts, outline, atol=0.05)
+    assert np.allclose(stageToMapPts(stagePts, mapItem, scale), corners)
+
+
+def test_skipExistingPts():
+    nav = openNavfile("nav.nav")
+    mapItem = nav["58-A"]
+    drawnOnMap = [
+        item for item in nav.values() if item.get("DrawnID") == mapItem["MapID"]
+    ]
+    stagePts = [[float(x) for x in item["StageXYZ"].split()[:2]] for item in drawnOnMap]
+    existingPts = [tuple(pt) for pt in stageToMapPts(stagePts[:5], mapItem)]
+    newPts = [(100.0, 100.0), (400.0, 300.0)]
+
+    index = NavPtsIndex(nav)
+    pts = skipExistingPts(existingPts + newPts, mapItem, index, 1, radius=0.5)
+    assert pts == newPts
+
+    # items that aren't drawn on 58-A only count with sameMapOnly=False
+    index.add(mapPtsToStage(newPts[:1], mapItem))
+    pts = skipExistingPts(newPts, mapItem, index, 1, radius=0.5)
+    assert pts == newPts
+    pts = skipExistingPts(newPts, mapItem, index, 1, radius=0.5, sameMapOnly=False)
+    assert pts == newPts[1:]
+
+
+def test_stageCoordsExport(tmp_path):
+    nav = openNavfile("nav.nav")
+    options = NavOptions(0, 7.0, 13, 10, 8, 1)
+    navPts = ptsToNavPts([Pt(1466, 1548), Pt(0, 0)], nav, "30-A", 9000, options)
+    assert navPts[0].CoordsInMap[:2] == [0, 0]
+    stagePts = navPtsToStage(navPts, nav["30-A"], 4)
+    assert np.allclose(stagePts[0], [236.927, 510.516], atol=0.05)
+
+    sidecar = str(tmp_path / "pts.npy")
+    writeSidecar(sidecar, navPts, stagePts)
+    table = np.load(sidecar)
+    assert list(table["label"]) == ["9000", "9001"]
+    assert np.allclose(table["stageX"], stagePts[:, 0])
+
+    setStageCoords(navPts, stagePts)
+    assert "CoordsInMap" not in str(navPts[0])
+    assert navPts[0].StageXYZ.endswith(" 31.9355")
+    assert navPts[0].PtsX == round(stagePts[0][0], 3)
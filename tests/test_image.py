@@ -0,0 +1,47 @@
+import numpy as np
+import PIL.Image
+
+# Qt is imported in the tests, so test_api can check the API doesn't need it
+
+
+def test_grayscaleRoundTrip():
+    from PyQt5.QtGui import QImage
+    from semmatch.image import npToQImage, qImgToNp
+
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    qimg = npToQImage(MMM)
+    assert qimg.format() == QImage.Format_Grayscale8
+    assert qimg.pixelColor(10, 20).red() == MMM[20, 10]
+
+    # no copies either way
+    view = qImgToNp(qimg)
+    assert np.shares_memory(view, MMM)
+    assert np.array_equal(view, MMM)
+    assert not view.flags.writeable
+
+
+def test_strides():
+    from semmatch.image import npToQImage, qImgToNp
+
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    # rows of a crop aren't contiguous; it's wrapped with the map's stride
+    crop = MMM[100:200, 300:450]
+    qimg = npToQImage(crop)
+    assert qimg.bytesPerLine() == MMM.shape[1]
+    assert np.array_equal(qImgToNp(qimg), crop)
+    assert np.array_equal(qImgToNp(qimg.copy()), crop)
+
+    rgba = np.dstack([crop, crop, crop, np.full_like(crop, 255)])
+    assert np.array_equal(qImgToNp(npToQImage(rgba)), rgba)
+
+
+def test_keepsAlive():
+    from PyQt5.QtGui import QImage
+    from semmatch.image import npToQImage, qImgToNp
+
+    view = qImgToNp(npToQImage(np.full((30, 40), 7, np.uint8)))
+    assert view.sum() == 7 * 30 * 40
+
+    qimg = QImage(40, 30, QImage.Format_ARGB32)
+    qimg.fill(0xFF102030)
+    assert qImgToNp(qimg)[0, 0].tolist() == [0x10, 0x20, 0x30, 0xFF]
@@ -0,0 +1,106 @@
+import argparse
+
+import numpy as np
+import PIL.Image
+import pytest
+import semmatch.__main__
+import semmatch.timing
+from semmatch.autodoc import openNavfile
+from semmatch.memory import estimateMemory, estimateSearch, peakRss
+from semmatch.timing import profiling, span
+from tests.test_mrc import writeMontage
+
+
+def test_tracedMemory():
+    with profiling(memory=True) as profile:
+        with span("outer"):
+            with span("allocate"):
+                block = np.ones(10 * 2**20, np.uint8)
+                del block
+            with span("small"):
+                np.ones(1000)
+    outer = profile.toDict()["children"][0]
+    allocate, small = outer["children"]
+    assert 10 * 2**20 <= allocate["peakMemory"] < 11 * 2**20
+    assert small["peakMemory"] < 2**20
+    assert outer["peakMemory"] >= allocate["peakMemory"]
+    assert 0 < allocate["peakRss"] <= peakRss()
+
+
+def test_tracedMemoryWithoutResetPeak(monkeypatch):
+    # Python before 3.9 can't reset the peak; spans get an upper bound
+    monkeypatch.setattr(semmatch.timing, "_resetPeak", lambda: None)
+    with profiling(memory=True) as profile:
+        with span("allocate"):
+            block = np.ones(10 * 2**20, np.uint8)
+            del block
+        with span("small"):
+            np.ones(1000)
+    allocate, small = profile.toDict()["children"]
+    assert 10 * 2**20 <= allocate["peakMemory"] < 11 * 2**20
+    assert small["peakMemory"] > 2**20
+
+
+def test_estimateMemory():
+    args = argparse.Namespace(
+        houghCircles=False, laceySearch=False, gui=False, roi=None
+    )
+    mapItem = openNavfile("nav.nav")["30-A"]
+    template = np.array(PIL.Image.open("T.jpg"))
+    height, width = np.array(PIL.Image.open("MMM.jpg")).shape
+    needed = estimateMemory("MMM.jpg", mapItem, template, 13, args)
+    assert needed == estimateSearch((height, width), "template", 1)
+    args.roi = [[(0, 0), (99, 0), (99, 99)]]
+    assert estimateMemory("MMM.jpg", mapItem, template, 13, args) < needed
+
+
+def _run(tmp_path, navfile, image, maxMemory, template="T.jpg"):
+    output = str(tmp_path / "out.nav")
+    semmatch.__main__.main(
+        [
+            "--navfile",
+            navfile,
+            "--mapLabel",
+            "30-A",
+            "--newLabel",
+            "9000",
+            "--pixelSize",
+            "13",
+            "--template",
+            template,
+            "-o",
+            output,
+            "--maxMemory",
+            maxMemory,
+        ]
+        + image
+    )
+    nav = openNavfile(output)
+    return np.array([item["CoordsInMap"].split()[:2] for item in nav.values()], float)
+
+
+def test_maxMemory(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        _run(tmp_path, "nav.nav", ["--image", "MMM.jpg"], "0.01")
+    assert "aborting" in capsys.readouterr().out
+    assert openNavfile(str(tmp_path / "out.nav")) == {}
+
+    # a missing template is reported before the memory is estimated
+    with pytest.raises(SystemExit):
+        _run(tmp_path, "nav.nav", ["--image", "MMM.jpg"], "0.01", "missing.jpg")
+    assert "non-gui option must specify template" in capsys.readouterr().out
+
+    # montage MRC maps are searched piece by piece instead
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    writeMontage(str(tmp_path / "MMM.mrc"), MMM, 20, (1822, 1754))
+    with open("nav.nav") as f:
+        navData = f.read()
+    navfile = str(tmp_path / "nav.nav")
+    with open(navfile, "w") as f:
+        f.write(navData.replace("MapMinMaxScale = 20 7295", "MapMinMaxScale = 20 2570"))
+    whole = _run(tmp_path, navfile, [], "0")
+    pieces = _run(tmp_path, navfile, [], "0.01")
+    assert "piece by piece" in capsys.readouterr().out
+    assert len(whole) == len(pieces) > 0
+    distances = np.linalg.norm(whole[:, None] - pieces[None], axis=2)
+    assert distances.min(axis=1).max() <= 2 * np.sqrt(2)
@@ -0,0 +1,164 @@
+import shutil
+import numpy as np
+import PIL.Image
+import semmatch.__main__
+from semmatch.autodoc import openNavfile
+from semmatch.mrc import readMap
+
+
+def writeMontage(path, image, section, pieceSize):
+    """Write image as a 2x2 montage of overlapping 16-bit pieces, the way
+    SerialEM does, with values 10 * pixel + 20."""
+    height, width = image.shape
+    ny, nx = pieceSize
+    pieces = []
+    coords = []
+    for x in (0, width - nx):
+        for y in (0, height - ny):
+            # y of piece coordinates counts from the bottom
+            top = height - y - ny
+            piece = image[top : top + ny, x : x + nx].astype(np.uint16) * 10 + 20
+            pieces.append(piece[::-1])
+            coords.append((x, y, section))
+
+    header = np.zeros(256, np.int32)
+    header[:4] = (nx, ny, len(pieces), 6)
+    header[23] = 6 * len(pieces)
+    header = header.view(np.uint8)
+    header[104:108] = np.frombuffer(b"SERI", np.uint8)
+    header[128:132] = np.array([6, 2], np.int16).view(np.uint8)
+    header[212:214] = 0x44
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(np.array(coords, np.int16).tobytes())
+        f.write(np.array(pieces).tobytes())
+
+
+def test_readMap(tmp_path):
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    mapItem = openNavfile("nav.nav")["30-A"]
+    mrcfile = str(tmp_path / "MMM.mrc")
+    writeMontage(mrcfile, MMM, int(mapItem["MapSection"]), (1822, 1754))
+
+    mapItem = dict(mapItem, MapMinMaxScale="20 2570")
+    assert np.array_equal(readMap(mrcfile, mapItem), MMM)
+
+
+def test_mapFileInput(tmp_path):
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    with open("nav.nav") as f:
+        navData = f.read()
+    # the map is found by name next to the navigator
+    with open(tmp_path / "nav.nav", "w") as f:
+        f.write(navData.replace("MapMinMaxScale = 20 7295", "MapMinMaxScale = 20 2570"))
+    writeMontage(str(tmp_path / "MMM.mrc"), MMM, 20, (1822, 1754))
+    shutil.copy("MMM.jpg", tmp_path / "MMM.jpg")
+
+    outputs = []
+    for image in ([], ["--image", str(tmp_path / "MMM.jpg")]):
+        output = str(tmp_path / ("out%d.nav" % len(outputs)))
+        semmatch.__main__.main(
+            [
+                "--navfile",
+                str(tmp_path / "nav.nav"),
+                "--mapLabel",
+                "30-A",
+                "--newLabel",
+                "9000",
+                "--pixelSize",
+                "13",
+                "--template",
+                "T.jpg",
+                "-o",
+                output,
+            ]
+            + image
+        )
+        with open(output) as f:
+            outputs.append(f.read())
+    assert outputs[0] == outputs[1]
+    assert "[Item = 9000]" in outputs[0]
+
+
+def test_pieces(tmp_path):
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    writeMontage(str(tmp_path / "MMM.mrc"), MMM, 20, (1822, 1754))
+    with open("nav.nav") as f:
+        navData = f.read()
+    with open(tmp_path / "nav.nav", "w") as f:
+        f.write(navData.replace("MapMinMaxScale = 20 7295", "MapMinMaxScale = 20 2570"))
+
+    outputs = []
+    for pieces in ([], ["--pieces", "--workers", "2"]):
+        output = str(tmp_path / ("out%d.nav" % len(outputs)))
+        semmatch.__main__.main(
+            [
+                "--navfile",
+                str(tmp_path / "nav.nav"),
+                "--mapLabel",
+                "30-A",
+                "--newLabel",
+                "9000",
+                "--pixelSize",
+                "13",
+                "--template",
+                "T.jpg",
+                "-o",
+                output,
+            ]
+            + pieces
+        )
+        nav = openNavfile(output)
+        coords = [item["CoordsInMap"].split()[:2] for item in nav.values()]
+        outputs.append(np.array(coords, dtype=float))
+
+    # same points, up to round off in the correlation of smaller images; the
+    # template is matched at pyramid level 1, so that's a pixel there
+    whole, pieces = outputs
+    assert len(whole) == len(pieces) > 0
+    distances = np.linalg.norm(whole[:, None] - pieces[None], axis=2)
+    assert distances.min(axis=1).max() <= 2 * np.sqrt(2)
+
+
+def test_laceyPieces(tmp_path):
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    writeMontage(str(tmp_path / "MMM.mrc"), MMM, 20, (1822, 1754))
+    with open("nav.nav") as f:
+        navData = f.read()
+    with open(tmp_path / "nav.nav", "w") as f:
+        f.write(navData.replace("MapMinMaxScale = 20 7295", "MapMinMaxScale = 20 2570"))
+
+    outputs = []
+    for pieces in ([], ["--pieces"], ["--pieces"]):
+        output = str(tmp_path / ("out%d.nav" % len(outputs)))
+        semmatch.__main__.main(
+            [
+                "--navfile",
+                str(tmp_path / "nav.nav"),
+                "--mapLabel",
+                "30-A",
+                "--newLabel",
+                "9000",
+                "--pixelSize",
+                "13",
+                "--laceySearch",
+                "--maxPts",
+                "20",
+                "--workers",
+                "2",
+                "-o",
+                output,
+            ]
+            + pieces
+        )
+        nav = openNavfile(output)
+        coords = [item["CoordsInMap"].split()[:2] for item in nav.values()]
+        outputs.append(np.array(coords, dtype=float))
+
+    # the largest holes of the whole map, every time; a few segments cut by
+    # the edges of the tiles differ
+    whole, pieces, again = outputs
+    assert np.array_equal(pieces, again)
+    assert len(whole) == len(pieces) == 20
+    distances = np.linalg.norm(whole[:, None] - pieces[None], axis=2)
+    assert (distances.min(axis=1) <= 2).sum() >= 15
@@ -0,0 +1,53 @@
+import collections
+import json
+
+from semmatch.autodoc import openNavfile
+import semmatch.navscaling
+
+
+def test_syntheticNav(tmp_path):
+    navfile = str(tmp_path / "synthetic.nav")
+    mapLabel = semmatch.navscaling.writeSyntheticNav(navfile, 120)
+    with open(navfile, "rb") as f:
+        assert f.read().count(b"\r\n") > 120 * 10
+    nav = openNavfile(navfile)
+    assert len(nav) == 120 and list(nav)[:5] == ["1-A", "2", "3", "4", "5-1"]
+    assert mapLabel == "19-A" and nav[mapLabel]["Type"] == "2"
+    types = collections.Counter(item["Type"] for item in nav.values())
+    assert types == {"2": 3, "1": 3, "0": 114}
+    assert sum("RegPt" in item for item in nav.values()) == 6
+    # every item drawn on a map, with MapIDs unique across the navigator
+    mapIDs = {item["MapID"] for item in nav.values()}
+    assert len(mapIDs) == 120
+    assert all(
+        item["DrawnID"] in mapIDs for item in nav.values() if item["Type"] != "2"
+    )
+    assert len(nav["5-1"]["PtsX"].split()) == 1 and nav["5-1"]["Acquire"] == "1"
+    assert int(nav["4"]["NumPts"]) == len(nav["4"]["PtsX"].split()) == 10
+    assert list(semmatch.navscaling.syntheticNavItems(120)) == list(
+        semmatch.navscaling.syntheticNavItems(120)
+    )
+
+
+def test_run(tmp_path, capsys):
+    output = str(tmp_path / "nav.json")
+    semmatch.navscaling.main(["--sizes", "100", "300", "--repeat", "2", "-o", output])
+    with open(output) as f:
+        report = json.load(f)
+    assert sorted(report["cases"]) == [
+        "appendToNavfile/items-100",
+        "appendToNavfile/items-300",
+        "createAutodoc/points-100",
+        "createAutodoc/points-300",
+        "lookup/items-100",
+        "lookup/items-300",
+        "openNavfile/items-100",
+        "openNavfile/items-300",
+    ]
+    case = report["cases"]["openNavfile/items-300"]
+    assert case["items"] == 300 and len(case["seconds"]) == 2
+    assert case["itemsPerSecond"] == 300 / case["min"]
+    assert case["peakMemory"] > case["bytes"]
+    case = report["cases"]["appendToNavfile/items-100"]
+    assert case["points"] == semmatch.navscaling.APPEND_PTS
+    assert "items/s" in capsys.readouterr().out
@@ -0,0 +1,38 @@
+import argparse
+import numpy as np
+import PIL.Image
+from semmatch.__main__ import findPts
+from semmatch.core import templateMatch
+from semmatch.pyramid import ImagePyramid, templateLevel, toBase
+
+
+def test_levels():
+    image = np.arange(7 * 5, dtype=np.uint8).reshape(7, 5)
+    pyramid = ImagePyramid(image)
+    level1 = pyramid.level(1)
+    assert level1.shape == (3, 2)
+    # the top row is dropped so the bottom-left corners line up
+    assert level1[-1, 0] == round(image[5:7, 0:2].mean())
+    # a pixel's center maps to the center of its 2x2 block
+    assert toBase([(0, 0), (1, 2)], 2) == [(0, 0), (2, 4)]
+
+
+def test_templateLevel():
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    template = np.array(PIL.Image.open("T.jpg"))
+    assert templateLevel(template) == 1
+
+    args = argparse.Namespace(
+        houghCircles=False,
+        laceySearch=False,
+        threshold=0.8,
+        noBlurImage=False,
+        noBlurTemplate=False,
+    )
+    pts = np.array(findPts(MMM, template, 13, args))
+    full = np.array(
+        templateMatch(MMM, template, 0.8, blurImage=True, blurTemplate=True)
+    )
+    distances = np.linalg.norm(pts[:, None] - full[None], axis=2)
+    assert len(pts) == len(full)
+    assert distances.min(axis=1).max() <= 3
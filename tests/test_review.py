@@ -0,0 +1,60 @@
+import argparse
+import concurrent.futures
+import time
+import numpy as np
+import PIL.Image
+from semmatch.autodoc import openNavfile
+from semmatch.batch import _initWorker
+from semmatch.core import templateMatches
+from semmatch.review import Prefetcher, _prefetchMap
+
+
+def test_prefetcher():
+    jobs = [(str(i), None, None) for i in range(5)]
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        maps = Prefetcher(jobs, pool, lambda job: int(job[0]) * 10, ahead=2)
+        assert len(maps) == 5
+        while maps.poll(0) is None:
+            pass
+        assert sorted(maps.futures) == [0, 1, 2]
+        while maps.poll(3) is None:
+            pass
+        assert maps.poll(3) == 30
+        # earlier maps are dropped, the next ones queued up to the last
+        assert sorted(maps.futures) == [3, 4]
+
+    # maps queued behind a slow one are cancelled, not searched
+    started = []
+
+    def search(job):
+        started.append(job[0])
+        time.sleep(0.2)
+
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        maps = Prefetcher(jobs, pool, search, ahead=2)
+        maps.poll(0)
+        while not started:
+            time.sleep(0.01)
+        maps.cancel()
+    assert started == ["0"] and not maps.futures
+
+
+def test_prefetchMap():
+    template = np.array(PIL.Image.open("T.jpg"))
+    _initWorker({1.0: template})
+    args = argparse.Namespace(
+        pixelSize=None,
+        houghCircles=False,
+        laceySearch=False,
+        noBlurImage=False,
+        noBlurTemplate=True,
+        roi=None,
+        reduction=1.0,
+    )
+    mapItem = openNavfile("nav.nav")["30-A"]
+    prefetched = _prefetchMap(("30-A", "MMM.jpg", mapItem), args, 0.001)
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    assert np.array_equal(prefetched.image, MMM)
+    assert prefetched.pixelSize > 0
+    matches = templateMatches(MMM, template, 0.001, blurImage=True)
+    assert prefetched.matches.above(0.5) == matches.above(0.5)
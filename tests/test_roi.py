@@ -0,0 +1,71 @@
+import numpy as np
+import PIL.Image
+import semmatch.__main__
+from semmatch.autodoc import openNavfile
+from semmatch.core import templateMatch
+from semmatch.roi import Roi, parseRoi, rectangle
+
+
+def test_contains():
+    # an L shape, so a point in its bounding box can still be outside
+    roi = Roi([[(0, 0), (4, 0), (4, 1), (1, 1), (1, 4), (0, 4)]])
+    assert roi.contains(
+        [(0.5, 0.5), (3, 0.5), (0.5, 3), (3, 3), (5, 0.5)]
+    ).tolist() == [
+        True,
+        True,
+        True,
+        False,
+        False,
+    ]
+    assert parseRoi("1,2,3,4") == rectangle(1, 2, 3, 4)
+    assert parseRoi("0,0 4,0 0,4") == [(0, 0), (4, 0), (0, 4)]
+
+
+def test_templateMatchRoi():
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    template = np.array(PIL.Image.open("T.jpg"))
+    full = templateMatch(MMM, template, 0.3, blurTemplate=True)
+    for polygon in (
+        rectangle(1700, 1000, 2700, 2000),
+        [(1700, 1000), (2900, 1100), (2200, 2200)],
+    ):
+        roi = Roi([polygon])
+        inside = [pt for pt, keep in zip(full, roi.contains(full)) if keep]
+        assert 0 < len(inside) < len(full)
+        assert (
+            templateMatch(MMM, template, 0.3, blurTemplate=True, roi=[polygon])
+            == inside
+        )
+
+
+def test_roiOption(tmp_path):
+    output = str(tmp_path / "out.nav")
+    semmatch.__main__.main(
+        [
+            "--navfile",
+            "nav.nav",
+            "--mapLabel",
+            "30-A",
+            "--newLabel",
+            "9000",
+            "--pixelSize",
+            "13",
+            "--image",
+            "MMM.jpg",
+            "--template",
+            "T.jpg",
+            "--threshold",
+            "0.5",
+            "--roi",
+            "1700,1000,2700,2000",
+            "-o",
+            output,
+        ]
+    )
+    nav = openNavfile(output)
+    coords = [item["CoordsInMap"].split()[:2] for item in nav.values()]
+    assert len(coords) > 0
+    assert (
+        Roi([rectangle(1700, 1000, 2700, 2000)]).contains(np.array(coords, float)).all()
+    )
@@ -0,0 +1,69 @@
+import json
+
+import semmatch.bench
+import semmatch.scaling
+
+
+def test_pointSet():
+    for kind in semmatch.scaling.KINDS:
+        pts = semmatch.scaling.pointSet(kind, 300)
+        assert len(pts) == len(set(pts)) == 300
+        assert pts == semmatch.scaling.pointSet(kind, 300)
+        assert min(min(pt) for pt in pts) >= 0
+    lattice = semmatch.scaling.pointSet("lattice", 4)
+    pitch = semmatch.bench.HOLE_PITCH
+    assert [tuple(pt) for pt in lattice] == [
+        (pitch // 2, pitch // 2),
+        (pitch * 3 // 2, pitch // 2),
+        (pitch // 2, pitch * 3 // 2),
+        (pitch * 3 // 2, pitch * 3 // 2),
+    ]
+    assert semmatch.scaling.tourLength([lattice[:2], lattice[2:]]) == (
+        pitch + (pitch**2 * 2) ** 0.5 + pitch
+    )
+
+
+def test_run(tmp_path, capsys):
+    output = str(tmp_path / "groups.json")
+    semmatch.scaling.main(
+        ["--sizes", "10", "100", "--options", "0", "4", "--repeat", "2", "-o", output]
+    )
+    with open(output) as f:
+        report = json.load(f)
+    assert len(report["cases"]) == 2 * 3 * 2
+    case = report["cases"]["groupPts/option0/lattice-100"]
+    assert case["points"] == 100 and len(case["seconds"]) == 2
+    # option 0 acquires every point from one position, in path order
+    assert case["groups"] == 1 and case["largestGroup"] == 100
+    assert 1 <= case["tourPerPoint"] < 2
+    case = report["cases"]["groupPts/option4/lattice-100"]
+    assert case["groups"] > 1 and case["largestGroup"] < 100
+    assert set(report["exponents"]) == {
+        "option%d/%s" % (option, kind)
+        for option in (0, 4)
+        for kind in semmatch.scaling.KINDS
+    }
+    out = capsys.readouterr().out
+    assert "exponent" in out and "option0 lattice" in out
+
+    # a longer tour is flagged like a slower case
+    worse = json.loads(json.dumps(report))
+    worse["cases"]["groupPts/option0/lattice-100"]["tourLength"] *= 2
+    lines, flagged = semmatch.bench.compare(report, worse)
+    assert flagged == ["groupPts/option0/lattice-100"]
+    assert any("LONGER tour x2.00" in line for line in lines)
+
+
+def test_budget():
+    report = semmatch.scaling.run(
+        sizes=(10, 100, 1000), groupOptions=(0,), kinds=("uniform",), budget=0
+    )
+    cases = report["cases"]
+    assert len(cases["groupPts/option0/uniform-10"]["seconds"]) == 1
+    assert cases["groupPts/option0/uniform-100"] == {
+        "points": 100,
+        "skipped": "over budget",
+    }
+    assert report["exponents"] == {"option0/uniform": None}
+    lines, _ = semmatch.bench.compare(report, report)
+    assert "skipped in old" in lines[1]
@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+from multiprocessing.connection import AuthenticationError, Client
+
+import pytest
+import semmatch.server
+from semmatch.autodoc import openNavfile
+
+
+def _loadedModules():
+    return {name for name in ("cv2", "scipy", "sklearn") if name in sys.modules}
+
+
+def test_warmUp(tmp_path, monkeypatch):
+    monkeypatch.setattr(semmatch.server, "STATE_DIR", str(tmp_path / "state"))
+    with semmatch.server.Server(semmatch.server.defaultAddress(), workers=1) as server:
+        # the detectors' dependencies are loaded before the first request
+        assert server.pool.submit(_loadedModules).result() == {
+            "cv2",
+            "scipy",
+            "sklearn",
+        }
+
+
+def test_client(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(semmatch.server, "STATE_DIR", str(tmp_path / "state"))
+    output = str(tmp_path / "out.nav")
+    argv = [
+        "--navfile",
+        "nav.nav",
+        "--image",
+        "MMM.jpg",
+        "--template",
+        "T.jpg",
+        "--mapLabel",
+        "30-A",
+        "--newLabel",
+        "9000",
+        "--pixelSize",
+        "13",
+        "-o",
+        output,
+    ]
+    address = semmatch.server.defaultAddress()
+    with semmatch.server.Server(address, workers=1) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        if os.name != "nt":
+            assert os.stat(semmatch.server.keyPath()).st_mode & 0o077 == 0
+            assert os.stat(tmp_path / "state").st_mode & 0o077 == 0
+
+        assert semmatch.server.client(argv, address) == 0
+        assert "%s created" % output in capsys.readouterr().out
+        assert len(openNavfile(output)) > 0
+
+        assert semmatch.server.client(argv[:2], address) == 2
+        assert "required" in capsys.readouterr().out
+
+        # connections without the key are dropped, and the server goes on
+        with pytest.raises(AuthenticationError):
+            Client(address, authkey=b"not the key")
+        assert semmatch.server.client(argv[:2], address) == 2
+
+        with pytest.raises(OSError, match="already listening"):
+            semmatch.server.Server(address, workers=1)
+        server.shutdown()
+        thread.join(10)
+        assert not thread.is_alive()
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+
+def test_lazyImports():
+    # loading the navigator tools must not pull in any detector's dependencies
+    code = (
+        "import sys, semmatch.__main__, semmatch.core, semmatch.autodoc, "
+        "semmatch.groups, semmatch.coords; "
+        "print(' '.join(m for m in ('cv2', 'scipy', 'skimage', 'sklearn', 'PIL') "
+        "if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True
+    )
+    assert result.stdout.strip() == ""
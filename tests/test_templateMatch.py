@@ -1,8 +1,9 @@
+import os
 import numpy as np
-import PIL
+import PIL.Image
 from scipy.ndimage import gaussian_filter
-from semmatch.core import templateMatch, Pt, NavOptions
-from semmatch.autodoc import ptsToNavPts, openNavfile
+from semmatch.core import templateMatch, templateMatches, Pt, NavOptions
+from semmatch.autodoc import createAutodoc, ptsToNavPts, openNavfile
 
 
 def test_templateMatch():
@@ -29,6 +30,14 @@ def test_templateMatch():
     ]
 
 
+def test_templateMatchesAbove():
+    MMM = np.array(PIL.Image.open("MMM.jpg"))
+    template = np.array(PIL.Image.open("T.jpg"))
+    matches = templateMatches(MMM, template, minScore=0.2)
+    for threshold in (0.2, 0.3, 0.5, 0.8, 0.95):
+        assert matches.above(threshold) == templateMatch(MMM, template, threshold)
+
+
 def test_writeToNavFile():
     coords = [
         (2149, 1904),
@@ -56,11 +65,13 @@ def test_writeToNavFile():
         acquire=1,
     )
     navPts = ptsToNavPts(coords, nav, mapID, startLabel=9000, options=options)
-    newNavData = "AdocVersion = 2.00\n\n" + "".join(str(pt) for pt in navPts)
-    with open("newNav.nav", "w") as f:
-        f.write(newNavData)
+    createAutodoc("newNav.nav", navPts)
 
+    with open("newNav.nav") as f:
+        newNavData = f.read()
     with open("newNav_validate.nav") as f:
         validationData = f.read()
 
     assert validationData == newNavData
+    assert newNavData == "AdocVersion = 2.00\n\n" + "".join(str(pt) for pt in navPts)
+    assert not [f for f in os.listdir(".") if f.endswith(".tmp")]
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+import semmatch.__main__
+from semmatch.timing import addSpans, profiledRun, profiling, span, timed
+
+
+@timed
+def _stage(n):
+    for _ in range(n):
+        with span("step"):
+            pass
+    return n
+
+
+def test_spans():
+    # nothing is recorded outside profiling()
+    assert _stage(2) == 2
+    with profiling() as profile:
+        with span("outer"):
+            _stage(3)
+            _stage(1)
+        addSpans({"name": "worker", "seconds": 2.0, "calls": 1})
+    tree = profile.toDict()
+    assert tree["name"] == "run" and tree["calls"] == 1
+    outer, worker = tree["children"]
+    assert worker == {"name": "worker", "seconds": 2.0, "calls": 1}
+    stage = outer["children"][0]
+    assert (stage["name"], stage["calls"]) == ("_stage", 2)
+    assert stage["children"][0]["calls"] == 4
+    assert outer["seconds"] >= stage["seconds"] >= stage["children"][0]["seconds"]
+
+
+def test_profiledRun(tmp_path):
+    path = str(tmp_path / "profile.json")
+    with pytest.raises(SystemExit):
+        with profiledRun(path, str(tmp_path / "run.pstats"), mapLabel="30-A"):
+            _stage(1)
+            exit()
+    with open(path) as f:
+        report = json.load(f)
+    assert report["mapLabel"] == "30-A"
+    assert report["spans"]["children"][0]["name"] == "_stage"
+    assert (tmp_path / "run.pstats").exists()
+
+
+def test_profileOption(tmp_path):
+    path = str(tmp_path / "profile.json")
+    semmatch.__main__.main(
+        [
+            "--navfile",
+            "nav.nav",
+            "--mapLabel",
+            "30-A",
+            "--image",
+            "MMM.jpg",
+            "--newLabel",
+            "9000",
+            "--pixelSize",
+            "13",
+            "--template",
+            "T.jpg",
+            "-o",
+            str(tmp_path / "out.nav"),
+            "--profile",
+            path,
+        ]
+    )
+    with open(path) as f:
+        spans = json.load(f)["spans"]
+    stages = [child["name"] for child in spans["children"]]
+    assert stages == [
+        "openNavfile",
+        "readTemplate",
+        "readImage",
+        "findPts",
+        "ptsToNavPts",
+        "createAutodoc",
+    ]
+    search = spans["children"][3]["children"][-1]
+    assert search["name"] == "templateMatches"
+    assert "matchTemplate" in [child["name"] for child in search["children"]]
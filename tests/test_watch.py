@@ -0,0 +1,37 @@
+import json
+import shutil
+import semmatch.watch
+
+
+def test_watch(tmp_path):
+    for name in ("nav.nav", "MMM.jpg", "T.jpg"):
+        shutil.copy(name, tmp_path / name)
+    defaults = {"navfile": "nav.nav", "template": "T.jpg", "pixelSize": 13}
+    (tmp_path / "defaults.json").write_text(json.dumps(defaults))
+    job = {"mapLabel": "30-A", "image": "MMM.jpg", "newLabel": 9000}
+    (tmp_path / "30-A.json").write_text(json.dumps(job))
+    (tmp_path / "bad.json").write_text(json.dumps({"image": "MMM.jpg"}))
+
+    (tmp_path / "aborted.json").write_text(json.dumps({"mapLabel": "missing"}))
+    # with --images, an image of its own is a job, named like 30-A.json
+    shutil.copy("MMM.jpg", tmp_path / "30-A.jpg")
+
+    semmatch.watch.main([str(tmp_path), "--once", "--workers", "2", "--images"])
+
+    results = tmp_path / "results"
+    status = json.loads((results / "30-A.json.status.json").read_text())
+    assert status["state"] == "done" and status["points"] > 0
+    assert (results / "30-A.json.nav").read_text().count("[Item") == status["points"]
+    status = json.loads((results / "30-A.jpg.status.json").read_text())
+    assert status["state"] == "done" and status["points"] > 0
+    status = json.loads((results / "bad.json.status.json").read_text())
+    assert status["state"] == "failed" and status["points"] == 0
+    status = json.loads((results / "aborted.json.status.json").read_text())
+    assert status["state"] == "aborted" and status["points"] == 0
+    # the map image and template of the JSON jobs aren't jobs
+    assert sorted(path.name for path in results.glob("*.status.json")) == [
+        "30-A.jpg.status.json",
+        "30-A.json.status.json",
+        "aborted.json.status.json",
+        "bad.json.status.json",
+    ]